@@ -0,0 +1,196 @@
+import json, time, tracemalloc, tempfile, subprocess, platform, statistics
+import argparse, sys, os
+import pandas as pd
+import make_catalog3
+import parse_aliquot
+import synthetic_data
+
+# Benchmark make_catalog3.py and parse_aliquot.py on synthetic data
+#
+# For each data set size (number of submitted files in the project), a synthetic project is generated with
+# synthetic_data.py and the following are timed:
+# * parse_YAML for CPTAC and TCGA sample responses of all cases
+# * read_reads_file of submitted and harmonized reads of all cases
+# * steps of generate_catalog: get_data_variety_RNA_BAM, get_data_variety_FASTQ, get_aliquot_tag, get_sample_ids,
+#   get_sample_code, get_dataset_name, get_metadata_json, as well as generate_catalog overall
+# * the final merge of reads and aliquots
+# * write_catalog
+#
+# Each phase is timed REPEAT times and the fastest is reported.  Peak memory allocated during each phase is measured
+# with tracemalloc in a separate run, since tracing slows allocation.
+#
+# Results are appended as JSON lines to the output file, one line per size and phase, along with the git commit.
+# Two result files can be compared with --compare:
+#     python src/benchmark.py -o before.jsonl
+#     ... (change code)
+#     python src/benchmark.py -o after.jsonl
+#     python src/benchmark.py --compare before.jsonl after.jsonl
+
+SIZES = "60,1000,10000,100000"
+FILES_PER_CASE = 60
+# Steps of generate_catalog timed by wrapping module functions
+CATALOG_STEPS = ["get_data_variety_RNA_BAM", "get_data_variety_FASTQ", "get_aliquot_tag", "get_sample_ids", "get_sample_code",
+    "get_dataset_name", "get_metadata_json"]
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# Write project-level input files to D: aliquots.dat, reads.dat (submitted and harmonized reads of all cases),
+# and sample responses sample-CPTAC.json and sample-TCGA.json with samples of all cases in one response.
+# Returns number of read rows
+def write_inputs(d, n_files, files_per_case, seed):
+    n_cases = max(1, round(n_files / files_per_case))
+    files_per_case = max(1, n_files // n_cases)
+    samples = {"CPTAC": [], "TCGA": []}
+    n_rows = 0
+    with open(os.path.join(d, "aliquots.dat"), 'w') as af, open(os.path.join(d, "reads.dat"), 'w') as rf:
+        af.write("\t".join(parse_aliquot.get_header("case")) + "\n")
+        for i in range(n_cases):
+            c = synthetic_data.make_case("SYN-%05d" % i, files_per_case, seed)
+            for line in synthetic_data.aliquot_lines(c):
+                af.write(line + "\n")
+            for line in synthetic_data.submitted_lines(c) + synthetic_data.harmonized_lines(c):
+                rf.write(line + "\n")
+                n_rows += 1
+            for data_model in samples:
+                samples[data_model] += synthetic_data.sample_response(c, data_model)["data"]["sample"]
+    for data_model in samples:
+        with open(os.path.join(d, "sample-%s.json" % data_model), 'w') as f:
+            json.dump({"data": {"sample": samples[data_model]}}, f)
+    return n_cases, n_rows
+
+class Benchmark:
+    def __init__(self, repeat=3, trace=False):
+        self.repeat = repeat
+        self.trace = trace
+        self.times = {}
+        self.peaks = {}
+
+    # Call func(*args), recording its time and, if tracing, its peak memory under PHASE
+    def run(self, phase, func, *args, **kwargs):
+        if self.trace:
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        result = func(*args, **kwargs)
+        t = time.perf_counter() - t
+        if self.trace:
+            peak = tracemalloc.get_traced_memory()[1] - start
+            self.peaks[phase] = max(self.peaks.get(phase, 0), peak)
+        self.times.setdefault(phase, []).append(t)
+        return result
+
+    # Replace module function NAME with one which records its time
+    def wrap(self, module, name):
+        func = getattr(module, name)
+        def timed(*args, **kwargs):
+            return self.run(name, func, *args, **kwargs)
+        setattr(module, name, timed)
+        return func
+
+def run_once(bm, d):
+    for data_model in ["CPTAC", "TCGA"]:
+        bm.run("parse_YAML_" + data_model, parse_aliquot.parse_YAML, os.path.join(d, "sample-%s.json" % data_model),
+            os.path.join(d, "aliquots-%s.out" % data_model), "SYN", data_model)
+
+    reads_fn = os.path.join(d, "reads.dat")
+    aliquots = make_catalog3.read_aliquots(os.path.join(d, "aliquots.dat"))
+    read_data = bm.run("read_reads_file", make_catalog3.read_reads_file, reads_fn)
+
+    originals = {name: bm.wrap(make_catalog3, name) for name in CATALOG_STEPS}
+    try:
+        catalog_data = bm.run("generate_catalog", make_catalog3.generate_catalog, read_data, aliquots, False)
+    finally:
+        for name, func in originals.items():
+            setattr(make_catalog3, name, func)
+
+    # generate_catalog modifies read_data in place, so it is ready for merge
+    prepared = make_catalog3.prepare_aliquots(aliquots)
+    bm.run("merge", read_data.merge, prepared, on=['aliquot_submitter_id', 'case'])
+
+    with open(os.devnull, 'w') as null:
+        stdout, sys.stdout = sys.stdout, null
+        try:
+            bm.run("write_catalog", make_catalog3.write_catalog, os.path.join(d, "catalog3.out"), catalog_data, "CCRCC", "SYN")
+        finally:
+            sys.stdout = stdout
+
+def run_size(n_files, files_per_case, repeat, seed, workd=None):
+    with tempfile.TemporaryDirectory(dir=workd) as d:
+        t = time.perf_counter()
+        n_cases, n_rows = write_inputs(d, n_files, files_per_case, seed)
+        eprint("Generated {} cases, {} read rows in {:.1f}s".format(n_cases, n_rows, time.perf_counter() - t))
+
+        bm = Benchmark(repeat)
+        for i in range(repeat):
+            run_once(bm, d)
+
+        tracer = Benchmark(1, trace=True)
+        tracemalloc.start()
+        try:
+            run_once(tracer, d)
+        finally:
+            tracemalloc.stop()
+
+    records = []
+    for phase, times in bm.times.items():
+        records.append({"files": n_files, "cases": n_cases, "rows": n_rows, "phase": phase, "seconds": min(times),
+            "median": statistics.median(times), "repeat": len(times), "peak_bytes": tracer.peaks.get(phase)})
+    return records
+
+def read_results(fn):
+    results = {}
+    with open(fn) as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                # later results for same size and phase replace earlier ones
+                results[(r["files"], r["phase"])] = r
+    return results
+
+# Print ratio of time and peak memory of NEW results to BASE results
+def compare(base_fn, new_fn):
+    base = read_results(base_fn)
+    new = read_results(new_fn)
+    print("files\tphase\tbase_seconds\tnew_seconds\ttime_ratio\tbase_peak_MB\tnew_peak_MB\tpeak_ratio")
+    for key in sorted(set(base) & set(new)):
+        b, n = base[key], new[key]
+        time_ratio = n["seconds"] / b["seconds"] if b["seconds"] else float("nan")
+        bp, np_ = b.get("peak_bytes"), n.get("peak_bytes")
+        peak_ratio = "{:.2f}".format(np_ / bp) if bp and np_ is not None else "NA"
+        mb = lambda x: "{:.1f}".format(x / 1e6) if x is not None else "NA"
+        print("{}\t{}\t{:.4f}\t{:.4f}\t{:.2f}\t{}\t{}\t{}".format(key[0], key[1], b["seconds"], n["seconds"], time_ratio, mb(bp), mb(np_), peak_ratio))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark catalog generation and aliquot parsing on synthetic data")
+    parser.add_argument("-n", "--sizes", dest="sizes", default=SIZES, help="Comma-separated list of data set sizes, as number of submitted files in project")
+    parser.add_argument("-f", "--files-per-case", dest="files_per_case", type=int, default=FILES_PER_CASE, help="Approximate number of submitted files per case")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="Number of times each phase is timed")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0, help="Random seed for synthetic data")
+    parser.add_argument("-o", "--output", dest="outfn", default="benchmark.jsonl", help="Append results as JSON lines to this file")
+    parser.add_argument("-l", "--label", dest="label", help="Label stored with results")
+    parser.add_argument("-w", "--workdir", dest="workd", help="Directory for temporary files")
+    parser.add_argument("-c", "--compare", dest="compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files and exit")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    info = {"commit": get_commit(), "label": args.label, "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "pandas": pd.__version__}
+    for n_files in [int(s) for s in args.sizes.split(",")]:
+        eprint("Benchmarking {} files".format(n_files))
+        records = run_size(n_files, args.files_per_case, args.repeat, args.seed, args.workd)
+        with open(args.outfn, 'a') as f:
+            for r in records:
+                f.write(json.dumps(dict(info, **r)) + "\n")
+                eprint("  {:<26}{:>10.4f}s {:>10.1f} MB".format(r["phase"], r["seconds"], (r["peak_bytes"] or 0) / 1e6))
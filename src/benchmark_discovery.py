@@ -0,0 +1,148 @@
+import json, time, tempfile, statistics, subprocess
+import argparse, sys, os
+import metrics_report
+import mock_gdc_server
+from gdc_record import GDCRecord
+from case_scheduler import read_cases
+from benchmark import get_commit
+import synthetic_data
+
+# End-to-end benchmark of discovery against a local mock GDC server
+#
+# mock_gdc_server.py is started in this process, serving synthetic cases or replaying an archive recorded with
+# GDC_RECORD, and run_discovery.sh is run for all cases with GDC_URL pointing to it and metrics recorded (-M).
+# Options after "--" are passed to run_discovery.sh, so that discovery modes can be compared, e.g., -q, -b, -p -T,
+# -J 8 or -P SYN.  No GDC token is needed.
+#
+# Reports wall time of the run, requests served per second, requests by outcome (ok, throttle, timeout, ...), and
+# wall time per case from the stage records of the metrics file.  Results are appended as a JSON line to the
+# output file, as with benchmark.py.  The discovery outputs are compared with the synthetic cases, if any.
+#
+# Usage:
+#   python src/benchmark_discovery.py -n 20 -- -q -b
+#   python src/benchmark_discovery.py -n 100 -l 0.05 -t 0.01 -- -p -T -J 8
+#   python src/benchmark_discovery.py -a logs/gdc_record.sqlite -C dat/cases.dat -R -- -p
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DISCOVERY_FILES = ["aliquots.dat", "read_groups.dat", "submitted_reads.dat", "harmonized_reads.dat", "methylation_array.dat", "demographics.dat"]
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Wall time of each case, from start of its first stage to end of its last
+def case_times(records):
+    spans = {}
+    for r in records:
+        if r.get("type") == "stage" and "case" in r:
+            start, end = r["start"], r["start"] + r["seconds"]
+            s = spans.setdefault(r["case"], [start, end])
+            s[0], s[1] = min(s[0], start), max(s[1], end)
+    return {case: end - start for case, (start, end) in spans.items()}
+
+def read_lines(fn):
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return sorted(line for line in f.read().split("\n") if line != "")
+
+# Cases whose discovery files differ, as sets of lines, from those written by synthetic_data.py
+def check_outputs(cases, logbase, expectd):
+    differ = []
+    for case, disease in cases:
+        for fn in DISCOVERY_FILES:
+            if read_lines(os.path.join(logbase, "outputs", case, fn)) != read_lines(os.path.join(expectd, "outputs", case, fn)):
+                differ.append("{}/{}".format(case, fn))
+    return differ
+
+def run(args, workd):
+    if args.record_fn is not None:
+        # run_discovery.sh is run in the repository directory
+        cases_fn = os.path.abspath(args.cases_fn)
+        record, graph = GDCRecord(args.record_fn), None
+    else:
+        cases_fn = os.path.join(workd, "cases.dat")
+        synthetic_data.write_project(os.path.join(workd, "expected"), cases_fn, args.n_cases, args.files_per_case, seed=args.seed)
+        record, graph = None, mock_gdc_server.synthetic_graph(read_cases(cases_fn), args.files_per_case, args.seed, args.project)
+    cases = read_cases(cases_fn)
+
+    mock = mock_gdc_server.MockGDC(record, graph, args.latency, args.recorded_latency, args.throttle_fraction, args.max_rate,
+        args.timeout_fraction, args.max_results, seed=args.seed)
+    server = mock_gdc_server.start_server(mock)
+    token_fn = os.path.join(workd, "token.txt")
+    with open(token_fn, 'w') as f:
+        f.write("mock-token\n")
+    logbase = os.path.join(workd, "logs")
+    env = dict(os.environ, GDC_URL="http://127.0.0.1:{}/".format(server.server_port), GDC_TOKEN=token_fn)
+    for var in ("GDC_CACHE", "GDC_RECORD", "GDC_METRICS", "GDC_RATE_LIMIT"):
+        env.pop(var, None)
+    cmd = ["bash", "src/run_discovery.sh", "-M", "-L", logbase, "-t", token_fn] + args.discovery_args + [cases_fn]
+    eprint("Running: {}".format(" ".join(cmd)))
+
+    start = time.time()
+    with open(os.path.join(workd, "discovery.log"), 'w') as log:
+        status = subprocess.run(cmd, cwd=REPO, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    wall = time.time() - start
+    server.shutdown()
+
+    stats = mock.stats()
+    metrics_fn = os.path.join(logbase, "metrics.jsonl")
+    records = metrics_report.read_metrics(metrics_fn) if os.path.exists(metrics_fn) else []
+    times = case_times(records)
+    result = {"discovery_args": " ".join(args.discovery_args), "replay": args.record_fn is not None, "status": status,
+        "cases": len(cases), "wall_seconds": wall, "requests": stats.get("requests", 0),
+        "requests_per_second": stats.get("requests", 0) / wall if wall else None, "outcomes": stats,
+        "case_seconds_mean": statistics.mean(times.values()) if times else None,
+        "case_seconds_median": statistics.median(times.values()) if times else None,
+        "case_seconds_max": max(times.values()) if times else None,
+        "latency": args.latency, "throttle": args.throttle_fraction, "timeout": args.timeout_fraction}
+    if args.record_fn is None:
+        result["differ"] = check_outputs(cases, logbase, os.path.join(workd, "expected"))
+    return result, times
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark discovery end to end against a local mock GDC server")
+    parser.add_argument("discovery_args", nargs="*", help="Arguments passed to run_discovery.sh, after --")
+    parser.add_argument("-n", "--cases-count", dest="n_cases", type=int, default=10, help="Number of synthetic cases")
+    parser.add_argument("-f", "--files-per-case", dest="files_per_case", type=int, default=60, help="Approximate number of submitted files per synthetic case")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0, help="Random seed for synthetic data and injected faults")
+    parser.add_argument("-P", "--project", dest="project", default="SYN", help="Project ID of synthetic cases, for run_discovery.sh -P.  Default SYN")
+    parser.add_argument("-a", "--archive", dest="record_fn", help="Replay this archive rather than serve synthetic cases.  Requires -C")
+    parser.add_argument("-C", "--cases", dest="cases_fn", help="Cases file of recorded run")
+    parser.add_argument("-l", "--latency", dest="latency", type=float, default=0.0, help="Seconds the server waits before each response")
+    parser.add_argument("-R", "--recorded-latency", dest="recorded_latency", action="store_true", help="Wait as long as each query took when recorded")
+    parser.add_argument("-t", "--throttle", dest="throttle_fraction", type=float, default=0.0, help="Fraction of requests throttled")
+    parser.add_argument("-r", "--max-rate", dest="max_rate", type=float, help="Throttle requests above this many per second")
+    parser.add_argument("-T", "--timeout", dest="timeout_fraction", type=float, default=0.0, help="Fraction of requests answered with query timeout error")
+    parser.add_argument("-m", "--max-results", dest="max_results", type=int, help="Queries returning more entities than this time out")
+    parser.add_argument("-o", "--output", dest="outfn", default="benchmark_discovery.jsonl", help="Append results as JSON lines to this file")
+    parser.add_argument("-L", "--label", dest="label", help="Label stored with results")
+    parser.add_argument("-w", "--workdir", dest="workd", help="Keep discovery outputs, logs and metrics in this directory rather than a temporary one")
+
+    args = parser.parse_args()
+
+    if args.record_fn is not None and args.cases_fn is None:
+        eprint("ERROR: Replay (-a) requires cases file (-C)")
+        sys.exit(1)
+
+    if args.workd is not None:
+        os.makedirs(args.workd, exist_ok=True)
+        result, times = run(args, os.path.abspath(args.workd))
+    else:
+        with tempfile.TemporaryDirectory() as workd:
+            result, times = run(args, workd)
+
+    info = {"commit": get_commit(), "label": args.label, "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(args.outfn, 'a') as f:
+        f.write(json.dumps(dict(info, **result)) + "\n")
+
+    fmt = lambda x: "NA" if x is None else "{:.2f}".format(x)
+    print("Discovery {}: {} cases in {:.1f}s, exit status {}".format(result["discovery_args"] or "(default)", result["cases"], result["wall_seconds"], result["status"]))
+    print("Requests: {} ({:.1f} per second); {}".format(result["requests"], result["requests_per_second"] or 0,
+        ", ".join("{} {}".format(k, v) for k, v in sorted(result["outcomes"].items()) if k != "requests")))
+    print("Seconds per case: mean {}, median {}, max {}".format(fmt(result["case_seconds_mean"]), fmt(result["case_seconds_median"]), fmt(result["case_seconds_max"])))
+    for case, seconds in sorted(times.items(), key=lambda x: -x[1])[:5]:
+        print("  {}\t{:.2f}".format(case, seconds))
+    if result.get("differ"):
+        print("WARNING: discovery output differs from synthetic data: {}".format(", ".join(result["differ"][:10])))
+    if result["status"] != 0:
+        sys.exit(result["status"])
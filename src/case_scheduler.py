@@ -0,0 +1,215 @@
+import time, subprocess, shlex, signal
+import argparse, sys, os
+from rate_limit import TokenBucket
+
+# Run process_case.sh for all cases of a project, with adaptive concurrency and a shared request rate limit
+#
+# This replaces the GNU parallel semaphore in run_discovery.sh, which ran a fixed number of cases at once
+# without regard to how GDC was responding.  Here
+# * all queries of all cases draw from one token bucket (see rate_limit.py), which is paused when GDC responds
+#   with "You are posting too quickly"
+# * the number of cases run at once adapts to GDC responses, additive increase / multiplicative decrease (AIMD):
+#   every INTERVAL seconds, if any queries were throttled or timed out, concurrency is halved; otherwise, if
+#   queries succeeded, it is increased by one, up to MAX_JOBS.  Running cases are not stopped when concurrency
+#   is reduced; new cases are started only when fewer than the current limit are running
+# * completed cases are recorded in a checkpoint file, so that an interrupted run can be restarted and will
+#   process only unfinished cases.  Failed cases are run again on restart.  Once all cases are done the checkpoint
+#   is moved to CHECKPOINT.last, so that the next run processes all cases again
+#
+# Usage:
+#   python src/case_scheduler.py -J 10 -L logs -R logs/rate_limit.state CASES -- bash src/process_case.sh -t TOKEN
+# runs for each case
+#   bash src/process_case.sh -t TOKEN -O logs/outputs/CASE -D DISEASE CASE > logs/outputs/CASE/log.CASE.out 2> logs/outputs/CASE/log.CASE.err
+
+INTERVAL = 30
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+def log(msg):
+    eprint("[ {} ] {}".format(time.strftime("%c"), msg))
+
+# Treat SIGTERM like ^C, so that running cases are stopped
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+# Returns list of (case, disease) from CASES file, skipping commented out entries
+def read_cases(cases_fn):
+    cases = []
+    with open(cases_fn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.split("\t")
+            cases.append((fields[0], fields[1] if len(fields) > 1 else "unknown"))
+    return cases
+
+# Checkpoint file has one line per completed case: case, status (done or failed), and time.
+# Later lines take precedence.  Returns set of cases which are done
+def read_checkpoint(checkpoint_fn):
+    status = {}
+    if os.path.exists(checkpoint_fn):
+        with open(checkpoint_fn) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 2:
+                    status[fields[0]] = fields[1]
+    return set(case for case, s in status.items() if s == "done")
+
+def write_checkpoint(checkpoint_fn, case, status):
+    with open(checkpoint_fn, 'a') as f:
+        f.write("{}\t{}\t{}\n".format(case, status, time.strftime("%Y-%m-%dT%H:%M:%S")))
+
+# Additive increase / multiplicative decrease of concurrency based on changes in query outcome counts
+class Concurrency:
+    def __init__(self, max_jobs, start=None, interval=INTERVAL, bucket=None):
+        self.max_jobs = max_jobs
+        self.limit = min(max_jobs, start or max_jobs)
+        self.interval = interval
+        self.bucket = bucket
+        self.last_check = time.time()
+        self.last_counts = bucket.counts() if bucket else None
+
+    # Adjust limit if INTERVAL has passed since last check
+    def update(self):
+        if self.bucket is None or time.time() - self.last_check < self.interval:
+            return
+        counts = self.bucket.counts()
+        delta = {k: counts[k] - self.last_counts[k] for k in counts}
+        self.last_counts = counts
+        self.last_check = time.time()
+        if delta["throttle"] > 0 or delta["timeout"] > 0:
+            limit = max(1, self.limit // 2)
+            reason = "{} throttled, {} timed out".format(delta["throttle"], delta["timeout"])
+        elif delta["ok"] > 0:
+            limit = min(self.max_jobs, self.limit + 1)
+            reason = "{} queries succeeded".format(delta["ok"])
+        else:
+            return
+        if limit != self.limit:
+            log("Concurrency {} -> {} ({})".format(self.limit, limit, reason))
+            self.limit = limit
+
+class Scheduler:
+    def __init__(self, command, logbase, checkpoint_fn, concurrency, dryrun=False):
+        self.command = command
+        self.logbase = logbase
+        self.checkpoint_fn = checkpoint_fn
+        self.concurrency = concurrency
+        self.dryrun = dryrun
+        self.running = {}   # case -> (Popen, start time)
+        self.failed = []
+
+    def get_command(self, case, disease):
+        logd = os.path.join(self.logbase, "outputs", case)
+        cmd = self.command + ["-O", logd, "-D", disease, case]
+        return " ".join(shlex.quote(c) for c in cmd), logd
+
+    def start(self, case, disease):
+        cmd, logd = self.get_command(case, disease)
+        out_fn = os.path.join(logd, "log.{}.out".format(case))
+        err_fn = os.path.join(logd, "log.{}.err".format(case))
+        if self.dryrun:
+            log("Dryrun: {} > {} 2> {}".format(cmd, out_fn, err_fn))
+            return
+        os.makedirs(logd, exist_ok=True)
+        log("Running: {} > {} 2> {}".format(cmd, out_fn, err_fn))
+        with open(out_fn, 'w') as out, open(err_fn, 'w') as err:
+            p = subprocess.Popen(cmd, shell=True, stdout=out, stderr=err, start_new_session=True)
+        self.running[case] = (p, time.time())
+
+    # Collect finished cases and record them in checkpoint
+    def reap(self):
+        for case, (p, start) in list(self.running.items()):
+            rc = p.poll()
+            if rc is None:
+                continue
+            del self.running[case]
+            status = "done" if rc == 0 else "failed"
+            if rc != 0:
+                self.failed.append(case)
+            write_checkpoint(self.checkpoint_fn, case, status)
+            log("Case {} {} in {:.0f}s (exit {})".format(case, status, time.time() - start, rc))
+
+    def stop(self):
+        for case, (p, start) in self.running.items():
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for case, (p, start) in self.running.items():
+            p.wait()
+
+    def run(self, cases):
+        pending = list(cases)
+        try:
+            while pending or self.running:
+                self.reap()
+                self.concurrency.update()
+                while pending and len(self.running) < self.concurrency.limit:
+                    self.start(*pending.pop(0))
+                if pending or self.running:
+                    time.sleep(0.5)
+        except KeyboardInterrupt:
+            log("Interrupted.  Stopping {} running cases; they will be run again on restart".format(len(self.running)))
+            self.stop()
+            raise
+        return self.failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run discovery for all cases with adaptive concurrency, shared rate limit and checkpointing",
+        usage="%(prog)s [options] CASES -- COMMAND ...")
+    parser.add_argument("cases_fn", help="TSV file with case name and disease in first and second columns")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run for each case; -O LOGD -D DISEASE CASE are appended")
+    parser.add_argument("-J", "--jobs", dest="max_jobs", type=int, default=10, help="Maximum number of cases run at once")
+    parser.add_argument("-s", "--start-jobs", dest="start_jobs", type=int, help="Initial number of cases run at once.  Default is half of maximum")
+    parser.add_argument("-L", "--logbase", dest="logbase", default="./logs", help="Base directory of per-case output.  Default ./logs")
+    parser.add_argument("-c", "--checkpoint", dest="checkpoint_fn", help="Checkpoint file.  Default LOGBASE/discovery.checkpoint")
+    parser.add_argument("-R", "--rate-limit", dest="rate_limit_fn", help="Shared rate limit state file.  Default is $GDC_RATE_LIMIT; if not defined, concurrency is fixed")
+    parser.add_argument("-i", "--interval", dest="interval", type=float, default=INTERVAL, help="Seconds between concurrency adjustments")
+    parser.add_argument("-r", "--restart", action="store_true", help="Ignore checkpoint and process all cases")
+    parser.add_argument("-1", "--just-one", dest="just_one", action="store_true", help="Process only one case")
+    parser.add_argument("-d", "--dryrun", action="store_true", help="Print commands but do not execute")
+
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("COMMAND is required")
+
+    os.makedirs(args.logbase, exist_ok=True)
+    checkpoint_fn = args.checkpoint_fn or os.path.join(args.logbase, "discovery.checkpoint")
+    if args.restart and os.path.exists(checkpoint_fn) and not args.dryrun:
+        os.remove(checkpoint_fn)
+    cases = read_cases(args.cases_fn)
+    done = read_checkpoint(checkpoint_fn)
+    todo = [c for c in cases if c[0] not in done]
+    if done:
+        log("{} of {} cases completed in earlier run, per {}".format(len(cases) - len(todo), len(cases), checkpoint_fn))
+    if args.just_one:
+        todo = todo[:1]
+
+    rate_limit_fn = args.rate_limit_fn or os.environ.get("GDC_RATE_LIMIT")
+    bucket = None
+    if rate_limit_fn:
+        # process_case.sh and the scripts it calls use the same file
+        os.environ["GDC_RATE_LIMIT"] = rate_limit_fn
+        bucket = TokenBucket.from_environment()
+    start_jobs = args.start_jobs or max(1, args.max_jobs // 2)
+    concurrency = Concurrency(args.max_jobs, start_jobs if bucket else args.max_jobs, args.interval, bucket)
+
+    signal.signal(signal.SIGTERM, interrupt)
+    log("Processing {} cases, up to {} at once".format(len(todo), args.max_jobs))
+    scheduler = Scheduler(command, args.logbase, checkpoint_fn, concurrency, args.dryrun)
+    try:
+        failed = scheduler.run(todo)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    if failed:
+        eprint("ERROR: {} cases failed: {}".format(len(failed), " ".join(failed)))
+        sys.exit(1)
+    # Only an unfinished run is resumed
+    done = read_checkpoint(checkpoint_fn)
+    if not args.dryrun and os.path.exists(checkpoint_fn) and all(case in done for case, disease in cases):
+        os.replace(checkpoint_fn, checkpoint_fn + ".last")
+        log("All {} cases completed.  Checkpoint moved to {}.last".format(len(cases), checkpoint_fn))
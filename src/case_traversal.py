@@ -0,0 +1,147 @@
+import json, time
+from gdc_client import GDCQueryError, get_json, is_timeout_error, eprint, THROTTLE_BACKOFF, ERROR_BACKOFF
+from gdc_batch import format_row, is_aligned_strategy, READ_GROUP_FIELDS, READS_FIELDS, METHYLATION_FIELDS, SAR_STRATEGIES, SUR_STRATEGIES
+from rate_limit import backoff_delay
+
+# Case-level traversal queries
+#
+# Per-hop discovery (get_read_groups.sh etc., gdc_batch.py, discover_case.py) makes one lookup per aliquot, read
+# group and submitted file, each one hop from its parent:
+#     read_group(with_path_to: {type: "aliquot", ...})
+#     submitted_aligned_reads(with_path_to: {type: "read_group", ...})
+#     aligned_reads(with_path_to: {type: "submitted_aligned_reads", id: ...})
+# Here each entity type is fetched for the whole case at once, along with the links to its parents,
+#     read_group(with_path_to: {type: "case", submitter_id:"C3L-00004"}, first:10000, offset:0) { ... aliquots { submitter_id } }
+# and entities are joined to their parents locally.  The result is the same as the per-hop lookups; see
+# join_read_groups etc.
+#
+# A case with more entities than fit in one page is fetched in pages with first / offset, and a page which exceeds
+# the GDC query timeout is fetched again with a smaller page size.
+
+PAGE_SIZE = 10000
+MIN_PAGE_SIZE = 100
+# Number of results returned by GDC when `first` is not given.  Per-hop submitted and harmonized reads queries
+# do not give it, so return at most this many entities per parent
+DEFAULT_FIRST = 10
+
+# Entity types fetched per case: fields of per-hop query, and link to parent with parent's key field
+CASE_ENTITIES = {
+    "read_group": (READ_GROUP_FIELDS, "aliquots { submitter_id }"),
+    "submitted_aligned_reads": (READS_FIELDS, "read_groups { submitter_id }"),
+    "submitted_unaligned_reads": (READS_FIELDS, "read_groups { submitter_id }"),
+    "aligned_reads": (READS_FIELDS, "submitted_aligned_reads_files { id } submitted_unaligned_reads_files { id }"),
+    "raw_methylation_array": (METHYLATION_FIELDS, "aliquots { submitter_id }"),
+}
+
+def case_entity_query(entity, case, first, offset):
+    fields, links = CASE_ENTITIES[entity]
+    return entity_query(entity, 'type: "case", submitter_id:"%s"' % case, " ".join(fields) + " " + links, first, offset)
+
+def entity_query(entity, path, fields, first, offset):
+    return '{ %s(with_path_to: {%s}, first:%d, offset:%d) { %s } }' % (entity, path, first, offset, fields)
+
+# Returns list of all entities of given type in case, fetching in pages of up to page_size
+def fetch_case_entities(client, entity, case, page_size=PAGE_SIZE, verbose=False):
+    query_func = lambda first, offset: case_entity_query(entity, case, first, offset)
+    results = []
+    for offset, R, page in iter_pages(client, query_func, entity, page_size, verbose=verbose):
+        results += page
+    return results
+
+# Generator of pages of results of query_func(first, offset), starting at given offset.  Yields (offset, response text,
+# list of entities) for each page.  Page size is reduced if a query times out; the last page has fewer than
+# page_size entities
+def iter_pages(client, query_func, entity, page_size=PAGE_SIZE, offset=0, verbose=False):
+    failures = 0    # consecutive failed queries, for retry backoff
+    while True:
+        query = query_func(page_size, offset)
+        R = client.get_cached(query)
+        if R is None:
+            start = time.time()
+            R, errors = client.request(get_json(query))
+            if errors is None:
+                errors = ["ERROR parsing result : " + R]
+            if errors:
+                if "Unauthorized query." in errors:
+                    raise GDCQueryError("Fatal error: Unauthorized query.")
+                failures += 1
+                if "You are posting too quickly" in R:
+                    delay = THROTTLE_BACKOFF + backoff_delay(failures - 1, THROTTLE_BACKOFF)
+                    eprint("Posting too quickly error.  Pausing {:.1f}s.".format(delay))
+                    time.sleep(delay)
+                elif is_timeout_error(errors) and page_size > MIN_PAGE_SIZE:
+                    # A smaller page is tried right away
+                    page_size = max(MIN_PAGE_SIZE, page_size // 2)
+                    if verbose:
+                        eprint("{} page at offset {} timed out.  Retrying with page size {}".format(entity, offset, page_size))
+                else:
+                    delay = backoff_delay(failures - 1, ERROR_BACKOFF)
+                    if verbose:
+                        eprint("ERRORS: " + " ".join(errors))
+                        eprint("Query failed.  Retrying in {:.1f}s.".format(delay))
+                    time.sleep(delay)
+                continue
+            failures = 0
+            if client.cache is not None:
+                client.cache.put(query, R)
+            if verbose:
+                eprint("{} entities {}-{} in {:.1f}s".format(entity, offset, offset + page_size, time.time() - start))
+        page = json.loads(R)['data'][entity] or []
+        yield offset, R, page
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+# Index entities by key of their parents.  Returns dictionary parent key -> list of entities, in order
+def index_by_parent(entities, link, key):
+    index = {}
+    for e in entities:
+        for parent in set(p[key] for p in e.get(link) or []):
+            index.setdefault(parent, []).append(e)
+    return index
+
+# The following return dictionaries of output lines keyed on parent line, the same as per-hop lookups
+# for each parent line in discover_case.py
+
+# aliquots.dat lines -> read_groups.dat lines
+def join_read_groups(aliquot_lines, read_groups):
+    index = index_by_parent(read_groups, "aliquots", "submitter_id")
+    result = {}
+    for line in aliquot_lines:
+        r = line.split("\t")
+        result[line] = [format_row([r[0], r[5]], rg, READ_GROUP_FIELDS) for rg in index.get(r[5], [])]
+    return result
+
+# read_groups.dat lines -> submitted_reads.dat lines
+def join_submitted_reads(read_group_lines, submitted_aligned, submitted_unaligned):
+    aligned = index_by_parent(submitted_aligned, "read_groups", "submitter_id")
+    unaligned = index_by_parent(submitted_unaligned, "read_groups", "submitter_id")
+    result = {}
+    for line in read_group_lines:
+        CASE, ASID, RGSID, ES = line.split("\t")[:4]
+        if ES not in SAR_STRATEGIES and ES not in SUR_STRATEGIES:
+            raise ValueError("Unknown Experimental Strategy {}. CASE = {} Aliquot = {} Read Group = {}".format(ES, CASE, ASID, RGSID))
+        index, alignment = (aligned, "submitted_aligned") if is_aligned_strategy(ES) else (unaligned, "submitted_unaligned")
+        result[line] = [format_row([CASE, ASID, alignment], sr, READS_FIELDS) for sr in index.get(RGSID, [])[:DEFAULT_FIRST]]
+    return result
+
+# submitted_reads.dat lines -> harmonized_reads.dat lines
+def join_harmonized_reads(submitted_lines, aligned_reads):
+    from_aligned = index_by_parent(aligned_reads, "submitted_aligned_reads_files", "id")
+    from_unaligned = index_by_parent(aligned_reads, "submitted_unaligned_reads_files", "id")
+    result = {}
+    for line in submitted_lines:
+        r = line.split("\t")
+        index = from_aligned if is_aligned_strategy(r[3]) else from_unaligned
+        result[line] = [format_row([r[0], r[1], "harmonized"], ar, READS_FIELDS) for ar in index.get(r[7], [])[:DEFAULT_FIRST]]
+    return result
+
+# aliquots.dat lines of DNA aliquots -> methylation_array.dat lines
+def join_methylation_array(aliquot_lines, methylation_arrays):
+    index = index_by_parent(methylation_arrays, "aliquots", "submitter_id")
+    result = {}
+    for line in aliquot_lines:
+        r = line.split("\t")
+        if r[7] == "DNA":
+            result[line] = [format_row([r[0], r[5], "NA"], ma, METHYLATION_FIELDS) for ma in index.get(r[5], [])]
+    return result
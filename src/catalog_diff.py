@@ -0,0 +1,280 @@
+import json, heapq, itertools, bisect, tempfile
+import argparse, sys, os
+from math import ceil
+from make_catalog3 import eprint, METADATA_KEYS
+from collect_catalog import write_atomic
+import catalog_parquet
+
+# Differences between two Catalog3 tables, e.g., the catalogs of two discovery runs
+#
+# Rows of the old and new catalogs are joined on uuid.  Each row of the new catalog whose uuid is not in the old
+# one is "added", and each row of the old catalog whose uuid is not in the new one is "removed".  Rows with the
+# same uuid which differ are "modified" if any of the tracked fields differ (by default md5, filesize, the state
+# in metadata, and dataset_name), and "updated" if only other fields do.  Catalogs may be TSV files or Parquet
+# datasets written by catalog_parquet.py.
+#
+# So that catalogs of millions of rows can be compared in bounded memory, both catalogs are read as streams and
+# split into partitions by uuid, which are written to temporary files; the partitions are then joined one at a
+# time.  The number of partitions is chosen so that a partition of both catalogs fits in the memory given with -M.
+# Partitions are ranges of uuid, so differences are written in order of uuid whatever their number.
+#
+# Differences are written as a delta file: a TSV file with columns change and changed_fields followed by those of
+# the catalog, with the new row for added, modified and updated rows and the old row for removed ones.  If a uuid
+# is not unique in either catalog, its rows are matched as whole lines and reported as added or removed.
+#
+# Usage:
+#   python src/catalog_diff.py -o CPTAC3.Catalog3.delta.tsv old/CPTAC3.Catalog3.tsv results/CPTAC3.Catalog3.tsv
+# Apply delta to the old catalog, which gives the new one:
+#   python src/catalog_diff.py -a CPTAC3.Catalog3.delta.tsv -o results/CPTAC3.Catalog3.tsv old/CPTAC3.Catalog3.tsv
+# or to an index made by catalog_index.py:
+#   python src/catalog_index.py -D CPTAC3.Catalog3.delta.tsv results/CPTAC3.Catalog3.sqlite
+
+TRACKED_FIELDS = ["md5", "filesize", "state", "dataset_name"]
+DELTA_COLUMNS = ["change", "changed_fields"]
+CHANGES = ["added", "removed", "modified", "updated"]
+MEMORY_MB = 512
+# Approximate ratio of memory used to hold catalog lines to their size in file, and bytes per row of Parquet
+MEMORY_FACTOR = 4
+PARQUET_ROW_BYTES = 600
+
+# Catalog3 table in TSV file or Parquet dataset directory, read as stream of TSV lines
+class CatalogReader:
+    def __init__(self, path):
+        self.path = path
+        self.is_parquet = os.path.isdir(path)
+        if self.is_parquet:
+            self.header = "\t".join(catalog_parquet.CATALOG_HEADER)
+        else:
+            with open(path) as f:
+                self.header = f.readline().rstrip("\n").lstrip("#")
+        self.columns = self.header.split("\t")
+
+    # Lines of catalog, without header
+    def lines(self):
+        if self.is_parquet:
+            yield from catalog_parquet.iter_lines(self.path)
+            return
+        with open(self.path) as f:
+            next(f, None)
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip() == "" or line.startswith("#"):
+                    continue
+                yield line
+
+    # Approximate size of catalog lines in bytes
+    def size(self):
+        if self.is_parquet:
+            return catalog_parquet.count_rows(self.path) * PARQUET_ROW_BYTES
+        return os.path.getsize(self.path)
+
+# Partitions are ranges of uuid starting at these values; uuids sorting before "0000" are in the first one
+def partition_bounds(n):
+    return [format(i * 16**4 // n, "04x") for i in range(n)]
+
+def partition_of(uuid, bounds):
+    return max(bisect.bisect_right(bounds, uuid) - 1, 0)
+
+# Fields which differ between two lines of a uuid.  Metadata is compared key by key, and its keys are reported by
+# name, e.g., "state"
+def changed_fields(old_line, new_line, columns):
+    changed = []
+    for column, a, b in zip(columns, old_line.split("\t"), new_line.split("\t")):
+        if a == b:
+            continue
+        if column != "metadata":
+            changed.append(column)
+            continue
+        try:
+            a, b = json.loads(a or "{}"), json.loads(b or "{}")
+        except ValueError:
+            changed.append(column)
+            continue
+        keys = [k for k in METADATA_KEYS if k in a or k in b] + sorted(k for k in set(a) | set(b) if k not in METADATA_KEYS)
+        changed += [k for k in keys if a.get(k) != b.get(k)]
+    return changed
+
+class CatalogDiff:
+    def __init__(self, columns, tracked=TRACKED_FIELDS):
+        unknown = [f for f in tracked if f not in columns and f not in METADATA_KEYS]
+        if unknown:
+            raise ValueError("Unknown tracked field(s) {}".format(", ".join(unknown)))
+        if "uuid" not in columns:
+            raise ValueError("Catalog header lacks uuid column")
+        self.columns = columns
+        self.tracked = set(tracked)
+        self.uuid_ix = columns.index("uuid")
+        self.counts = {change: 0 for change in CHANGES + ["unchanged"]}
+        self.field_counts = {}
+
+    def uuid(self, line):
+        return line.split("\t")[self.uuid_ix]
+
+    def group(self, lines):
+        groups = {}
+        for line in lines:
+            groups.setdefault(self.uuid(line), []).append(line)
+        return groups
+
+    # Delta records (change, changed_fields, line) of one partition, in order of uuid
+    def diff_partition(self, old_lines, new_lines):
+        old, new = self.group(old_lines), self.group(new_lines)
+        records = []
+        for uuid in sorted(old.keys() | new.keys()):
+            old_group, new_group = old.get(uuid, []), new.get(uuid, [])
+            if len(old_group) == 1 and len(new_group) == 1:
+                if old_group[0] == new_group[0]:
+                    self.counts["unchanged"] += 1
+                    continue
+                changed = changed_fields(old_group[0], new_group[0], self.columns)
+                change = "modified" if self.tracked.intersection(changed) else "updated"
+                for field in changed:
+                    self.field_counts[field] = self.field_counts.get(field, 0) + 1
+                records.append((change, ",".join(changed), new_group[0]))
+                self.counts[change] += 1
+                continue
+            # Not unique in one of the catalogs: match whole lines
+            unmatched = list(new_group)
+            for line in sorted(old_group):
+                if line in unmatched:
+                    unmatched.remove(line)
+                    self.counts["unchanged"] += 1
+                else:
+                    records.append(("removed", "", line))
+                    self.counts["removed"] += 1
+            for line in sorted(unmatched):
+                records.append(("added", "", line))
+                self.counts["added"] += 1
+        return records
+
+    # Generator of delta lines, with header.  OLD and NEW are CatalogReaders
+    def diff(self, old, new, memory_mb=MEMORY_MB, tmpd=None):
+        yield "\t".join(DELTA_COLUMNS + self.columns)
+        n = max(1, ceil((old.size() + new.size()) * MEMORY_FACTOR / (memory_mb * 2**20)))
+        if n == 1:
+            partitions = [(old.lines(), new.lines())]
+            yield from self.iter_delta(partitions)
+            return
+        eprint("Splitting catalogs into {} partitions".format(n))
+        with tempfile.TemporaryDirectory(dir=tmpd) as partd:
+            self.split(old, os.path.join(partd, "old"), n)
+            self.split(new, os.path.join(partd, "new"), n)
+            partitions = ((read_lines(os.path.join(partd, "old.{}".format(i))), read_lines(os.path.join(partd, "new.{}".format(i)))) for i in range(n))
+            yield from self.iter_delta(partitions)
+
+    def iter_delta(self, partitions):
+        for old_lines, new_lines in partitions:
+            for change, changed, line in self.diff_partition(old_lines, new_lines):
+                yield "\t".join([change, changed, line])
+
+    # Write lines of catalog to files BASE.0, BASE.1, ... by partition of uuid
+    def split(self, reader, base, n):
+        bounds = partition_bounds(n)
+        files = [open("{}.{}".format(base, i), 'w') for i in range(n)]
+        try:
+            for line in reader.lines():
+                files[partition_of(self.uuid(line), bounds)].write(line + "\n")
+        finally:
+            for f in files:
+                f.close()
+
+def read_lines(fn):
+    with open(fn) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+def diff_catalogs(old_fn, new_fn, outfn=None, tracked=TRACKED_FIELDS, memory_mb=MEMORY_MB, tmpd=None):
+    old, new = CatalogReader(old_fn), CatalogReader(new_fn)
+    if old.header != new.header:
+        raise ValueError("Headers of {} and {} differ".format(old_fn, new_fn))
+    differ = CatalogDiff(old.columns, tracked)
+    lines = differ.diff(old, new, memory_mb, tmpd)
+    if outfn is None:
+        for line in lines:
+            print(line)
+    else:
+        write_atomic(outfn, lines)
+    return differ
+
+# Returns catalog header and list of (change, changed_fields, line) of delta file
+def read_delta(delta_fn):
+    with open(delta_fn) as f:
+        header = f.readline().rstrip("\n").split("\t", len(DELTA_COLUMNS))
+        if header[:len(DELTA_COLUMNS)] != DELTA_COLUMNS or len(header) <= len(DELTA_COLUMNS):
+            raise ValueError("{} is not a catalog delta file".format(delta_fn))
+        records = []
+        for i, line in enumerate(f, 2):
+            record = line.rstrip("\n").split("\t", len(DELTA_COLUMNS))
+            if len(record) <= len(DELTA_COLUMNS) or record[0] not in CHANGES:
+                raise ValueError("{}:{}: unknown change {}".format(delta_fn, i, record[0]))
+            records.append(tuple(record))
+    return header[-1], records
+
+# Apply delta to catalog, writing resulting catalog to OUTFN.  Removed rows, and the old rows of modified and
+# updated ones, are dropped as the catalog is read, and new rows merged in; if the catalog is sorted, as written
+# by collect_catalog.py, so is the result.  Raises ValueError if the delta was not made from this catalog
+def apply_delta(catalog_fn, delta_fn, outfn):
+    header, records = read_delta(delta_fn)
+    reader = CatalogReader(catalog_fn)
+    if reader.header != header:
+        raise ValueError("Header of {} differs from that of delta {}".format(catalog_fn, delta_fn))
+    uuid_ix = reader.columns.index("uuid")
+    removed = {}
+    replaced = set()
+    for change, changed, line in records:
+        if change == "removed":
+            removed[line] = removed.get(line, 0) + 1
+        elif change != "added":
+            replaced.add(line.split("\t")[uuid_ix])
+    inserted = sorted(line for change, changed, line in records if change != "removed")
+
+    def kept_lines():
+        found = set()
+        for line in reader.lines():
+            if removed.get(line, 0) > 0:
+                removed[line] -= 1
+                continue
+            uuid = line.split("\t")[uuid_ix]
+            if uuid in replaced:
+                found.add(uuid)
+                continue
+            yield line
+        missing = sum(removed.values()) + len(replaced - found)
+        if missing:
+            raise ValueError("{} rows of delta {} not found in {}".format(missing, delta_fn, catalog_fn))
+
+    try:
+        write_atomic(outfn, itertools.chain([header], heapq.merge(kept_lines(), inserted)))
+    except ValueError:
+        if os.path.exists(outfn + ".tmp"):
+            os.remove(outfn + ".tmp")
+        raise
+    return {change: sum(1 for r in records if r[0] == change) for change in CHANGES}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two Catalog3 tables by uuid and write delta file, or apply delta to catalog")
+    parser.add_argument("catalogs", nargs="+", help="Old and new catalogs: TSV file or Parquet dataset directory.  Only old catalog with -a")
+    parser.add_argument("-o", "--output", dest="outfn", help="Output delta file, or catalog with -a.  Default delta to stdout")
+    parser.add_argument("-a", "--apply", dest="delta_fn", help="Apply this delta to the catalog, writing new catalog to OUTFN")
+    parser.add_argument("-f", "--fields", dest="fields", default=",".join(TRACKED_FIELDS), help="Comma-separated fields whose changes make a row modified: catalog columns or metadata keys.  Default {}".format(",".join(TRACKED_FIELDS)))
+    parser.add_argument("-M", "--memory", dest="memory_mb", type=int, default=MEMORY_MB, help="Approximate memory for joining catalogs, in MB.  Default {}".format(MEMORY_MB))
+    parser.add_argument("-T", "--tmpdir", dest="tmpd", help="Directory for partitions of catalogs.  Default system temporary directory")
+
+    args = parser.parse_args()
+
+    try:
+        if args.delta_fn is not None:
+            if len(args.catalogs) != 1 or args.outfn is None:
+                raise ValueError("-a requires one catalog and output file -o")
+            counts = apply_delta(args.catalogs[0], args.delta_fn, args.outfn)
+            eprint("Wrote {}: {} rows added, {} removed, {} modified, {} updated".format(args.outfn, *[counts[c] for c in CHANGES]))
+        else:
+            if len(args.catalogs) != 2:
+                raise ValueError("Two catalogs required, old and new")
+            differ = diff_catalogs(args.catalogs[0], args.catalogs[1], args.outfn, args.fields.split(","), args.memory_mb, args.tmpd)
+            eprint("{} rows added, {} removed, {} modified, {} updated, {} unchanged".format(*[differ.counts[c] for c in CHANGES + ["unchanged"]]))
+            for field, n in sorted(differ.field_counts.items(), key=lambda x: -x[1]):
+                eprint("  {}: {} rows".format(field, n))
+    except (OSError, ValueError) as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
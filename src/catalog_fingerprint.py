@@ -0,0 +1,77 @@
+import hashlib, json
+import os
+
+# Fingerprints of catalog3 inputs, for incremental rebuilds (make_catalog3.py -i)
+#
+# The fingerprint of a catalog3 file is a hash of the contents of its input files (aliquots.dat and the reads or
+# methylation array file), of the catalog code (make_catalog3.py) and configuration files (annotation rules,
+# sample types and annotation table), and of the disease and project written to it.  It is recorded with the
+# size and modification time of the catalog3 file in OUTFN.fingerprint once the file is written.  A catalog3 file
+# is up to date if its fingerprint is unchanged and the file is as written; it is then not generated again.
+
+CODE_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "make_catalog3.py")]
+
+_digests = {}
+# SHA-256 of file contents, or None if file does not exist.  Each file is read once per process
+def file_digest(fn):
+    if fn not in _digests:
+        if not os.path.exists(fn):
+            return None
+        h = hashlib.sha256()
+        with open(fn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _digests[fn] = h.hexdigest()
+    return _digests[fn]
+
+# Hash of catalog code and configuration files.  Configuration files which are not used are None
+def catalog_version(config_fns):
+    h = hashlib.sha256()
+    for fn in CODE_FILES + [fn for fn in config_fns if fn is not None]:
+        h.update("{}\t{}\n".format(os.path.basename(fn), file_digest(fn)).encode("utf8"))
+    return h.hexdigest()
+
+def fingerprint(version, input_fns, *params):
+    h = hashlib.sha256((version + "\n").encode("utf8"))
+    for fn in input_fns:
+        h.update("{}\n".format(file_digest(fn)).encode("utf8"))
+    for p in params:
+        h.update("{}\n".format(p).encode("utf8"))
+    return h.hexdigest()
+
+def sidecar_fn(outfn):
+    return outfn + ".fingerprint"
+
+def file_stat(fn):
+    st = os.stat(fn)
+    return [st.st_size, st.st_mtime_ns]
+
+def read_record(outfn):
+    try:
+        with open(sidecar_fn(outfn)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# True if OUTFN was made with inputs of fingerprint FP and has not changed since.  An empty catalog is not
+# written, and is up to date if its fingerprint is unchanged
+def is_current(outfn, fp):
+    record = read_record(outfn)
+    if record is None or record.get("fingerprint") != fp:
+        return False
+    if not record.get("written"):
+        return True
+    return os.path.exists(outfn) and file_stat(outfn) == record.get("output")
+
+# True if OUTFN was written when last made, rather than skipped as empty
+def was_written(outfn):
+    record = read_record(outfn)
+    return record is not None and bool(record.get("written"))
+
+# Record fingerprint after OUTFN is written, or found to be empty and not written
+def write_record(outfn, fp, written=True):
+    record = {"fingerprint": fp, "written": written, "output": file_stat(outfn) if written else None}
+    tmp_fn = sidecar_fn(outfn) + ".tmp"
+    with open(tmp_fn, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_fn, sidecar_fn(outfn))
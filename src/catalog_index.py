@@ -0,0 +1,197 @@
+import sqlite3, hashlib
+import argparse, sys, os
+
+# Indexed lookup of Catalog3 entries
+#
+# Rather than scanning results/PROJECT.Catalog3.tsv with grep for every lookup, catalog rows are stored in an
+# SQLite database with B-tree indexes on uuid, case, specimen_name, dataset_name and md5.  Lookups return the
+# original catalog lines, so output is the same as `grep` of the catalog, with a header.
+#
+# Build or update the index after the catalog is (re)generated:
+#   python src/catalog_index.py -u results/CPTAC3.Catalog3.tsv results/CPTAC3.Catalog3.sqlite
+# Updates are incremental: only rows added to or removed from the catalog are written, and if the catalog has
+# not changed since the last update (same size and modification time) nothing is done.
+#
+# An index may also be brought up to date with a delta file of differences between catalogs (see catalog_diff.py):
+#   python src/catalog_index.py -D CPTAC3.Catalog3.delta.tsv results/CPTAC3.Catalog3.sqlite
+#
+# Point and prefix queries:
+#   python src/catalog_index.py -f uuid results/CPTAC3.Catalog3.sqlite 5a249602-cb25-4a4e-b671-8937d5f929e2
+#   python src/catalog_index.py -f dataset_name -p results/CPTAC3.Catalog3.sqlite C3L-00004.WXS
+# Many values may be looked up at once by reading them from a file (-F), one per line
+
+INDEX_FIELDS = ['uuid', 'case', 'specimen_name', 'dataset_name', 'md5']
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Smallest string greater than all strings starting with prefix, for range queries which use the index
+def prefix_upper(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class CatalogIndex:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.header = self.get_meta("header")
+        if self.header is not None:
+            self.columns = self.header.split("\t")
+
+    def get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    # Create table for catalog with given header.  All columns are stored as text, along with the original line
+    def create(self, header):
+        columns = header.split("\t")
+        missing = [f for f in INDEX_FIELDS if f not in columns]
+        if missing:
+            raise ValueError("Catalog header lacks field(s) {}".format(", ".join(missing)))
+        self.db.execute("DROP TABLE IF EXISTS catalog")
+        coldefs = ", ".join('"{}" TEXT'.format(c) for c in columns)
+        self.db.execute('CREATE TABLE catalog (line_hash TEXT PRIMARY KEY, line TEXT, {})'.format(coldefs))
+        for f in INDEX_FIELDS:
+            self.db.execute('CREATE INDEX "catalog_{0}" ON catalog ("{0}")'.format(f))
+        self.set_meta("header", header)
+        self.header = header
+        self.columns = columns
+
+    # Bring index up to date with catalog file.  Returns (added, removed) row counts, or None if catalog
+    # has not changed since last update
+    def update(self, catalog_fn, force=False):
+        st = os.stat(catalog_fn)
+        stamp = "{}:{}:{}".format(os.path.abspath(catalog_fn), st.st_size, st.st_mtime_ns)
+        if not force and self.get_meta("stamp") == stamp:
+            return None
+        with open(catalog_fn) as f:
+            header = f.readline().rstrip("\n").lstrip("#")
+            lines = {}
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip() == "" or line.startswith("#"):
+                    continue
+                lines[hashlib.sha1(line.encode("utf8")).hexdigest()] = line
+        if header != self.header:
+            self.create(header)
+        old = set(h for (h,) in self.db.execute("SELECT line_hash FROM catalog"))
+        removed = old - lines.keys()
+        added = [h for h in lines if h not in old]
+        self.db.executemany("DELETE FROM catalog WHERE line_hash=?", ((h,) for h in removed))
+        n = len(self.columns)
+        placeholders = ", ".join(["?"] * (n + 2))
+        def rows():
+            for h in added:
+                fields = lines[h].split("\t")
+                fields = (fields + [""] * n)[:n]
+                yield [h, lines[h]] + fields
+        self.db.executemany("INSERT INTO catalog VALUES ({})".format(placeholders), rows())
+        self.set_meta("stamp", stamp)
+        self.db.commit()
+        return len(added), len(removed)
+
+    # Apply delta file written by catalog_diff.py, rather than reading the whole new catalog.  Removed rows are
+    # deleted by line, modified and updated ones replaced by uuid.  Returns (added, removed) row counts.  The stamp
+    # is cleared, so that the next update from a catalog file compares all rows
+    def apply_delta(self, delta_fn):
+        if self.header is None:
+            raise ValueError("Index {} is empty; create it from a catalog with -u first".format(self.path))
+        with open(delta_fn) as f:
+            header = f.readline().rstrip("\n").split("\t", 2)
+            if header[:2] != ["change", "changed_fields"] or len(header) < 3:
+                raise ValueError("{} is not a catalog delta file".format(delta_fn))
+            if header[2] != self.header:
+                raise ValueError("Header of delta {} differs from that of index {}".format(delta_fn, self.path))
+            records = [line.rstrip("\n").split("\t", 2) for line in f if line.strip() != ""]
+        n = len(self.columns)
+        placeholders = ", ".join(["?"] * (n + 2))
+        added = removed = 0
+        for change, changed, line in records:
+            h = hashlib.sha1(line.encode("utf8")).hexdigest()
+            if change == "removed":
+                removed += self.db.execute("DELETE FROM catalog WHERE line_hash=?", (h,)).rowcount
+                continue
+            if change in ("modified", "updated"):
+                uuid = line.split("\t")[self.columns.index("uuid")]
+                removed += self.db.execute("DELETE FROM catalog WHERE uuid=?", (uuid,)).rowcount
+            elif change != "added":
+                raise ValueError("{}: unknown change {}".format(delta_fn, change))
+            fields = (line.split("\t") + [""] * n)[:n]
+            added += self.db.execute("INSERT OR REPLACE INTO catalog VALUES ({})".format(placeholders), [h, line] + fields).rowcount
+        self.set_meta("stamp", "")
+        self.db.commit()
+        return added, removed
+
+    # Returns catalog lines where FIELD equals value, or starts with value if prefix is True.
+    # Lines are in order of field value, then line
+    def lookup(self, field, value, prefix=False):
+        if self.header is None:
+            raise ValueError("Index {} is empty".format(self.path))
+        if field not in INDEX_FIELDS:
+            raise ValueError("Unknown field {}.  Indexed fields are {}".format(field, ", ".join(INDEX_FIELDS)))
+        if prefix and value:
+            sql = 'SELECT line FROM catalog WHERE "{0}" >= ? AND "{0}" < ? ORDER BY "{0}", line'.format(field)
+            args = (value, prefix_upper(value))
+        elif prefix:
+            sql = 'SELECT line FROM catalog ORDER BY "{0}", line'.format(field)
+            args = ()
+        else:
+            sql = 'SELECT line FROM catalog WHERE "{0}" = ? ORDER BY line'.format(field)
+            args = (value,)
+        return [line for (line,) in self.db.execute(sql, args)]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM catalog").fetchone()[0] if self.header is not None else 0
+
+def read_values(fn):
+    f = sys.stdin if fn == "-" else open(fn)
+    values = [line.rstrip("\n") for line in f if line.strip() != ""]
+    if f is not sys.stdin:
+        f.close()
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query index of Catalog3 file")
+    parser.add_argument("index_fn", help="Index database, e.g., results/CPTAC3.Catalog3.sqlite")
+    parser.add_argument("values", nargs="*", help="Values to look up")
+    parser.add_argument("-u", "--update", dest="catalog_fn", help="Create or update index from this Catalog3 file")
+    parser.add_argument("-D", "--delta", dest="delta_fn", help="Update index with delta file written by catalog_diff.py")
+    parser.add_argument("-U", "--force", action="store_true", help="Update index even if catalog appears unchanged")
+    parser.add_argument("-f", "--field", dest="field", default="uuid", help="Field to look up: {}.  Default uuid".format(", ".join(INDEX_FIELDS)))
+    parser.add_argument("-p", "--prefix", action="store_true", help="Find entries where field starts with given values")
+    parser.add_argument("-F", "--values-file", dest="values_fn", help="Read values to look up from file, one per line.  Use '-' for stdin")
+    parser.add_argument("-n", "--no-header", action="store_true", help="Do not print header")
+
+    args = parser.parse_args()
+
+    if args.catalog_fn is None and not os.path.exists(args.index_fn):
+        eprint("ERROR: Index {} does not exist".format(args.index_fn))
+        sys.exit(1)
+    index = CatalogIndex(args.index_fn)
+    try:
+        if args.catalog_fn is not None:
+            result = index.update(args.catalog_fn, args.force)
+            if result is None:
+                eprint("Catalog {} unchanged.  Index {} has {} entries".format(args.catalog_fn, args.index_fn, index.count()))
+            else:
+                eprint("Updated index {}: {} rows added, {} removed, {} total".format(args.index_fn, result[0], result[1], index.count()))
+        if args.delta_fn is not None:
+            result = index.apply_delta(args.delta_fn)
+            eprint("Applied delta {} to index {}: {} rows added, {} removed, {} total".format(args.delta_fn, args.index_fn, result[0], result[1], index.count()))
+
+        values = list(args.values)
+        if args.values_fn is not None:
+            values += read_values(args.values_fn)
+        if values:
+            if not args.no_header:
+                print(index.header)
+            for value in values:
+                for line in index.lookup(args.field, value, args.prefix):
+                    print(line)
+    except ValueError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
@@ -0,0 +1,157 @@
+import json, glob
+import pandas as pd
+import argparse, sys, os
+from make_catalog3 import CATALOG_HEADER, METADATA_KEYS
+
+# Write Catalog3 data as a Parquet dataset
+#
+# The TSV catalog represents all values as strings, including `filesize` and the `metadata` JSON.  Here the same
+# columns are written with proper types:
+# * `filesize` is int64
+# * low-cardinality columns (disease, experimental_strategy, data_format, sample_type, alignment) are dictionary-encoded
+# * `metadata` is a struct with one string field per metadata key (see METADATA_KEYS in make_catalog3.py), which
+#   is null where the key is absent from the JSON
+# * empty values are null
+#
+# The dataset is partitioned by disease and experimental strategy in hive layout, e.g.,
+#   PARQUET_DIR/disease=CCRCC/experimental_strategy=WXS/C3L-00004.submitted_reads-0.parquet
+# so that consumers can read only the slices they need:
+#   pyarrow.dataset.dataset(PARQUET_DIR, partitioning="hive").to_table(filter=pc.field("disease") == "CCRCC")
+#
+# Files in the dataset are named after the BASENAME given when writing.  Before writing, files with that name are
+# removed from all partitions, so that writing again with the same name replaces them even if rows moved to another
+# partition.  make_catalog3.py also removes files written with other names for the same project or case, e.g., by
+# a run with another memory budget or in the other mode (see remove_parquet there).  pyarrow is imported only when
+# Parquet output is requested, so that it is not required otherwise.
+#
+# Usage as a script converts existing Catalog3 TSV files, e.g., the merged project catalog:
+#   python src/catalog_parquet.py -o results/CPTAC3.Catalog3.parquet results/CPTAC3.Catalog3.tsv
+
+DICTIONARY_COLUMNS = ['disease', 'experimental_strategy', 'data_format', 'sample_type', 'alignment']
+PARTITION_COLUMNS = ['disease', 'experimental_strategy']
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow.  Install with `pip install pyarrow`")
+    return pyarrow
+
+def get_schema(pa):
+    fields = []
+    for col in CATALOG_HEADER:
+        if col == 'filesize':
+            t = pa.int64()
+        elif col == 'metadata':
+            t = pa.struct([pa.field(key, pa.string()) for key in METADATA_KEYS])
+        elif col in DICTIONARY_COLUMNS:
+            t = pa.dictionary(pa.int32(), pa.string())
+        else:
+            t = pa.string()
+        fields.append(pa.field(col, t))
+    return pa.schema(fields)
+
+# Values of series as list, with NaN and empty strings as None
+def to_list(s):
+    s = s.astype(object)
+    return s.where(s.notna() & (s != ""), None).tolist()
+
+# Returns pyarrow Table from catalog data.  Metadata struct fields are taken from columns of CD with the same
+# name as the metadata keys, if present, and from the `metadata` JSON column otherwise.
+def to_table(cd):
+    pa = import_pyarrow()
+    schema = get_schema(pa)
+    arrays = []
+    for field in schema:
+        col = field.name
+        if col == 'metadata':
+            children = [pa.array(to_list(get_metadata_field(cd, key)), pa.string()) for key in METADATA_KEYS]
+            arrays.append(pa.StructArray.from_arrays(children, fields=list(field.type)))
+        elif col == 'filesize':
+            arrays.append(pa.array([None if v is None else int(v) for v in to_list(cd[col])], pa.int64()))
+        elif col in DICTIONARY_COLUMNS:
+            arrays.append(pa.array(to_list(cd[col]), pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(to_list(cd[col]), pa.string()))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def get_metadata_field(cd, key):
+    if key in cd.columns:
+        return cd[key]
+    if '_metadata' not in cd.columns:
+        cd['_metadata'] = cd['metadata'].map(json.loads)
+    return cd['_metadata'].map(lambda d: d.get(key))
+
+# Files of dataset OUTD written with any of the given basenames, in all partitions.  Basenames are glob patterns
+def dataset_files(outd, basenames):
+    fns = set()
+    for basename in basenames:
+        fns.update(glob.glob(os.path.join(glob.escape(outd), "**", basename + "-*.parquet"), recursive=True))
+    return sorted(fns)
+
+# Remove files of dataset OUTD written with any of the given basenames, and partition directories left empty
+def remove_files(outd, basenames):
+    for fn in dataset_files(outd, basenames):
+        os.remove(fn)
+        d = os.path.dirname(fn)
+        while os.path.abspath(d) != os.path.abspath(outd) and not os.listdir(d):
+            os.rmdir(d)
+            d = os.path.dirname(d)
+
+# Write catalog data to Parquet dataset OUTD, partitioned by disease and experimental strategy.  Existing files
+# with the same basename are replaced
+def write_parquet(outd, cd, basename):
+    pa = import_pyarrow()
+    table = to_table(cd)
+    remove_files(outd, [glob.escape(basename)])
+    print("Writing Parquet catalog to {}/**/{}-*.parquet".format(outd, basename))
+    pa.dataset.write_dataset(table, outd, format="parquet", partitioning=PARTITION_COLUMNS, partitioning_flavor="hive",
+        basename_template=basename + "-{i}.parquet", existing_data_behavior="overwrite_or_ignore")
+
+# Value of Parquet column as TSV text, as written to the TSV catalog.  Metadata struct is written as JSON with
+# keys in order of METADATA_KEYS, skipping null values, as get_metadata_json() in make_catalog3.py does
+def to_text(col, v):
+    if v is None:
+        return ""
+    if col == 'metadata':
+        return "{" + ", ".join('"' + key + '": ' + json.dumps(v[key]) for key in METADATA_KEYS if v.get(key) not in (None, "")) + "}"
+    return str(v)
+
+# Generator of Catalog3 TSV lines, without header, of Parquet dataset in directory PATH
+def iter_lines(path):
+    pa = import_pyarrow()
+    dataset = pa.dataset.dataset(path, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(columns=CATALOG_HEADER):
+        columns = [[to_text(col, v) for v in batch.column(i).to_pylist()] for i, col in enumerate(CATALOG_HEADER)]
+        for row in zip(*columns):
+            yield "\t".join(row)
+
+def count_rows(path):
+    pa = import_pyarrow()
+    return pa.dataset.dataset(path, format="parquet", partitioning="hive").count_rows()
+
+# Read Catalog3 TSV file as strings; empty fields are NaN while "NA" is retained as a string
+def read_catalog(fn):
+    return pd.read_csv(fn, sep="\t", dtype=str, keep_default_na=False, na_values=[""])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Catalog3 TSV files to a partitioned Parquet dataset")
+    parser.add_argument("catalogs", nargs="+", help="Catalog3 TSV files")
+    parser.add_argument("-o", "--output", dest="outd", required=True, help="Parquet dataset directory")
+    parser.add_argument("-n", "--name", dest="basename", help="Base name of Parquet files, if one catalog is given.  Default is name of catalog file, without extension")
+
+    args = parser.parse_args()
+    if args.basename and len(args.catalogs) > 1:
+        parser.error("-n may be given only with one catalog")
+
+    for fn in args.catalogs:
+        cd = read_catalog(fn)
+        if cd.empty:
+            eprint("Catalog {} is empty.  Skipping".format(fn))
+            continue
+        basename = args.basename or os.path.splitext(os.path.basename(fn))[0]
+        write_parquet(args.outd, cd, basename)
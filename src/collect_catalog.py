@@ -0,0 +1,219 @@
+import json, heapq, itertools
+import argparse, sys, os
+from concurrent.futures import ThreadPoolExecutor
+from make_catalog3 import eprint, read_cases, CATALOG_HEADER, READS_FILES, METHYLATION_FILES
+
+# Collect per-case Catalog3 or Demographics files into one project file
+#
+# collect_catalog3 in process_catalog.sh and collect_demographics in process_demographics.sh append the files of
+# each case in turn to the output.  Here
+# * the files of each case (a "shard") are read in parallel, checked, sorted and deduplicated
+# * shards are combined with a k-way merge, so that output rows are sorted by byte value (as with LC_ALL=C sort)
+#   regardless of the order of cases.  Rows of Catalog3 with the same uuid are written once; the first in sort
+#   order is kept.  Rows of Demographics are deduplicated as whole rows
+# * the output is written to a temporary file which then replaces it, so that readers never see a partial file
+# * every file must have the same header, and every row as many fields as the header, with case column equal to
+#   the case of the shard.  Otherwise nothing is written
+#
+# The size and modification time of the files of each case are recorded in a manifest, OUTFN.manifest.json.  On
+# the next collection, only cases whose files changed, and cases which were added or removed, are read; rows of
+# all other cases are taken from the previous output, which is merged with the changed shards.  The output is
+# collected from all shards if the manifest or output is missing or the output changed since, or if rows of
+# different cases had the same uuid in the previous collection (since rows dropped then may be needed now).
+#
+# Usage:
+#   python src/collect_catalog.py -k catalog3 -L logs -o results/CPTAC3.Catalog3.tsv dat/cases.dat
+
+WORKERS = 8
+
+# Per-case files of each kind of output, relative to LOGBASE/outputs/CASE, and column used for deduplication
+# (None for whole row).  Catalog3 cases with is_empty.flag are skipped, as in collect_catalog3
+KINDS = {
+    "catalog3": {"files": [out_fn for in_fn, out_fn in READS_FILES + METHYLATION_FILES], "key": "uuid",
+        "header": CATALOG_HEADER, "skip_empty": True},
+    "demographics": {"files": ["demographics.dat"], "key": None, "header": None, "skip_empty": False},
+}
+
+# Size and modification time of each file, to detect changes
+def fingerprint(fns):
+    fp = {}
+    for fn in fns:
+        st = os.stat(fn)
+        fp[fn] = [st.st_size, st.st_mtime_ns]
+    return fp
+
+# Returns list of existing files of case, or None if case is skipped
+def get_case_files(case, logbase, kind):
+    datd = os.path.join(logbase, "outputs", case)
+    if KINDS[kind]["skip_empty"] and os.path.exists(os.path.join(datd, "is_empty.flag")):
+        return None
+    fns = [os.path.join(datd, fn) for fn in KINDS[kind]["files"] if os.path.exists(os.path.join(datd, fn))]
+    if not fns and kind == "demographics":
+        eprint("WARNING: Demographics file {} for case {} does not exist".format(os.path.join(datd, "demographics.dat"), case))
+    return fns
+
+# Yields rows of sorted ROWS, skipping those whose key was seen before.  seen is dictionary key -> case, and
+# counts is dictionary with number of rows dropped as "same_case" or "other_case" duplicates
+def unique_rows(rows, key_ix, case_ix, seen, counts):
+    for row in rows:
+        fields = row.split("\t")
+        key = row if key_ix is None else fields[key_ix]
+        if key in seen:
+            counts["same_case" if seen[key] == fields[case_ix] else "other_case"] += 1
+            continue
+        seen[key] = fields[case_ix]
+        yield row
+
+class Shard:
+    def __init__(self, case, fns):
+        self.case = case
+        self.fns = fns
+        self.header = None
+        self.rows = []
+        self.duplicates = 0
+
+    # Read all files of case, checking header and number of fields, and sort and deduplicate rows
+    def read(self, key):
+        rows = []
+        for fn in self.fns:
+            with open(fn) as f:
+                lines = f.read().split("\n")
+            if lines == [""]:
+                continue
+            header = lines[0].split("\t")
+            if self.header is None:
+                self.header = header
+            elif header != self.header:
+                raise ValueError("Header of {} differs from that of {}".format(fn, self.fns[0]))
+            case_ix = header.index("case") if "case" in header else None
+            if case_ix is None or (key is not None and key not in header):
+                raise ValueError("{}: header lacks case{} column".format(fn, "" if key is None else " or " + key))
+            for i, line in enumerate(lines[1:], 2):
+                if line.strip() == "":
+                    continue
+                fields = line.split("\t")
+                if len(fields) != len(header):
+                    raise ValueError("{}:{}: expected {} fields, found {}".format(fn, i, len(header), len(fields)))
+                if fields[case_ix] != self.case:
+                    raise ValueError("{}:{}: row of case {} in file of case {}".format(fn, i, fields[case_ix], self.case))
+                rows.append(line)
+        rows.sort()
+        if self.header is not None:
+            key_ix = None if key is None else self.header.index(key)
+            counts = {"same_case": 0, "other_case": 0}
+            self.rows = list(unique_rows(rows, key_ix, self.header.index("case"), {}, counts))
+            self.duplicates = counts["same_case"]
+        return self
+
+def read_manifest(fn):
+    if not os.path.exists(fn):
+        return None
+    with open(fn) as f:
+        return json.load(f)
+
+# Written to a temporary file first, so that an interrupted write leaves the previous file in place
+def write_atomic(fn, lines):
+    tmp_fn = fn + ".tmp"
+    with open(tmp_fn, 'w') as f:
+        for line in lines:
+            f.write(line + "\n")
+    os.replace(tmp_fn, fn)
+
+# Rows of previous output, without header, excluding those of given cases
+def previous_rows(outfn, case_ix, exclude):
+    with open(outfn) as f:
+        if next(f, None) is None:
+            return
+        for line in f:
+            line = line.rstrip("\n")
+            if line.split("\t")[case_ix] not in exclude:
+                yield line
+
+# Reason the previous output cannot be reused, or None if it can
+def check_previous(manifest, kind, outfn):
+    if manifest is None:
+        return "no manifest"
+    if manifest.get("kind") != kind:
+        return "manifest is of {}".format(manifest.get("kind"))
+    if KINDS[kind]["header"] is not None and manifest.get("header") != KINDS[kind]["header"]:
+        return "header changed since last collection"
+    if not os.path.exists(outfn) or fingerprint([outfn])[outfn] != manifest.get("output"):
+        return "{} changed since last collection".format(outfn)
+    if manifest.get("other_case_duplicates", 0) > 0:
+        return "rows of different cases had the same {}".format(KINDS[kind]["key"])
+    return None
+
+def collect(cases_fn, logbase, kind, outfn, manifest_fn=None, workers=WORKERS, rebuild=False, verbose=False):
+    manifest_fn = manifest_fn or outfn + ".manifest.json"
+    key = KINDS[kind]["key"]
+    case_files = {}
+    for case, disease in read_cases(cases_fn):
+        fns = get_case_files(case, logbase, kind)
+        if fns is not None:
+            case_files[case] = fns
+    fingerprints = {case: fingerprint(fns) for case, fns in case_files.items()}
+
+    manifest = None if rebuild else read_manifest(manifest_fn)
+    reason = "rebuild requested" if rebuild else check_previous(manifest, kind, outfn)
+    if reason is None:
+        changed = [case for case in case_files if fingerprints[case] != manifest["cases"].get(case)]
+        removed = [case for case in manifest["cases"] if case not in case_files]
+        eprint("{} of {} cases changed, {} removed since last collection".format(len(changed), len(case_files), len(removed)))
+        if not changed and not removed:
+            eprint("{} is up to date".format(outfn))
+            return
+    else:
+        changed, removed = list(case_files), []
+        eprint("Collecting all {} cases: {}".format(len(changed), reason))
+
+    # Files are read in parallel; shards are in order of cases
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shards = list(executor.map(lambda case: Shard(case, case_files[case]).read(key), changed))
+
+    header = KINDS[kind]["header"] or (manifest["header"] if reason is None else None)
+    for shard in shards:
+        if shard.header is None:
+            continue
+        if header is None:
+            header = shard.header
+        elif shard.header != header:
+            raise ValueError("Header of {} differs from expected: {}".format(shard.fns[0], "\t".join(header)))
+        if verbose and shard.duplicates:
+            eprint("{}: {} duplicate rows".format(shard.case, shard.duplicates))
+
+    streams = [shard.rows for shard in shards]
+    if reason is None and header is not None:
+        streams.append(previous_rows(outfn, header.index("case"), set(changed) | set(removed)))
+    counts = {"same_case": 0, "other_case": 0}
+    if header is None:
+        write_atomic(outfn, [])
+    else:
+        key_ix = None if key is None else header.index(key)
+        rows = unique_rows(heapq.merge(*streams), key_ix, header.index("case"), {}, counts)
+        write_atomic(outfn, itertools.chain(["\t".join(header)], rows))
+    if counts["other_case"]:
+        eprint("WARNING: {} rows dropped with {} of rows of other cases".format(counts["other_case"], key))
+
+    manifest = {"kind": kind, "header": header, "output": fingerprint([outfn])[outfn],
+        "other_case_duplicates": counts["other_case"], "cases": fingerprints}
+    write_atomic(manifest_fn, [json.dumps(manifest)])
+    eprint("Collected {} cases into {}".format(len(case_files), outfn))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect per-case Catalog3 or Demographics files into one sorted, deduplicated project file")
+    parser.add_argument("cases_fn", help="TSV file with case name and disease in first and second columns")
+    parser.add_argument("-k", "--kind", dest="kind", choices=list(KINDS), default="catalog3", help="Kind of files to collect.  Default catalog3")
+    parser.add_argument("-L", "--logbase", dest="logbase", default="./logs", help="Base directory of per-case files.  Default ./logs")
+    parser.add_argument("-o", "--output", dest="outfn", required=True, help="Output file, e.g., results/CPTAC3.Catalog3.tsv")
+    parser.add_argument("-m", "--manifest", dest="manifest_fn", help="Manifest of collected files.  Default OUTFN.manifest.json")
+    parser.add_argument("-j", "--workers", dest="workers", type=int, default=WORKERS, help="Number of cases read at once")
+    parser.add_argument("-r", "--rebuild", action="store_true", help="Collect all cases, ignoring manifest")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic information to stderr")
+
+    args = parser.parse_args()
+
+    try:
+        collect(args.cases_fn, args.logbase, args.kind, args.outfn, args.manifest_fn, args.workers, args.rebuild, args.verbose)
+    except (OSError, ValueError) as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
@@ -0,0 +1,164 @@
+import argparse, sys
+from math import ceil
+
+# Hash IDs of CPTAC3 aliquot names, the same as get_CPT_hash.sh obtains with bashids
+#
+# The hash ID is generated with the hashids algorithm (https://hashids.org, v1, as implemented by
+# https://github.com/benwilber/bashids) from the number given by the aliquot name with "CPT", leading 0's and the
+# first "_" removed, e.g., CPT0088230009_1 -> 882300091.  bashids is run with its defaults: no salt, no minimum
+# length, and the alphabet below.
+#
+# The encoder is implemented here so that aliquot hashes may be obtained in-process, rather than by running
+# get_CPT_hash.sh (and bashids) once per aliquot as make_catalog2.sh does.
+#
+# Usage, as with get_CPT_hash.sh:
+#   python src/cpt_hash.py CPT0170510019
+#   python src/cpt_hash.py -d HASH
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890"
+SEPARATORS = "cfhistuCFHISTU"
+RATIO_SEPARATORS = 3.5
+RATIO_GUARDS = 12
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Reorder characters of ALPHABET deterministically according to SALT
+def shuffle(alphabet, salt):
+    if not salt:
+        return alphabet
+    chars = list(alphabet)
+    p = 0
+    for i in range(len(chars) - 1, 0, -1):
+        v = (len(chars) - 1 - i) % len(salt)
+        n = ord(salt[v])
+        p += n
+        j = (n + v + p) % i
+        chars[i], chars[j] = chars[j], chars[i]
+    return "".join(chars)
+
+# Number as string of characters of ALPHABET, most significant first
+def to_digits(number, alphabet):
+    digits = ""
+    while True:
+        digits = alphabet[number % len(alphabet)] + digits
+        number //= len(alphabet)
+        if number == 0:
+            return digits
+
+def from_digits(digits, alphabet):
+    number = 0
+    for c in digits:
+        number = number * len(alphabet) + alphabet.index(c)
+    return number
+
+class Hashids:
+    def __init__(self, salt="", min_length=0, alphabet=ALPHABET):
+        self.salt = salt
+        self.min_length = min_length
+        # Separators are taken out of the alphabet, and then guards, in proportions given by the ratios
+        separators = "".join(c for c in SEPARATORS if c in alphabet)
+        alphabet = "".join(c for i, c in enumerate(alphabet) if alphabet.index(c) == i and c not in separators)
+        if len(alphabet) + len(separators) < 16:
+            raise ValueError("Alphabet must contain at least 16 unique characters")
+        separators = shuffle(separators, salt)
+        missing = int(ceil(len(alphabet) / RATIO_SEPARATORS)) - len(separators)
+        if missing > 0:
+            separators += alphabet[:missing]
+            alphabet = alphabet[missing:]
+        alphabet = shuffle(alphabet, salt)
+        n_guards = int(ceil(len(alphabet) / RATIO_GUARDS))
+        if len(alphabet) < 3:
+            self.guards, self.separators, self.alphabet = separators[:n_guards], separators[n_guards:], alphabet
+        else:
+            self.guards, self.separators, self.alphabet = alphabet[:n_guards], separators, alphabet[n_guards:]
+
+    # Hash ID of one or more non-negative integers
+    def encode(self, *numbers):
+        if not numbers or any(n < 0 for n in numbers):
+            raise ValueError("Only non-negative integers can be encoded: {}".format(numbers))
+        alphabet = self.alphabet
+        numbers_hash = sum(n % (i + 100) for i, n in enumerate(numbers))
+        lottery = alphabet[numbers_hash % len(alphabet)]
+        encoded = lottery
+        for i, n in enumerate(numbers):
+            alphabet = shuffle(alphabet, (lottery + self.salt + alphabet)[:len(alphabet)])
+            digits = to_digits(n, alphabet)
+            encoded += digits
+            if i < len(numbers) - 1:
+                encoded += self.separators[n % (ord(digits[0]) + i) % len(self.separators)]
+        if len(encoded) < self.min_length:
+            encoded = self.pad(encoded, alphabet, numbers_hash)
+        return encoded
+
+    # Guards, and then alphabet characters, are added around hash ID shorter than min_length
+    def pad(self, encoded, alphabet, numbers_hash):
+        encoded = self.guards[(numbers_hash + ord(encoded[0])) % len(self.guards)] + encoded
+        if len(encoded) < self.min_length:
+            encoded += self.guards[(numbers_hash + ord(encoded[2])) % len(self.guards)]
+        half = len(alphabet) // 2
+        while len(encoded) < self.min_length:
+            alphabet = shuffle(alphabet, alphabet)
+            encoded = alphabet[half:] + encoded + alphabet[:half]
+            excess = len(encoded) - self.min_length
+            if excess > 0:
+                encoded = encoded[excess // 2:excess // 2 + self.min_length]
+        return encoded
+
+    # Returns tuple of integers encoded by hash ID.  Raises ValueError if it is not a valid hash ID
+    def decode(self, hashid):
+        parts = "".join("|" if c in self.guards else c for c in hashid).split("|")
+        body = parts[1] if 2 <= len(parts) <= 3 else parts[0]
+        if not body:
+            raise ValueError("Invalid hash ID: {}".format(hashid))
+        lottery, alphabet = body[0], self.alphabet
+        numbers = []
+        for digits in "".join("|" if c in self.separators else c for c in body[1:]).split("|"):
+            alphabet = shuffle(alphabet, (lottery + self.salt + alphabet)[:len(alphabet)])
+            if not digits or any(c not in alphabet for c in digits):
+                raise ValueError("Invalid hash ID: {}".format(hashid))
+            numbers.append(from_digits(digits, alphabet))
+        if self.encode(*numbers) != hashid:
+            raise ValueError("Invalid hash ID: {}".format(hashid))
+        return tuple(numbers)
+
+# Number encoded for aliquot name, as in get_CPT_hash.sh: "CPT" and any leading 0's are removed, and then the
+# first "_" (for aliquot names like CPT0088230009_1).  Raises ValueError if the remainder is not a number
+def cpt_number(aliquot_name):
+    anum = aliquot_name[len("CPT"):].lstrip("0").replace("_", "", 1)
+    if not anum.isdigit() or not anum.isascii():
+        raise ValueError("Aliquot name {} does not give a number to encode: {}".format(aliquot_name, anum))
+    return int(anum)
+
+# Hash IDs of aliquot names.  Each distinct name is encoded once
+class CPTHash:
+    def __init__(self, hashids=None):
+        self.hashids = hashids or Hashids()
+        self.hashes = {}
+
+    # Returns "" with a warning if name does not start with CPT, as get_CPT_hash.sh does
+    def get_hash(self, aliquot_name):
+        if aliquot_name not in self.hashes:
+            if not aliquot_name.startswith("CPT"):
+                eprint("WARNING: Aliquot name does not start with CPT.  Will not generate a suffix")
+                self.hashes[aliquot_name] = ""
+            else:
+                self.hashes[aliquot_name] = self.hashids.encode(cpt_number(aliquot_name))
+        return self.hashes[aliquot_name]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Obtain a unique hash of the numerical portion of a string like CPT0170510019")
+    parser.add_argument("cpt_id", help="Aliquot name, or hash ID to decode with -d")
+    parser.add_argument("-d", "--decode", action="store_true", help="Decode into the numerical portion of the original string")
+
+    args = parser.parse_args()
+
+    try:
+        if args.decode:
+            for n in Hashids().decode(args.cpt_id):
+                print(n)
+        else:
+            print(CPTHash().get_hash(args.cpt_id))
+    except ValueError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
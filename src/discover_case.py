@@ -0,0 +1,296 @@
+import json, io, re, threading
+import argparse, sys, os
+from concurrent.futures import ThreadPoolExecutor
+from gdc_client import GDCClient, GDCQueryError, read_token, eprint
+from gdc_cache import GDCCache
+from rate_limit import TokenBucket
+from gdc_batch import (format_row, make_batch_query, sort_unique, is_aligned_strategy, read_group_from_aliquot_query,
+    submitted_reads_from_read_group_query, harmonized_reads_from_submitted_query, methylation_array_from_aliquot_query,
+    READ_GROUP_FIELDS, READS_FIELDS, METHYLATION_FIELDS, SAR_STRATEGIES, SUR_STRATEGIES)
+import parse_aliquot
+import case_traversal
+
+# Discovery of one case as an in-process pipeline
+#
+# process_case.sh runs discovery stages one after another: all aliquots are found before any read groups are
+# queried, all read groups before any submitted reads, and so on.  Here each lookup is a task in a thread pool,
+# started as soon as its parent is known:
+#
+#   aliquots (CPTAC, TCGA) -> read groups of each aliquot -> submitted reads of each read group -> harmonized reads
+#                          -> methylation arrays of each DNA aliquot
+#   demographics
+#
+# so that, e.g., harmonized reads of the first aliquot are queried while read groups of later aliquots are.
+# All queries go through one GDCClient, and so use the query cache, shared rate limit and metrics as configured
+# in the environment (GDC_CACHE, GDC_RATE_LIMIT, GDC_METRICS).  Lookups use the same GraphQL as gdc_batch.py,
+# so cached results are shared with it.
+#
+# With -T, each entity type is instead fetched for the whole case in one query, and joined to parents locally;
+# see case_traversal.py.
+#
+# Results are collected and written once all tasks complete, in the order and format of process_case.sh:
+#   aliquots-CPTAC.dat, aliquots-TCGA.dat, aliquots.dat, [is_empty.flag], read_groups.dat, submitted_reads.dat,
+#   harmonized_reads.dat, methylation_array.dat, demographics.dat
+#
+# Usage:
+#   python src/discover_case.py -O logs/outputs/C3L-00004 -D CCRCC C3L-00004
+
+WORKERS = 8
+
+def aliquot_from_case_query(case, data_model):
+    if data_model == "TCGA":
+        aliquots = "portions { analytes { submitter_id id analyte_type aliquots { submitter_id id annotations { notes } } } }"
+    else:
+        aliquots = "aliquots { submitter_id id analyte_type annotations { notes } }"
+    return '{ sample(with_path_to: {type: "case", submitter_id:"%s"}, first:10000) { submitter_id id sample_type preservation_method %s } }' % (case, aliquots)
+
+def demo_from_case_query(case):
+    return '{ demographic(with_path_to: {type: "case", submitter_id:"%s"}) { ethnicity gender race days_to_birth } }' % case
+
+# get_aliquots.sh and get_demographics.sh parse `echo $R`, in which runs of whitespace are collapsed
+def echo_unquoted(R):
+    return re.sub(r'[ \t\n]+', ' ', R).strip(' ')
+
+class CasePipeline:
+    def __init__(self, client, case, disease="unknown", workers=WORKERS, verbose=False):
+        self.client = client
+        self.case = case
+        self.disease = disease
+        self.verbose = verbose
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.pending = 0
+        self.error = None
+        # Results, keyed by line of the parent file
+        self.aliquots = {}          # data model -> list of aliquots.dat lines
+        self.read_groups = {}       # aliquots.dat line -> read_groups.dat lines
+        self.submitted = {}         # read_groups.dat line -> submitted_reads.dat lines
+        self.harmonized = {}        # submitted_reads.dat line -> harmonized_reads.dat lines
+        self.methylation = {}       # aliquots.dat line -> methylation_array.dat lines
+        self.demographics = None
+
+    # Run func(*args) in the thread pool.  The first error stops the pipeline and is raised by run()
+    def spawn(self, func, *args):
+        with self.lock:
+            if self.error is not None:
+                return
+            self.pending += 1
+        self.executor.submit(self.task, func, *args)
+
+    def task(self, func, *args):
+        try:
+            func(*args)
+        except BaseException as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.done.notify_all()
+
+    # Returns list of entities from a single lookup, aliased q0 as in gdc_batch.py
+    def lookup(self, subquery):
+        return json.loads(self.client.run_query_retry(make_batch_query([subquery])))['data']['q0'] or []
+
+    # Record value for key in results dictionary, returning False if key was already seen
+    def claim(self, results, key):
+        with self.lock:
+            if key in results:
+                return False
+            results[key] = []
+            return True
+
+    def get_aliquots(self, data_model):
+        R = echo_unquoted(self.client.run_query_retry(aliquot_from_case_query(self.case, data_model)))
+        records = parse_aliquot.iter_aliquots(parse_aliquot.iter_samples(io.StringIO(R)), self.case, data_model)
+        lines = ["\t".join(r) for r in records]
+        with self.lock:
+            self.aliquots[data_model] = lines
+        self.found_aliquots(lines)
+
+    def found_aliquots(self, lines):
+        for line in lines:
+            # The same aliquot may be found in both data models
+            if self.claim(self.read_groups, line):
+                self.spawn(self.get_read_groups, line)
+                if line.split("\t")[7] == "DNA":
+                    self.methylation[line] = []
+                    self.spawn(self.get_methylation_array, line)
+
+    def get_read_groups(self, aliquot_line):
+        r = aliquot_line.split("\t")
+        lines = [format_row([r[0], r[5]], rg, READ_GROUP_FIELDS) for rg in self.lookup(read_group_from_aliquot_query(r[5]))]
+        self.read_groups[aliquot_line] = lines
+        for line in lines:
+            rg = line.split("\t")
+            if rg[3] not in SAR_STRATEGIES and rg[3] not in SUR_STRATEGIES:
+                raise ValueError("Unknown Experimental Strategy {}. CASE = {} Aliquot = {} Read Group = {}".format(rg[3], rg[0], rg[1], rg[2]))
+            if self.claim(self.submitted, line):
+                self.spawn(self.get_submitted_reads, line)
+
+    def get_submitted_reads(self, read_group_line):
+        CASE, ASID, RGSID, ES = read_group_line.split("\t")[:4]
+        alignment = "submitted_aligned" if is_aligned_strategy(ES) else "submitted_unaligned"
+        srs = self.lookup(submitted_reads_from_read_group_query(RGSID, is_aligned_strategy(ES)))
+        lines = [format_row([CASE, ASID, alignment], sr, READS_FIELDS) for sr in srs]
+        self.submitted[read_group_line] = lines
+        for line in lines:
+            # A submitted file may belong to several read groups
+            if self.claim(self.harmonized, line):
+                self.spawn(self.get_harmonized_reads, line)
+
+    def get_harmonized_reads(self, submitted_line):
+        r = submitted_line.split("\t")
+        ars = self.lookup(harmonized_reads_from_submitted_query(r[7], is_aligned_strategy(r[3])))
+        self.harmonized[submitted_line] = [format_row([r[0], r[1], "harmonized"], ar, READS_FIELDS) for ar in ars]
+
+    def get_methylation_array(self, aliquot_line):
+        r = aliquot_line.split("\t")
+        mas = self.lookup(methylation_array_from_aliquot_query(r[5]))
+        self.methylation[aliquot_line] = [format_row([r[0], r[5], "NA"], ma, METHYLATION_FIELDS) for ma in mas]
+
+    def get_demographics(self):
+        R = echo_unquoted(self.client.run_query_retry(demo_from_case_query(self.case)))
+        demographics = json.loads(R)['data']['demographic'] or []
+        fields = ["ethnicity", "gender", "race", "days_to_birth"]
+        self.demographics = [format_row([self.case, self.disease], d, fields) for d in demographics]
+
+    def start(self):
+        self.spawn(self.get_aliquots, "CPTAC")
+        self.spawn(self.get_aliquots, "TCGA")
+        self.spawn(self.get_demographics)
+
+    # Called once all tasks complete
+    def finish(self):
+        pass
+
+    # Start discovery and wait for all tasks to complete
+    def run(self):
+        try:
+            self.start()
+            with self.lock:
+                while self.pending > 0 and self.error is None:
+                    self.done.wait()
+        except KeyboardInterrupt:
+            self.error = KeyboardInterrupt()
+        if self.error is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            raise self.error
+        self.executor.shutdown()
+        self.finish()
+        if self.verbose:
+            eprint("{}: {} aliquots, {} read groups, {} submitted reads, {} harmonized reads".format(self.case,
+                len(self.read_groups), len(self.submitted), len(self.harmonized), sum(len(v) for v in self.harmonized.values())))
+
+    # Write discovery files to OUTD, as process_case.sh does
+    def write(self, outd):
+        header = "\t".join(parse_aliquot.get_header(self.case))
+        for data_model in ("CPTAC", "TCGA"):
+            write_lines(os.path.join(outd, "aliquots-{}.dat".format(data_model)), [header] + self.aliquots[data_model])
+        # Merge the CPTAC and TCGA aliquots, respecting the header line
+        aliquot_lines = sort_unique(self.aliquots["CPTAC"] + self.aliquots["TCGA"])
+        write_lines(os.path.join(outd, "aliquots.dat"), [header] + aliquot_lines)
+
+        if not aliquot_lines:
+            eprint("NOTE: {} is empty.  Skipping case".format(os.path.join(outd, "aliquots.dat")))
+            touch(os.path.join(outd, "is_empty.flag"))
+        else:
+            read_group_lines = [l for a in aliquot_lines for l in self.read_groups[a]]
+            if not read_group_lines:
+                eprint("WARNING: {} is empty / not written.  Will skip this case".format(os.path.join(outd, "read_groups.dat")))
+                touch(os.path.join(outd, "is_empty.flag"))
+            else:
+                write_lines(os.path.join(outd, "read_groups.dat"), read_group_lines)
+                submitted_lines = sort_unique([l for rg in read_group_lines for l in self.submitted[rg]])
+                write_lines(os.path.join(outd, "submitted_reads.dat"), submitted_lines)
+                harmonized_lines = [l for sr in submitted_lines for l in self.harmonized[sr]]
+                if harmonized_lines:
+                    write_lines(os.path.join(outd, "harmonized_reads.dat"), harmonized_lines)
+            methylation_lines = [l for a in aliquot_lines if a in self.methylation for l in self.methylation[a]]
+            if methylation_lines:
+                write_lines(os.path.join(outd, "methylation_array.dat"), methylation_lines)
+
+        # get_demographics.sh writes an empty line if there are no demographics
+        write_lines(os.path.join(outd, "demographics.dat"), ["case\tdisease\tethnicity\tgender\trace\tdays_to_birth", "\n".join(self.demographics)])
+
+# Discovery with case-level traversal queries.  Read groups, submitted and harmonized reads and methylation arrays
+# of the case are fetched concurrently with aliquots, and joined once all are known
+class CaseTraversalPipeline(CasePipeline):
+    def __init__(self, client, case, disease="unknown", workers=WORKERS, verbose=False, page_size=case_traversal.PAGE_SIZE):
+        super().__init__(client, case, disease, workers, verbose)
+        self.page_size = page_size
+        self.entities = {}
+
+    def found_aliquots(self, lines):
+        pass
+
+    def get_entities(self, entity):
+        self.entities[entity] = case_traversal.fetch_case_entities(self.client, entity, self.case, self.page_size, self.verbose)
+
+    def start(self):
+        super().start()
+        for entity in case_traversal.CASE_ENTITIES:
+            self.spawn(self.get_entities, entity)
+
+    def finish(self):
+        aliquot_lines = set(self.aliquots["CPTAC"] + self.aliquots["TCGA"])
+        self.read_groups = case_traversal.join_read_groups(aliquot_lines, self.entities["read_group"])
+        read_group_lines = set(l for v in self.read_groups.values() for l in v)
+        self.submitted = case_traversal.join_submitted_reads(read_group_lines, self.entities["submitted_aligned_reads"],
+            self.entities["submitted_unaligned_reads"])
+        submitted_lines = set(l for v in self.submitted.values() for l in v)
+        self.harmonized = case_traversal.join_harmonized_reads(submitted_lines, self.entities["aligned_reads"])
+        self.methylation = case_traversal.join_methylation_array(aliquot_lines, self.entities["raw_methylation_array"])
+
+# Remove output of earlier discovery in OUTD
+def clear_outputs(outd):
+    for fn in ["aliquots.dat", "is_empty.flag", "read_groups.dat", "submitted_reads.dat", "harmonized_reads.dat", "methylation_array.dat", "demographics.dat"]:
+        if os.path.exists(os.path.join(outd, fn)):
+            os.remove(os.path.join(outd, fn))
+
+def touch(fn):
+    open(fn, 'a').close()
+
+def write_lines(fn, lines):
+    with open(fn, 'w') as f:
+        for line in lines:
+            f.write(line + "\n")
+    eprint("Written to " + fn)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discover aliquots, read groups, submitted and harmonized reads, methylation arrays and demographics of a case with concurrent GDC queries")
+    parser.add_argument("case", help="Case name, e.g., C3L-00004")
+    parser.add_argument("-O", "--outd", dest="outd", default="./dat", help="Output directory.  Default ./dat")
+    parser.add_argument("-D", "--disease", dest="disease", default="unknown", help="Disease, written to demographics.dat")
+    parser.add_argument("-t", "--token", dest="token_fn", default=os.environ.get("GDC_TOKEN"), help="Token file.  Default is $GDC_TOKEN")
+    parser.add_argument("-j", "--workers", dest="workers", type=int, default=WORKERS, help="Number of queries run at once")
+    parser.add_argument("-T", "--traverse", action="store_true", help="Fetch each entity type for the whole case at once rather than per parent")
+    parser.add_argument("-P", "--page-size", dest="page_size", type=int, default=case_traversal.PAGE_SIZE, help="With -T, initial number of entities per query")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic information to stderr")
+
+    args = parser.parse_args()
+
+    if args.token_fn is None:
+        eprint("GDC_TOKEN environment variable not defined.  Quitting.")
+        sys.exit(1)
+
+    token = read_token(args.token_fn)
+    client = GDCClient(token, cache=GDCCache.from_environment(token), rate_limit=TokenBucket.from_environment())
+    client.source = "discover_case"
+    os.makedirs(args.outd, exist_ok=True)
+    clear_outputs(args.outd)
+
+    if args.traverse:
+        pipeline = CaseTraversalPipeline(client, args.case, args.disease, args.workers, args.verbose, args.page_size)
+    else:
+        pipeline = CasePipeline(client, args.case, args.disease, args.workers, args.verbose)
+    try:
+        pipeline.run()
+    except (GDCQueryError, ValueError) as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    pipeline.write(args.outd)
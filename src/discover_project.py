@@ -0,0 +1,250 @@
+import json
+import argparse, sys, os
+from concurrent.futures import ThreadPoolExecutor
+from gdc_client import GDCClient, GDCQueryError, read_token, eprint
+from gdc_cache import GDCCache
+from rate_limit import TokenBucket
+from gdc_batch import format_row
+from case_scheduler import read_cases
+from discover_case import CaseTraversalPipeline, echo_unquoted, clear_outputs
+import case_traversal
+import parse_aliquot
+
+# Discovery of all cases of a project with project-wide bulk queries
+#
+# run_discovery.sh queries each case in turn, with one or more queries per aliquot, read group and file.  Here
+# each entity type is fetched for the whole project in pages of up to 10000 entities,
+#     sample(with_path_to: {type: "project", project_id:"CPTAC-3"}, first:10000, offset:0) { ... cases { submitter_id } }
+#     read_group(with_path_to: {type: "project", project_id:"CPTAC-3"}, first:10000, offset:0) { ... aliquots { submitter_id } }
+#     ...
+# with links to parents, as in case_traversal.py.  Entities are assigned to cases through their parents, and the
+# per-case files LOGBASE/outputs/CASE/aliquots.dat, read_groups.dat, ... are written for all cases in the cases
+# file, the same as process_case.sh -p -T would write.
+#
+# Each page is written to PAGES/ENTITY/OFFSET.json as it is received, where PAGES is LOGBASE/pages/PROJECT by
+# default.  An interrupted run resumes after the last page received; use -r to fetch all pages again.  Pages are
+# removed once the per-case files are written, so that the next run fetches all pages again.
+#
+# Usage:
+#   python src/discover_project.py -P CPTAC-3 -L logs dat/cases.dat
+
+WORKERS = 4
+
+# Entity types fetched per project: name of pages directory -> (entity, fields with parent links)
+PROJECT_ENTITIES = {
+    "sample-CPTAC": ("sample", "submitter_id id sample_type preservation_method cases { submitter_id } "
+        "aliquots { submitter_id id analyte_type annotations { notes } }"),
+    "sample-TCGA": ("sample", "submitter_id id sample_type preservation_method cases { submitter_id } "
+        "portions { analytes { submitter_id id analyte_type aliquots { submitter_id id annotations { notes } } } }"),
+    "demographic": ("demographic", "ethnicity gender race days_to_birth cases { submitter_id }"),
+}
+for entity, (fields, links) in case_traversal.CASE_ENTITIES.items():
+    PROJECT_ENTITIES[entity] = (entity, " ".join(fields) + " " + links)
+
+def project_query(name, project, first, offset):
+    entity, fields = PROJECT_ENTITIES[name]
+    return case_traversal.entity_query(entity, 'type: "project", project_id:"%s"' % project, fields, first, offset)
+
+# Pages of one entity type, stored as response text in PAGESD/OFFSET.json
+class PageStore:
+    def __init__(self, pagesd):
+        self.pagesd = pagesd
+        os.makedirs(pagesd, exist_ok=True)
+
+    def offsets(self):
+        return sorted(int(fn.split(".")[0]) for fn in os.listdir(self.pagesd) if fn.endswith(".json"))
+
+    def page_fn(self, offset):
+        return os.path.join(self.pagesd, "{:09d}.json".format(offset))
+
+    def read(self, offset):
+        with open(self.page_fn(offset)) as f:
+            return f.read()
+
+    # Written to a temporary file first, so that an interrupted write does not leave a partial page
+    def write(self, offset, R):
+        tmp_fn = self.page_fn(offset) + ".tmp"
+        with open(tmp_fn, 'w') as f:
+            f.write(R)
+        os.replace(tmp_fn, self.page_fn(offset))
+
+    def is_complete(self):
+        return os.path.exists(os.path.join(self.pagesd, "complete"))
+
+    def set_complete(self):
+        open(os.path.join(self.pagesd, "complete"), 'w').close()
+
+    def clear(self):
+        for fn in os.listdir(self.pagesd):
+            os.remove(os.path.join(self.pagesd, fn))
+
+    # Offset at which to resume fetching
+    def next_offset(self, entity):
+        offsets = self.offsets()
+        if not offsets:
+            return 0
+        last = offsets[-1]
+        return last + len(json.loads(self.read(last))['data'][entity] or [])
+
+    # Generator of response text of all pages, in order
+    def iter_responses(self):
+        for offset in self.offsets():
+            yield self.read(offset)
+
+# Fetch all pages of entity type NAME not already in store
+def fetch_pages(client, name, project, store, page_size, verbose=False):
+    if store.is_complete():
+        if verbose:
+            eprint("{}: all pages fetched in earlier run".format(name))
+        return
+    entity = PROJECT_ENTITIES[name][0]
+    offset = store.next_offset(entity)
+    if offset > 0:
+        eprint("{}: resuming at offset {}".format(name, offset))
+    query_func = lambda first, offset: project_query(name, project, first, offset)
+    n = offset
+    for offset, R, page in case_traversal.iter_pages(client, query_func, entity, page_size, offset, verbose):
+        store.write(offset, R)
+        n += len(page)
+    store.set_complete()
+    eprint("{}: {} entities".format(name, n))
+
+def read_entities(store, entity, unquoted=False):
+    entities = []
+    for R in store.iter_responses():
+        if unquoted:
+            R = echo_unquoted(R)
+        entities += json.loads(R)['data'][entity] or []
+    return entities
+
+# Add entity to list of each of its cases in by_case
+def add_to_cases(by_case, cases, entity):
+    for case in cases:
+        by_case.setdefault(case, []).append(entity)
+
+# Assign entities to cases.  Returns dictionary of data for each case:
+#   case -> {"CPTAC": aliquots.dat lines, "TCGA": aliquots.dat lines, "demographic": [...], "read_group": [...], ...}
+def split_by_case(stores):
+    cases = {}
+    def case_data(case):
+        return cases.setdefault(case, {"CPTAC": [], "TCGA": [], "demographic": [], "entities": {e: [] for e in case_traversal.CASE_ENTITIES}})
+
+    # Aliquots are parsed per case as with get_aliquots.sh
+    aliquot_cases = {}      # aliquot submitter_id -> cases
+    for data_model in ("CPTAC", "TCGA"):
+        samples = {}
+        for s in read_entities(stores["sample-" + data_model], "sample", unquoted=True):
+            add_to_cases(samples, set(c["submitter_id"] for c in s.get("cases") or []), s)
+        for case, case_samples in samples.items():
+            lines = ["\t".join(r) for r in parse_aliquot.iter_aliquots(case_samples, case, data_model)]
+            case_data(case)[data_model] = lines
+            for line in lines:
+                aliquot_cases.setdefault(line.split("\t")[5], set()).add(case)
+
+    for d in read_entities(stores["demographic"], "demographic", unquoted=True):
+        for case in set(c["submitter_id"] for c in d.get("cases") or []):
+            case_data(case)["demographic"].append(d)
+
+    # Other entities are assigned to the cases of their parents
+    def parent_cases(e, link, key, parents):
+        return set(case for p in e.get(link) or [] for case in parents.get(p[key], ()))
+
+    read_group_cases = {}
+    for rg in read_entities(stores["read_group"], "read_group"):
+        rg_cases = parent_cases(rg, "aliquots", "submitter_id", aliquot_cases)
+        for case in rg_cases:
+            case_data(case)["entities"]["read_group"].append(rg)
+        read_group_cases.setdefault(rg["submitter_id"], set()).update(rg_cases)
+
+    submitted_cases = {}
+    for entity in ("submitted_aligned_reads", "submitted_unaligned_reads"):
+        for sr in read_entities(stores[entity], entity):
+            sr_cases = parent_cases(sr, "read_groups", "submitter_id", read_group_cases)
+            for case in sr_cases:
+                case_data(case)["entities"][entity].append(sr)
+            submitted_cases.setdefault(sr["id"], set()).update(sr_cases)
+
+    for ar in read_entities(stores["aligned_reads"], "aligned_reads"):
+        ar_cases = parent_cases(ar, "submitted_aligned_reads_files", "id", submitted_cases)
+        ar_cases |= parent_cases(ar, "submitted_unaligned_reads_files", "id", submitted_cases)
+        for case in ar_cases:
+            case_data(case)["entities"]["aligned_reads"].append(ar)
+
+    for ma in read_entities(stores["raw_methylation_array"], "raw_methylation_array"):
+        for case in parent_cases(ma, "aliquots", "submitter_id", aliquot_cases):
+            case_data(case)["entities"]["raw_methylation_array"].append(ma)
+    return cases
+
+# Write discovery files of one case to OUTD, as discover_case.py -T does
+def write_case(case, disease, data, outd):
+    pipeline = CaseTraversalPipeline(None, case, disease)
+    pipeline.aliquots = {"CPTAC": data["CPTAC"], "TCGA": data["TCGA"]}
+    pipeline.entities = data["entities"]
+    fields = ["ethnicity", "gender", "race", "days_to_birth"]
+    pipeline.demographics = [format_row([case, disease], d, fields) for d in data["demographic"]]
+    pipeline.finish()
+    os.makedirs(outd, exist_ok=True)
+    clear_outputs(outd)
+    pipeline.write(outd)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discover all cases of a project with project-wide bulk queries, writing per-case discovery files")
+    parser.add_argument("cases_fn", help="TSV file with case name and disease in first and second columns")
+    parser.add_argument("-P", "--project", dest="project", required=True, help="GDC project ID, e.g., CPTAC-3")
+    parser.add_argument("-L", "--logbase", dest="logbase", default="./logs", help="Per-case files are written to LOGBASE/outputs/CASE.  Default ./logs")
+    parser.add_argument("-p", "--pages", dest="pagesd", help="Directory of fetched pages.  Default LOGBASE/pages/PROJECT")
+    parser.add_argument("-t", "--token", dest="token_fn", default=os.environ.get("GDC_TOKEN"), help="Token file.  Default is $GDC_TOKEN")
+    parser.add_argument("-S", "--page-size", dest="page_size", type=int, default=case_traversal.PAGE_SIZE, help="Initial number of entities per query")
+    parser.add_argument("-j", "--workers", dest="workers", type=int, default=WORKERS, help="Number of entity types fetched at once")
+    parser.add_argument("-r", "--restart", action="store_true", help="Fetch all pages again rather than resuming")
+    parser.add_argument("-1", "--just-one", dest="just_one", action="store_true", help="Write files for only the first case")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic information to stderr")
+
+    args = parser.parse_args()
+
+    if args.token_fn is None:
+        eprint("GDC_TOKEN environment variable not defined.  Quitting.")
+        sys.exit(1)
+
+    token = read_token(args.token_fn)
+    client = GDCClient(token, cache=GDCCache.from_environment(token), rate_limit=TokenBucket.from_environment())
+    client.source = "discover_project"
+    pagesd = args.pagesd or os.path.join(args.logbase, "pages", args.project)
+    stores = {name: PageStore(os.path.join(pagesd, name)) for name in PROJECT_ENTITIES}
+    if args.restart:
+        for store in stores.values():
+            store.clear()
+
+    # Entity types are fetched concurrently, each one page after another
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(fetch_pages, client, name, args.project, stores[name], args.page_size, args.verbose) for name in PROJECT_ENTITIES]
+        try:
+            for future in futures:
+                future.result()
+        # Exit without waiting for other entity types; pages fetched so far are kept
+        except (GDCQueryError, ValueError) as e:
+            eprint("ERROR: {}".format(e))
+            executor.shutdown(wait=False, cancel_futures=True)
+            os._exit(1)
+        except KeyboardInterrupt:
+            eprint("Interrupted.  Fetched pages are kept in {}; run again to resume".format(pagesd))
+            os._exit(130)
+
+    data = split_by_case(stores)
+    cases = read_cases(args.cases_fn)
+    if args.just_one:
+        cases = cases[:1]
+    empty = {"CPTAC": [], "TCGA": [], "demographic": [], "entities": {e: [] for e in case_traversal.CASE_ENTITIES}}
+    try:
+        for case, disease in cases:
+            write_case(case, disease, data.get(case, empty), os.path.join(args.logbase, "outputs", case))
+    except ValueError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
+    eprint("Wrote discovery files of {} cases to {}".format(len(cases), os.path.join(args.logbase, "outputs")))
+
+    # Only an unfinished fetch is resumed
+    for store in stores.values():
+        store.clear()
+    if args.verbose:
+        eprint("Removed fetched pages from {}".format(pagesd))
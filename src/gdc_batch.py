@@ -0,0 +1,266 @@
+import json
+import argparse, sys, os, time, subprocess
+from gdc_client import GDCClient, GDCQueryError, read_token, get_json, is_timeout_error, eprint, THROTTLE_BACKOFF, ERROR_BACKOFF
+from gdc_cache import GDCCache
+from rate_limit import TokenBucket, backoff_delay
+
+# Batched discovery of read groups, submitted reads, harmonized reads and methylation arrays
+#
+# get_read_groups.sh, get_submitted_reads.sh, get_harmonized_reads.sh and get_methylation_array.sh
+# make one GraphQL query per row of their input file.  Here, N such lookups are packed into one
+# GraphQL document using field aliases,
+#     {
+#         q0: read_group(with_path_to: {type: "aliquot", submitter_id:"CPT0001580165"}, first:10000) { ... }
+#         q1: read_group(with_path_to: {type: "aliquot", submitter_id:"CPT0001580166"}, first:10000) { ... }
+#     }
+# and the response is split back into the same per-row TSV output written by the shell scripts.
+#
+# Batch size adapts so that queries stay under GDC's 20 second query timeout: a batch which times out
+# is split in half and retried, and the batch size grows again while queries complete quickly.
+#
+# If the client has a cache, each lookup is cached individually, so that cached lookups are not re-sent
+# regardless of how they were batched.
+
+READ_GROUP_FIELDS = ["submitter_id", "library_strategy", "experiment_name", "target_capture_kit_target_region"]
+# Order of fields in output rows; the query asks for `id` before `file_name`
+READS_FIELDS = ["experimental_strategy", "data_format", "file_name", "file_size", "id", "md5sum", "state"]
+METHYLATION_FIELDS = ["submitter_id", "id", "channel", "file_name", "file_size", "data_format", "experimental_strategy", "md5sum", "state"]
+
+# Experimental strategies associated with submitted aligned reads; all others in SUR_STRATEGIES are submitted unaligned reads
+SAR_STRATEGIES = ["WGS", "WXS", "Targeted Sequencing"]
+SUR_STRATEGIES = ["RNA-Seq", "miRNA-Seq", "ATAC-Seq", "scRNA-Seq", "HiChIP", "scATAC-Seq"]
+
+# Queries which complete faster than this (in seconds) allow the batch size to grow; slower ones shrink it
+FAST_QUERY = 5
+SLOW_QUERY = 12
+
+# Format value as jq does for string interpolation, `"\(.x)"`
+def jq_string(v):
+    if v is None:
+        return "null"
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, separators=(',', ':'))
+    return str(v)
+
+def format_row(prefix, entry, fields):
+    return "\t".join(prefix + [jq_string(entry.get(f)) for f in fields])
+
+def read_group_from_aliquot_query(aliquot):
+    return 'read_group(with_path_to: {type: "aliquot", submitter_id:"%s"}, first:10000) { %s }' % (aliquot, " ".join(READ_GROUP_FIELDS))
+
+def submitted_reads_from_read_group_query(read_group, is_aligned):
+    entity = "submitted_aligned_reads" if is_aligned else "submitted_unaligned_reads"
+    return '%s(with_path_to: {type: "read_group", submitter_id:"%s"}) { experimental_strategy data_format id file_name file_size md5sum state }' % (entity, read_group)
+
+def harmonized_reads_from_submitted_query(submitted_id, is_aligned):
+    entity = "submitted_aligned_reads" if is_aligned else "submitted_unaligned_reads"
+    return 'aligned_reads(with_path_to: {type: "%s", id:"%s"}) { experimental_strategy data_format id file_name file_size md5sum state }' % (entity, submitted_id)
+
+def methylation_array_from_aliquot_query(aliquot):
+    return 'raw_methylation_array(with_path_to: {type: "aliquot", submitter_id:"%s"}, first:10000) { %s }' % (aliquot, " ".join(METHYLATION_FIELDS))
+
+# Combine subqueries into one GraphQL document, with subquery i aliased as qi
+def make_batch_query(subqueries):
+    return "{\n" + "\n".join("q%d: %s" % (i, q) for i, q in enumerate(subqueries)) + "\n}"
+
+# Run all subqueries in batches and return list of results, one per subquery, in the same order.
+# Each result is the list of entities returned by that subquery
+def run_batched(client, subqueries, batch_size=50, max_batch_size=200, verbose=False):
+    cached = {}
+    if client.cache is not None:
+        for k, q in enumerate(subqueries):
+            R = client.get_cached(make_batch_query([q]))
+            if R is not None:
+                cached[k] = json.loads(R)['data']['q0'] or []
+        if verbose and cached:
+            eprint("{} of {} lookups served from cache".format(len(cached), len(subqueries)))
+    misses = [q for k, q in enumerate(subqueries) if k not in cached]
+    fetched = iter(query_batches(client, misses, batch_size, max_batch_size, verbose))
+    return [cached[k] if k in cached else next(fetched) for k in range(len(subqueries))]
+
+def query_batches(client, subqueries, batch_size, max_batch_size, verbose):
+    cache = client.cache
+    results = []
+    i = 0
+    failures = 0    # consecutive failed batches, for retry backoff
+    while i < len(subqueries):
+        batch = subqueries[i:i+batch_size]
+        start = time.time()
+        if len(batch) == 1:
+            # A single lookup is retried until it succeeds, as with queryGDC.sh -r
+            R = client.run_query_retry(make_batch_query(batch))
+            errors = []
+        else:
+            R, errors = client.request(get_json(make_batch_query(batch)), batch=len(batch))
+            if errors is None:
+                errors = ["ERROR parsing result : " + R]
+        elapsed = time.time() - start
+
+        if errors:
+            if "Unauthorized query." in errors:
+                raise GDCQueryError("Fatal error: Unauthorized query.")
+            failures += 1
+            if "You are posting too quickly" in R:
+                delay = THROTTLE_BACKOFF + backoff_delay(failures - 1, THROTTLE_BACKOFF)
+                eprint("Posting too quickly error.  Pausing {:.1f}s.".format(delay))
+                time.sleep(delay)
+            elif is_timeout_error(errors):
+                # A smaller batch is tried right away
+                batch_size = max(1, len(batch) // 2)
+                if verbose:
+                    eprint("Batch of {} timed out.  Retrying with batch size {}".format(len(batch), batch_size))
+            else:
+                delay = backoff_delay(failures - 1, ERROR_BACKOFF)
+                if verbose:
+                    eprint("ERRORS: " + " ".join(errors))
+                    eprint("Query failed.  Retrying in {:.1f}s.".format(delay))
+                time.sleep(delay)
+            continue
+        failures = 0
+
+        data = json.loads(R)['data']
+        for j in range(len(batch)):
+            results.append(data["q%d" % j] or [])
+            if cache is not None and len(batch) > 1:
+                cache.put(make_batch_query([batch[j]]), json.dumps({"data": {"q0": data["q%d" % j]}}))
+        i += len(batch)
+
+        if elapsed < FAST_QUERY:
+            batch_size = min(max_batch_size, batch_size * 2)
+        elif elapsed > SLOW_QUERY:
+            batch_size = max(1, batch_size // 2)
+        if verbose:
+            eprint("Batch of {} completed in {:.1f}s.  Next batch size {}".format(len(batch), elapsed, batch_size))
+    return results
+
+# Read TSV rows from given file, skipping blank lines
+def read_rows(fn):
+    rows = []
+    with open(fn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.strip() == "":
+                continue
+            rows.append(line.split("\t"))
+    return rows
+
+def is_aligned_strategy(es):
+    return es in SAR_STRATEGIES
+
+# Returns lines of read_groups.dat for rows of aliquots.dat.  See get_read_groups.sh
+def get_read_groups(client, aliquot_rows, **kwargs):
+    # skip header line of aliquots.dat
+    aliquot_rows = [r for r in aliquot_rows if r[0] != "case"]
+    subqueries = [read_group_from_aliquot_query(r[5]) for r in aliquot_rows]
+    results = run_batched(client, subqueries, **kwargs)
+    lines = []
+    for r, rgs in zip(aliquot_rows, results):
+        for rg in rgs:
+            lines.append(format_row([r[0], r[5]], rg, READ_GROUP_FIELDS))
+    return lines
+
+# Returns lines of submitted_reads.dat for rows of read_groups.dat.  See get_submitted_reads.sh
+def get_submitted_reads(client, read_group_rows, **kwargs):
+    subqueries = []
+    for r in read_group_rows:
+        CASE, ASID, RGSID, ES = r[0], r[1], r[2], r[3]
+        if ES not in SAR_STRATEGIES and ES not in SUR_STRATEGIES:
+            raise ValueError("Unknown Experimental Strategy {}. CASE = {} Aliquot = {} Read Group = {}".format(ES, CASE, ASID, RGSID))
+        subqueries.append(submitted_reads_from_read_group_query(RGSID, is_aligned_strategy(ES)))
+    results = run_batched(client, subqueries, **kwargs)
+    lines = []
+    for r, srs in zip(read_group_rows, results):
+        alignment = "submitted_aligned" if is_aligned_strategy(r[3]) else "submitted_unaligned"
+        for sr in srs:
+            lines.append(format_row([r[0], r[1], alignment], sr, READS_FIELDS))
+    return sort_unique(lines)
+
+# Returns lines of harmonized_reads.dat for rows of submitted_reads.dat.  See get_harmonized_reads.sh
+def get_harmonized_reads(client, submitted_rows, **kwargs):
+    subqueries = [harmonized_reads_from_submitted_query(r[7], is_aligned_strategy(r[3])) for r in submitted_rows]
+    results = run_batched(client, subqueries, **kwargs)
+    lines = []
+    for r, ars in zip(submitted_rows, results):
+        for ar in ars:
+            lines.append(format_row([r[0], r[1], "harmonized"], ar, READS_FIELDS))
+    return lines
+
+# Returns lines of methylation_array.dat for DNA aliquots in rows of aliquots.dat.  See get_methylation_array.sh
+def get_methylation_array(client, aliquot_rows, **kwargs):
+    aliquot_rows = [r for r in aliquot_rows if r[0] != "case" and r[7] == "DNA"]
+    subqueries = [methylation_array_from_aliquot_query(r[5]) for r in aliquot_rows]
+    results = run_batched(client, subqueries, **kwargs)
+    lines = []
+    for r, mas in zip(aliquot_rows, results):
+        for ma in mas:
+            lines.append(format_row([r[0], r[5], "NA"], ma, METHYLATION_FIELDS))
+    return lines
+
+# get_submitted_reads.sh writes `sort -u` of its results.  Use the same utility so that collation
+# is the same as in the shell pipeline
+def sort_unique(lines):
+    if not lines:
+        return lines
+    p = subprocess.run(["sort", "-u"], input="\n".join(lines) + "\n", capture_output=True, text=True, check=True)
+    return p.stdout.splitlines()
+
+def write_lines(lines, outfn):
+    if outfn:
+        with open(outfn, 'w') as f:
+            for line in lines:
+                f.write(line + "\n")
+        eprint("Written to " + outfn)
+    else:
+        for line in lines:
+            print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query GDC for read groups, submitted reads, harmonized reads or methylation arrays with batched GraphQL queries")
+    parser.add_argument("stage", choices=["read_groups", "submitted_reads", "harmonized_reads", "methylation_array"], help="Discovery step to perform")
+    parser.add_argument("input", help="Input file: aliquots.dat for read_groups and methylation_array, read_groups.dat for submitted_reads, submitted_reads.dat for harmonized_reads")
+    parser.add_argument("-o", "--output", dest="outfn", help="Output file name.  Default writes to stdout")
+    parser.add_argument("-t", "--token", dest="token_fn", default=os.environ.get("GDC_TOKEN"), help="Token file.  Default is $GDC_TOKEN")
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=50, help="Initial number of lookups per query")
+    parser.add_argument("-B", "--max-batch-size", dest="max_batch_size", type=int, default=200, help="Maximum number of lookups per query")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic information to stderr")
+
+    args = parser.parse_args()
+
+    if args.token_fn is None:
+        eprint("GDC_TOKEN environment variable not defined.  Quitting.")
+        sys.exit(1)
+    if args.outfn and os.path.exists(args.outfn):
+        eprint("WARNING: {} exists.  Deleting".format(args.outfn))
+        os.remove(args.outfn)
+    if not os.path.exists(args.input):
+        eprint("NOTE: {} is empty.  Continuing".format(args.input))
+        sys.exit(0)
+
+    token = read_token(args.token_fn)
+    client = GDCClient(token, cache=GDCCache.from_environment(token), rate_limit=TokenBucket.from_environment())
+    client.source = "gdc_batch"
+    kwargs = {"batch_size": args.batch_size, "max_batch_size": args.max_batch_size, "verbose": args.verbose}
+    rows = read_rows(args.input)
+    try:
+        if args.stage == "read_groups":
+            lines = get_read_groups(client, rows, **kwargs)
+        elif args.stage == "submitted_reads":
+            lines = get_submitted_reads(client, rows, **kwargs)
+        elif args.stage == "harmonized_reads":
+            lines = get_harmonized_reads(client, rows, **kwargs)
+        else:
+            lines = get_methylation_array(client, rows, **kwargs)
+    except (GDCQueryError, ValueError) as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
+
+    # get_submitted_reads.sh always writes its output file; the other steps write only when data exist
+    if lines or args.stage == "submitted_reads":
+        write_lines(lines, args.outfn)
+    elif args.outfn and args.stage == "read_groups":
+        eprint("WARNING: {} is empty / not written.  Will skip this case".format(args.outfn))
+        open(os.path.join(os.path.dirname(args.outfn), "is_empty.flag"), 'a').close()
@@ -0,0 +1,181 @@
+import sqlite3, hashlib, re, time, threading
+import argparse, sys, os
+
+# Persistent cache of GDC query results
+#
+# Results are stored in an SQLite database, typically under the log directory (e.g., logs/gdc_cache.sqlite),
+# keyed on a hash of the normalized query text and the token scope.  Only successful responses are cached.
+#
+# How long a result may be reused depends on the entity type being queried.  Aliquot -> sample structure
+# and read groups change rarely and are served from disk, while files (submitted and harmonized reads,
+# methylation arrays) are always queried again, since reusing past results misses deprecated and replaced
+# datasets (see process_case.sh).  Likewise, any query which asks for `state` is never served from cache.
+#
+# The cache is bounded in size; least recently used entries are evicted first.
+#
+# Environment variables used by gdc_client.py and gdc_batch.py:
+#   GDC_CACHE - path to cache database.  Caching is disabled if not defined
+#   GDC_CACHE_REFRESH - if defined and not 0, do not read from the cache but store new results
+#   GDC_CACHE_TTL - comma-separated list of entity=seconds, overriding TTL_DEFAULTS, e.g. "read_group=0,sample=3600"
+
+DAY = 24 * 3600
+# Time-to-live, in seconds, for each entity type.  Entities not listed here are not cached
+TTL_DEFAULTS = {
+    "sample": 30 * DAY,
+    "demographic": 30 * DAY,
+    "read_group": 7 * DAY,
+    "submitted_aligned_reads": 0,
+    "submitted_unaligned_reads": 0,
+    "aligned_reads": 0,
+    "raw_methylation_array": 0,
+}
+MAX_BYTES = 1024**3
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Collapse whitespace so that formatting differences (e.g., from `echo $Q`) do not change the key
+def normalize_query(query):
+    q = re.sub(r'\s+', ' ', query).strip()
+    return re.sub(r' ?([{}():,]) ?', r'\1', q)
+
+# Entity types queried, e.g. ['read_group'] for `{ q0: read_group(with_path_to: ...) {...} }`
+def get_entities(query):
+    return sorted(set(re.findall(r'(\w+)\s*\(\s*with_path_to', query)))
+
+# Token scope is a hash of the token, so that results obtained with one token are not served to another
+def token_scope(token):
+    return hashlib.sha256(token.encode("utf8")).hexdigest()[:16]
+
+def parse_ttl(ttl_string):
+    ttl = {}
+    for item in ttl_string.split(","):
+        if item.strip() == "":
+            continue
+        entity, seconds = item.split("=")
+        ttl[entity.strip()] = int(seconds)
+    return ttl
+
+class GDCCache:
+    def __init__(self, path, scope="", ttl=None, max_bytes=MAX_BYTES, refresh=False):
+        self.path = path
+        self.scope = scope
+        self.ttl = dict(TTL_DEFAULTS)
+        if ttl:
+            self.ttl.update(ttl)
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        # Several cases may be discovered in parallel, each in its own process
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # and threads of one process (discover_case.py) share the connection
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, entity TEXT, created REAL, accessed REAL, size INTEGER, response TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+
+    # Cache configured by environment variables, or None if GDC_CACHE is not defined
+    @classmethod
+    def from_environment(cls, token):
+        path = os.environ.get("GDC_CACHE")
+        if not path:
+            return None
+        ttl = parse_ttl(os.environ.get("GDC_CACHE_TTL", ""))
+        refresh = os.environ.get("GDC_CACHE_REFRESH", "0") not in ("", "0")
+        return cls(path, scope=token_scope(token), ttl=ttl, refresh=refresh)
+
+    def key(self, query):
+        return hashlib.sha256((self.scope + "\n" + normalize_query(query)).encode("utf8")).hexdigest()
+
+    # Returns TTL of the query, which is the shortest TTL of all entities queried.
+    # Queries of unknown entities or which request `state` have TTL of 0
+    def get_ttl(self, query):
+        entities = get_entities(query)
+        if not entities or re.search(r'\bstate\b', query):
+            return 0
+        return min(self.ttl.get(e, 0) for e in entities)
+
+    # Returns cached response text, or None if not cached or expired
+    def get(self, query):
+        if self.refresh:
+            return None
+        ttl = self.get_ttl(query)
+        if ttl <= 0:
+            return None
+        key = self.key(query)
+        with self.lock:
+            row = self.db.execute("SELECT created, response FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[0] > ttl:
+                return None
+            self.db.execute("UPDATE responses SET accessed=? WHERE key=?", (now, key))
+            self.db.commit()
+        return row[1]
+
+    def put(self, query, response):
+        if self.get_ttl(query) <= 0:
+            return
+        now = time.time()
+        entity = ",".join(get_entities(query))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(query), entity, now, now, len(response), response))
+            self.db.commit()
+            self.evict()
+
+    # Delete least recently used entries until size is below 90% of max_bytes
+    def evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = 0.9 * self.max_bytes
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= target:
+                break
+            self.db.execute("DELETE FROM responses WHERE key=?", (key,))
+            total -= size
+        self.db.commit()
+
+    # Delete entries which have expired under current TTLs
+    def purge(self):
+        now = time.time()
+        n = 0
+        for key, entity, created in self.db.execute("SELECT key, entity, created FROM responses").fetchall():
+            ttl = min([self.ttl.get(e, 0) for e in entity.split(",")] or [0])
+            if now - created > ttl:
+                self.db.execute("DELETE FROM responses WHERE key=?", (key,))
+                n += 1
+        self.db.commit()
+        return n
+
+    def clear(self):
+        self.db.execute("DELETE FROM responses")
+        self.db.commit()
+
+    def stats(self):
+        return self.db.execute("SELECT entity, COUNT(*), COALESCE(SUM(size), 0) FROM responses GROUP BY entity ORDER BY entity").fetchall()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on and maintain GDC query cache")
+    parser.add_argument("cache_fn", help="Cache database, e.g., logs/gdc_cache.sqlite")
+    parser.add_argument("-p", "--purge", action="store_true", help="Delete expired entries")
+    parser.add_argument("-c", "--clear", action="store_true", help="Delete all entries")
+    parser.add_argument("-m", "--max-bytes", dest="max_bytes", type=int, default=MAX_BYTES, help="Evict least recently used entries above this size")
+    parser.add_argument("-T", "--ttl", dest="ttl", default="", help="Comma-separated list of entity=seconds overriding default TTLs")
+
+    args = parser.parse_args()
+
+    cache = GDCCache(args.cache_fn, ttl=parse_ttl(args.ttl), max_bytes=args.max_bytes)
+    if args.clear:
+        cache.clear()
+    if args.purge:
+        eprint("Purged {} entries".format(cache.purge()))
+    cache.evict()
+    print("entity\tcount\tbytes")
+    for entity, count, size in cache.stats():
+        print("{}\t{}\t{}".format(entity, count, size))
@@ -0,0 +1,253 @@
+import json
+import argparse, sys, os, time, threading
+import http.client, urllib.parse
+from gdc_cache import GDCCache
+from gdc_record import GDCRecord
+import metrics
+from rate_limit import TokenBucket, backoff_delay
+
+# In-process GraphQL client for the GDC submission API
+#
+# This performs the same work as queryGDC.sh -- JSON-escaping the query, POSTing it with the
+# authorization token, and checking the `errors` array of the response -- but without starting
+# bash, python, curl and jq processes for every query.  HTTP connections are kept open (keep-alive)
+# and reused across queries, one connection per thread.
+#
+# Can be used as a library:
+#     client = GDCClient(read_token(os.environ["GDC_TOKEN"]))
+#     result = client.query('{ sample(with_path_to: {type: "case", submitter_id:"C3L-00004"}) { id submitter_id } }')
+#
+# or as a drop-in replacement for queryGDC.sh, with the same arguments:
+#     echo $Q | python src/gdc_client.py -r -
+#
+# The endpoint may be changed with the GDC_URL environment variable, e.g. to test against a local stub server
+# Results may be cached on disk; see gdc_cache.py
+# Responses are recorded for later replay, if GDC_RECORD is defined; see gdc_record.py
+# Each request is recorded in the metrics file, if GDC_METRICS is defined; see metrics.py
+# Requests may be rate limited across processes, if GDC_RATE_LIMIT is defined; see rate_limit.py
+
+GDC_URL = "https://api.gdc.cancer.gov/v0/submission/graphql"
+# Base delay in seconds before retrying after "You are posting too quickly" and after other errors.
+# Delays grow exponentially with repeated failures; see rate_limit.backoff_delay
+THROTTLE_BACKOFF = 5.0
+ERROR_BACKOFF = 1.0
+
+# https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Errors which are not resolved by repeating the query, e.g., "Unauthorized query."
+class GDCQueryError(Exception):
+    pass
+
+# Creates valid GDC query JSON string based on graphQL text.  Same as get_json in queryGDC.sh
+def get_json(query):
+    d = { 'query': query.rstrip(), 'variables': 'null' }
+    return json.dumps(d)
+
+# Token is the contents of the token file, without trailing newline (as with `T=$(cat $GDC_TOKEN)`)
+def read_token(token_fn):
+    with open(token_fn) as f:
+        return f.read().rstrip("\n")
+
+# Returns list of error strings in response R, or None if R is not valid JSON.
+# Empty list indicates success.  Mirrors `jq -r '.errors[]? '`
+def get_errors(R):
+    try:
+        data = json.loads(R)
+    except ValueError:
+        return None
+    errors = data.get('errors') if isinstance(data, dict) else None
+    if not errors:
+        return []
+    return [e if isinstance(e, str) else json.dumps(e) for e in errors]
+
+# Query timeout error, e.g.,
+# "Query exceeded 20.0 second timeout. Please reduce query complexity and try again. ..."
+def is_timeout_error(errors):
+    return any("second timeout" in e for e in errors)
+
+class GDCClient:
+    def __init__(self, token, url=None, timeout=120, verbose=False, cache=None, rate_limit=None, record=None):
+        self.token = token
+        self.cache = cache
+        self.record = record or GDCRecord.from_environment()
+        self.rate_limit = rate_limit
+        self.url = url or os.environ.get("GDC_URL", GDC_URL)
+        self.timeout = timeout
+        self.verbose = verbose
+        u = urllib.parse.urlsplit(self.url)
+        self.scheme = u.scheme
+        self.netloc = u.netloc
+        self.path = u.path or "/"
+        # HTTP connections are not thread safe, so keep one per thread
+        self.local = threading.local()
+        # Name of program in query metrics
+        self.source = "gdc_client"
+
+    def get_connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    # POST query JSON and return response body as text.  A connection closed by the server
+    # while idle is reopened once
+    def post(self, query_json):
+        headers = {"X-Auth-Token": self.token, "Content-Type": "application/json", "Connection": "keep-alive"}
+        body = query_json.encode("utf8")
+        for attempt in (0, 1):
+            conn = self.get_connection()
+            try:
+                conn.request("POST", self.path, body=body, headers=headers)
+                response = conn.getresponse()
+                R = response.read().decode("utf8")
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 1:
+                    raise
+                continue
+            if response.will_close:
+                self.close()
+            return R
+
+    # POST query JSON and return response text and list of errors (see get_errors), recording the request in metrics
+    # and successful responses in the archive, if any
+    # Waits for shared rate limit, if any, and reports throttling and timeouts to it
+    def request(self, query_json, batch=1):
+        if self.rate_limit is not None:
+            self.rate_limit.acquire()
+        start = time.time()
+        R = self.post(query_json)
+        errors = get_errors(R)
+        error = metrics.error_class(R, errors)
+        if self.rate_limit is not None and error in (None, "throttle", "timeout"):
+            self.rate_limit.report(error or "ok")
+        if metrics.is_enabled():
+            metrics.record("query", source=self.source, start=start, seconds=time.time() - start, bytes=len(R.encode("utf8")),
+                error=error, cached=False, batch=batch)
+        if self.record is not None and errors == []:
+            self.record.put(json.loads(query_json)['query'], R, time.time() - start)
+        return R, errors
+
+    # Returns cached response text of query, or None if not cached
+    def get_cached(self, query, batch=1):
+        if self.cache is None:
+            return None
+        R = self.cache.get(query)
+        if R is not None and metrics.is_enabled():
+            metrics.record("query", source=self.source, start=time.time(), seconds=0, bytes=len(R.encode("utf8")),
+                error=None, cached=True, batch=batch)
+        if R is not None and self.record is not None:
+            self.record.put(query, R)
+        return R
+
+    # Perform query once and return response text.  Same as run_query in queryGDC.sh
+    def run_query(self, query):
+        R = self.get_cached(query)
+        if R is not None:
+            return R
+        R, errors = self.request(get_json(query))
+        if self.cache is not None and errors == []:
+            self.cache.put(query, R)
+        return R
+
+    # Perform query, repeating in case of transient errors until it succeeds.  Returns response text.
+    # Same as run_query_retry in queryGDC.sh:
+    # * "Unauthorized query." is fatal and raises GDCQueryError
+    # * "You are posting too quickly" (HTML response) waits at least 5 seconds before trying again
+    # * all other errors, such as the 20 second query timeout, are retried after a short delay
+    # Delays increase exponentially with each retry, with random jitter.
+    # max_retries of None retries indefinitely
+    def run_query_retry(self, query, max_retries=None):
+        R = self.get_cached(query)
+        if R is not None:
+            if self.verbose:
+                eprint("CACHED RESULT: " + R)
+            return R
+        query_json = get_json(query)
+        n = 0
+        while True:
+            R, errors = self.request(query_json)
+            if errors == []:
+                if self.verbose:
+                    eprint("RESULT: " + R)
+                if self.cache is not None:
+                    self.cache.put(query, R)
+                return R
+            if errors is None:
+                errors = ["ERROR parsing result : " + R]
+            if "Unauthorized query." in errors:
+                raise GDCQueryError("Fatal error: Unauthorized query.")
+            n += 1
+            if max_retries is not None and n > max_retries:
+                raise GDCQueryError("Query failed after {} retries: {}".format(max_retries, " ".join(errors)))
+            if "You are posting too quickly" in R:
+                delay = THROTTLE_BACKOFF + backoff_delay(n - 1, THROTTLE_BACKOFF)
+                eprint("Posting too quickly error.  Pausing {:.1f}s.".format(delay))
+            else:
+                delay = backoff_delay(n - 1, ERROR_BACKOFF)
+            if self.verbose:
+                eprint("ERRORS: " + " ".join(errors))
+                eprint("Query failed.  Retrying in {:.1f}s.".format(delay))
+            time.sleep(delay)
+
+    # Perform query with retries and return parsed `data` dictionary
+    def query(self, query, max_retries=None):
+        R = self.run_query_retry(query, max_retries)
+        return json.loads(R)['data']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Execute given GraphQL file as a query to GDC.  Drop-in replacement for queryGDC.sh")
+    parser.add_argument("gql", help="File with bare GraphQL query.  Use '-' to read from stdin")
+    parser.add_argument("-t", "--token", dest="token_fn", default=os.environ.get("GDC_TOKEN", "gdc-user-token.txt"), help="Token file.  Default is $GDC_TOKEN or ./gdc-user-token.txt")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic information to stderr")
+    parser.add_argument("-S", "--no-silent", action="store_true", help="Ignored; accepted for compatibility with queryGDC.sh")
+    parser.add_argument("-r", "--repeat", action="store_true", help="Repeat query in case of timeout errors until succeeds.  Stops on other errors")
+    parser.add_argument("-d", "--dryrun", action="store_true", help="Dry run.  Print query but do not execute")
+    parser.add_argument("-C", "--cache", dest="cache_fn", help="Cache query results in this database.  Default is $GDC_CACHE, if defined")
+    parser.add_argument("-F", "--refresh", action="store_true", help="Do not use cached results, but update cache with new ones")
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        eprint("Using token file " + args.token_fn)
+    if not os.path.isfile(args.token_fn):
+        eprint("Token {} not found".format(args.token_fn))
+        sys.exit(1)
+
+    if args.gql == '-':
+        query = sys.stdin.read()
+    else:
+        with open(args.gql) as f:
+            query = f.read()
+
+    if args.cache_fn:
+        os.environ["GDC_CACHE"] = args.cache_fn
+    if args.refresh:
+        os.environ["GDC_CACHE_REFRESH"] = "1"
+    token = read_token(args.token_fn)
+    client = GDCClient(token, verbose=args.verbose, cache=GDCCache.from_environment(token), rate_limit=TokenBucket.from_environment())
+    if args.dryrun:
+        eprint("POST {} --data {}".format(client.url, get_json(query)))
+        eprint("Exiting after dry run.")
+        sys.exit(0)
+
+    try:
+        if args.repeat:
+            print(client.run_query_retry(query).rstrip("\n"))
+        else:
+            sys.stdout.write(client.run_query(query))
+    except GDCQueryError as e:
+        eprint(e)
+        sys.exit(1)
@@ -0,0 +1,90 @@
+import sqlite3, hashlib, json, zlib, time, threading
+import argparse, sys, os
+from gdc_cache import normalize_query, get_entities
+
+# Archive of GDC queries and their responses, recorded during real runs and replayed by mock_gdc_server.py
+#
+# If the environment variable GDC_RECORD is defined, each successful response is recorded in the archive at that
+# path by gdc_client.py (and so by gdc_batch.py, discover_case.py and discover_project.py) and by queryGDC.sh -r.
+# Responses served from the query cache are recorded as well, so that the archive covers the whole run.
+#
+# The archive is an SQLite database keyed on a hash of the normalized query text (see gdc_cache.normalize_query).
+# Responses are stored zlib-compressed, with the time the query took; a query made more than once keeps its latest
+# response.  Unlike the cache, the archive is not scoped by token and entries do not expire.
+#
+# Record a discovery run, then replay it offline:
+#   GDC_RECORD=logs/gdc_record.sqlite bash src/run_discovery.sh -q dat/cases.dat
+#   python src/mock_gdc_server.py -a logs/gdc_record.sqlite
+# Summary of archive by entity:
+#   python src/gdc_record.py logs/gdc_record.sqlite
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+class GDCRecord:
+    def __init__(self, path):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        # As with the cache, several processes may record at once, and threads of one process share the connection
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, entity TEXT, recorded REAL, seconds REAL, size INTEGER, query TEXT, response BLOB)")
+        self.db.commit()
+
+    # Archive given by GDC_RECORD, or None if it is not defined
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get("GDC_RECORD")
+        return cls(path) if path else None
+
+    def key(self, query):
+        return hashlib.sha256(normalize_query(query).encode("utf8")).hexdigest()
+
+    # Record response text of query.  seconds is None for responses which were not timed, e.g., served from cache
+    def put(self, query, response, seconds=None):
+        entity = ",".join(get_entities(query))
+        data = zlib.compress(response.encode("utf8"))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key(query), entity, time.time(), seconds, len(response), normalize_query(query), data))
+            self.db.commit()
+
+    # Returns (response text, seconds) of query, or None if it was not recorded
+    def get(self, query):
+        with self.lock:
+            row = self.db.execute("SELECT response, seconds FROM responses WHERE key=?", (self.key(query),)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf8"), row[1]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    # Number of responses, their size and compressed size, and mean time of query, by entity
+    def stats(self):
+        return self.db.execute("SELECT entity, COUNT(*), SUM(size), SUM(LENGTH(response)), AVG(seconds) FROM responses GROUP BY entity ORDER BY entity").fetchall()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on or add to archive of recorded GDC queries")
+    parser.add_argument("record_fn", help="Archive database, e.g., logs/gdc_record.sqlite")
+    parser.add_argument("-a", "--add", dest="query_json", help="Record response read from stdin to this query JSON, as posted by queryGDC.sh")
+    parser.add_argument("-s", "--seconds", dest="seconds", type=float, help="Time taken by query added with -a")
+
+    args = parser.parse_args()
+
+    record = GDCRecord(args.record_fn)
+    if args.query_json is not None:
+        try:
+            query = json.loads(args.query_json)["query"]
+        except (ValueError, KeyError, TypeError):
+            eprint("ERROR: Not a query JSON: {}".format(args.query_json))
+            sys.exit(1)
+        record.put(query, sys.stdin.read().rstrip("\n"), args.seconds)
+        sys.exit(0)
+
+    print("entity\tcount\tbytes\tcompressed_bytes\tmean_seconds")
+    for entity, count, size, compressed, seconds in record.stats():
+        print("{}\t{}\t{}\t{}\t{}".format(entity, count, size, compressed, "NA" if seconds is None else "{:.3f}".format(seconds)))
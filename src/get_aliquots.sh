@@ -41,7 +41,8 @@ in the subsequent parsing (`src/parse_aliquot.py`)
 EOF
 
 PYTHON="/diskmnt/Projects/Users/mwyczalk/miniconda3/bin/python"
-QUERYGDC="src/queryGDC.sh"
+# QUERYGDC may be defined in environment to use an alternate query backend, e.g., "python src/gdc_client.py"
+QUERYGDC=${QUERYGDC:-"src/queryGDC.sh"}
 DATA_MODEL="CPTAC"
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
 while getopts ":hvo:m:" opt; do
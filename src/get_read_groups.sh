@@ -26,7 +26,8 @@ Options:
 Require GDC_TOKEN environment variable to be defined with path to gdc-user-token.*.txt file
 EOF
 
-QUERYGDC="src/queryGDC.sh"
+# QUERYGDC may be defined in environment to use an alternate query backend, e.g., "python src/gdc_client.py"
+QUERYGDC=${QUERYGDC:-"src/queryGDC.sh"}
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
 while getopts ":hvo:" opt; do
   case $opt in
@@ -32,7 +32,8 @@ Require GDC_TOKEN environment variable to be defined with path to gdc-user-token
 Note that a temporary file is written to /tmp/get_submitted_reads.XXXXXX then deleted
 EOF
 
-QUERYGDC="src/queryGDC.sh"
+# QUERYGDC may be defined in environment to use an alternate query backend, e.g., "python src/gdc_client.py"
+QUERYGDC=${QUERYGDC:-"src/queryGDC.sh"}
 TMPL="/tmp/get_submitted_reads.XXXXXX"
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
 while getopts ":hvo:T:t1" opt; do
@@ -0,0 +1,288 @@
+import numpy as np
+import pandas as pd
+import argparse, sys, os, binascii
+import csv, re
+from make_catalog3 import eprint, READS_HEADER, METHYLATION_HEADER
+import parse_aliquot
+import cpt_hash
+
+# Write Catalog2 file of one case, the same as make_catalog2.sh
+#
+# make_catalog2.sh loops over reads one line at a time, looking up each aliquot in the aliquots file with awk and
+# running get_CPT_hash.sh (and bashids) for annotated aliquots.  Here, as in make_catalog3.py, reads are read
+# into a frame which is merged with aliquot data, and sample names and other columns are built column-wise.
+# Aliquot data is obtained once per distinct aliquot, and aliquot hashes are encoded in-process (see cpt_hash.py).
+#
+# Output is byte-identical to that of make_catalog2.sh, including its particulars:
+# * All values are written as they appear in the input files (e.g., a missing file size is written as "null")
+# * There is one row for each row of reads.  Sample type is that of the aliquot, and must be unique
+# * Sample IDs and aliquot annotation are looked up by matching the aliquot name to column 5 of the aliquots file,
+#   as make_catalog2.sh does.  Since preservation_method was added as column 5 this does not match, and both
+#   are empty; the lookup is retained so that the output does not change
+# * A suffix list is matched as awk does, splitting lines on whitespace, and experimental strategies are
+#   matched on their first word
+#
+# Usage:
+#   python src/make_catalog2.py -Q ALIQUOTS -R SUBMITTED -H HARMONIZED -M METHYL -o OUTFN CASE DISEASE
+
+# Sample type name -> sample code, short name.  These are the sample types known to Catalog2; Catalog3 sample
+# types are given in config/sample_types.txt
+SAMPLE_TYPES = {
+    "Blood Derived Normal": ("N", "blood_normal"),
+    "Solid Tissue Normal": ("A", "tissue_normal"),
+    "Primary Tumor": ("T", "tumor"),
+    "Tumor": ("T", "tumor"),
+    "Buccal Cell Normal": ("Nbc", "buccal_normal"),
+    "Primary Blood Derived Cancer - Bone Marrow": ("Tbm", "tumor_bone_marrow"),
+    "Primary Blood Derived Cancer - Peripheral Blood": ("Tpb", "tumor_peripheral_blood"),
+    "Recurrent Tumor": ("R", "recurrent_tumor"),
+}
+
+# Aliquot annotation -> annotation code (ANN_CODE) of Catalog2 sample tags.  Unknown annotations have code UNK
+ANNOTATION_CODES = {
+    "Duplicate item: CCRCC Tumor heterogeneity study aliquot": "HET",
+    "Duplicate item: Additional DNA for PDA Deep Sequencing": "DEEP",
+    "Duplicate item: Additional DNA requested": "ADNA",
+    "Duplicate item: Additional RNA requested": "ARNA",
+    "Duplicate item: PDA Pilot - bulk-derived DNA": "BULK",
+    "Duplicate item: PDA Pilot - core-derived DNA": "CORE",
+    "Duplicate item: Replacement RNA Distribution - original aliquot failed": "RRNA",
+    "Duplicate item: Replacement DNA Distribution - original aliquot failed": "RDNA",
+    "Duplicate item: UCEC BioTEXT Pilot": "BIOTEXT",
+    "Duplicate item: UCEC LMD Heterogeneity Pilot": "LMD",
+    "Additional DNA Distribution - Additional aliquot": "ADD",
+    "PDA BIOTEXT RNA": "BIOTEXT",
+    "Replacement DNA Aliquot": "RDNA",
+    "Duplicate item: Replacement RNA aliquot per UNC request": "RDNA",
+    "Original DNA Aliquot": "ODNA",
+    "Duplicate item: PDA BIOTEXT DNA": "BIOTEXT",
+    "Duplicate item: PDA BioTEXT RNA": "BIOTEXT",
+    "Duplicate item: Supplementary DNA Aliquot": "ADNA",
+    "Duplicate item: Replacement DNA Aliquot": "RDNA",
+    "Duplicate item: No new shipment/material. DNA aliquot resubmission for Broad post-harmonization sequencing and sample type mismatch correction.": "RDNA",
+    "Duplicate item: Replacement RNA Aliquot": "RRNA",
+    "Duplicate Item: CHOP GBM Duplicate Primary Tumor DNA Aliquot": "ADNA",
+    "Duplicate Item: CHOP GBM Duplicate Primary Tumor RNA Aliquot": "ARNA",
+    "Duplicate Item: CHOP GBM Duplicate Recurrent Tumor DNA Aliquot": "ADNA",
+    "Duplicate Item: CHOP GBM Duplicate Recurrent Tumor RNA Aliquot": "ARNA",
+    "Duplicate Item: CHOP GBM Triplicate Primary Tumor DNA Aliquot": "ADNA",
+    "Duplicate Item: CHOP GBM Triplicate Primary Tumor RNA Aliquot": "ARNA",
+    "Duplicate Item: CHOP GBM Triplicate Recurrent Tumor DNA Aliquot": "ADNA",
+    "Duplicate Item: CHOP GBM Triplicate Recurrent Tumor RNA Aliquot": "ARNA",
+    "This entity was not yet authorized to be released by the submitters": "UNAV",
+}
+UNKNOWN_ANNOTATION_CODE = "UNK"
+
+CATALOG2_HEADER = ['sample_name', 'case', 'disease', 'experimental_strategy', 'short_sample_type', 'aliquot', 'filename',
+    'filesize', 'data_format', 'result_type', 'UUID', 'MD5', 'reference', 'sample_type', 'sample_id', 'sample_metadata',
+    'aliquot_annotation']
+
+# Reads all fields as text, as they appear in the file.  Columns are given names in order; missing columns are empty
+def read_text_table(fn, names):
+    try:
+        df = pd.read_csv(fn, sep="\t", header=None, dtype=str, na_filter=False, quoting=csv.QUOTE_NONE)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame()
+    df = df.iloc[:, :len(names)].fillna("")
+    df.columns = names[:df.shape[1]]
+    for col in names[df.shape[1]:]:
+        df[col] = ""
+    return df
+
+# Aliquots file is read with its header line as a row, as it is searched by make_catalog2.sh
+def read_aliquots_text(fn):
+    return read_text_table(fn, ('case',) + parse_aliquot.HEADER)
+
+# Aliquot hashes, used to create a unique sample name for an annotated sample:
+# * CPTAC3 aliquot names (starting with CPT) are encoded as with get_CPT_hash.sh
+# * All other aliquot names are given a CRC checksum, as in make_catalog2.sh with gzip and hexdump
+class AliquotHashes:
+    def __init__(self):
+        self.cpt_hash = cpt_hash.CPTHash()
+        self.hashes = {}
+
+    def get_hash(self, aliquot_name):
+        if aliquot_name not in self.hashes:
+            if aliquot_name.startswith("CPT"):
+                self.hashes[aliquot_name] = self.cpt_hash.get_hash(aliquot_name)
+            else:
+                self.hashes[aliquot_name] = format(binascii.crc32(aliquot_name.encode("utf8")), "08x")
+        return self.hashes[aliquot_name]
+
+# Returns "" for an annotation which is blank
+def get_annotation_code(annotation):
+    annotation = annotation.strip()
+    if annotation == "":
+        return ""
+    if annotation not in ANNOTATION_CODES:
+        eprint("WARNING: Unknown Aliquot Annotation: {}".format(annotation))
+        return UNKNOWN_ANNOTATION_CODE
+    return ANNOTATION_CODES[annotation]
+
+# Unique values of column VALUE of rows where column KEY is each of NAMES, sorted
+def lookup_values(aliquots, key, value, names):
+    found = aliquots.loc[aliquots[key].isin(names), [key, value]].drop_duplicates()
+    values = {}
+    for k, v in zip(found[key], found[value]):
+        values.setdefault(k, []).append(v)
+    return {k: sorted(v) for k, v in values.items()}
+
+# Returns frame with one row for each of aliquot names NAMES, with columns aliquot_submitter_id, sample_type,
+# sample_code, short_sample_type, sample_id, aliquot_annotation and sample_tag.  Raises ValueError if an aliquot
+# has no sample type or more than one, or more than one annotation
+def get_aliquot_data(aliquots, names, aliquots_fn, hashes):
+    sample_types = lookup_values(aliquots, 'aliquot_submitter_id', 'sample_type', names)
+    sample_ids = lookup_values(aliquots, 'preservation_method', 'sample_submitter_id', names)
+    annotations = lookup_values(aliquots, 'preservation_method', 'analyte_type', names)
+    rows = []
+    for name in names:
+        sample_type = sample_types.get(name, [])
+        if sample_type in ([], [""]):
+            raise ValueError("Sample type for aliquot {} not found in {}".format(name, aliquots_fn))
+        if len(sample_type) > 1:
+            raise ValueError("Multiple sample types for aliquot {} in {}".format(name, aliquots_fn))
+        sample_type = sample_type[0]
+        if sample_type not in SAMPLE_TYPES:
+            raise ValueError("Unknown sample type: {}".format(sample_type))
+        annotation = annotations.get(name, [""])
+        if len(annotation) > 1:
+            raise ValueError("Aliquot {} in {} has {} distinct notes: {}".format(name, aliquots_fn, len(annotation), " ".join(annotation)))
+        annotation = annotation[0]
+        # Sample tag, e.g. HET_qZq3G, is annotation code and aliquot hash
+        sample_tag = get_annotation_code(annotation) + "_" + hashes.get_hash(name) if annotation != "" else ""
+        sample_code, short_sample_type = SAMPLE_TYPES[sample_type]
+        rows.append((name, sample_type, sample_code, short_sample_type, ",".join(sample_ids.get(name, [])), annotation, sample_tag))
+    return pd.DataFrame(rows, columns=['aliquot_submitter_id', 'sample_type', 'sample_code', 'short_sample_type', 'sample_id',
+        'aliquot_annotation', 'sample_tag'])
+
+# Suffix list is TSV file with lines of either
+#   a) uuid, suffix
+#   b) aliquot, experimental_strategy, suffix  (experimental_strategy may be * for all)
+# Fields are split on spaces and tabs, as with awk.  Returns dictionary first field -> list of fields of each line
+def read_suffix_list(fn):
+    suffixes = {}
+    with open(fn) as f:
+        for line in f:
+            fields = re.split("[ \t]+", line.rstrip("\n").strip(" \t"))
+            suffixes.setdefault(fields[0], []).append(fields)
+    return suffixes
+
+# Suffix of sample name: suffixes of lines matching UUID, followed by those of lines matching aliquot and
+# experimental strategy.  Whitespace between and within suffixes is collapsed to single spaces
+def get_suffix(suffixes, uuid, aliquot, es):
+    words = es.split()
+    if not words:
+        raise ValueError("provide experimental strategy")
+    uuid_suffixes = "\n".join(f[1] if len(f) > 1 else "" for f in suffixes.get(uuid, []))
+    aliquot_suffixes = "".join(f[2] if len(f) > 2 else "" for f in suffixes.get(aliquot, []) if len(f) > 1 and f[1] in (words[0], "*"))
+    return " ".join((uuid_suffixes + aliquot_suffixes).split())
+
+# Raises ValueError with the first value of VALUES where MASK is true
+def check(mask, values, msg):
+    if mask.any():
+        raise ValueError(msg.format(values[mask].iat[0]))
+
+# Reads are columns of READS_HEADER or METHYLATION_HEADER.  Returns list of catalog lines
+def generate_catalog2(read_data, aliquots, case, disease, is_methylation, reads_fn, aliquots_fn, hashes, suffixes=None):
+    if read_data.empty:
+        return []
+    check(read_data['case'] != case, read_data['case'], "CASE mismatch: passed " + case + " , " + reads_fn + " = {}")
+    es = read_data['experimental_strategy']
+    if is_methylation:
+        check(es != "Methylation Array", es, "Unexpected experimental strategy: {}")
+
+    names = read_data['aliquot_submitter_id'].unique().tolist()
+    cd = read_data.merge(get_aliquot_data(aliquots, names, aliquots_fn, hashes), on='aliquot_submitter_id', how='left')
+    es, df, fn = cd['experimental_strategy'], cd['data_format'], cd['file_name']
+
+    # Reference is named as in Catalog2: hg19 for submitted aligned reads, NA for submitted unaligned reads, and
+    # hg38 for harmonized reads
+    reference = cd['alignment'].replace({"submitted_aligned": "hg19", "submitted_unaligned": "NA", "harmonized": "hg38"})
+
+    # Result type of harmonized RNA-Seq BAMs (genomic, chimeric, transcriptome), or channel of methylation array
+    rna_bam = (es == "RNA-Seq") & (df == "BAM")
+    rna_types = [fn.str.contains(t, regex=False) for t in ["transcriptome", "genomic", "chimeric"]]
+    check(rna_bam & ~(rna_types[0] | rna_types[1] | rna_types[2]), fn, "Unknown result type in RNA-Seq BAM {}")
+    channel = cd['channel'] if is_methylation else ""
+    result_type = pd.Series(np.select([rna_bam & rna_types[0], rna_bam & rna_types[1], rna_bam & rna_types[2], es == "Methylation Array"],
+        ["transcriptome", "genomic", "chimeric", channel], "NA"), index=cd.index)
+
+    # Sample name, e.g., C3N-00858.RNA-Seq.R1.T or C3N-00858.WXS.N.HET_qZq3G.hg38
+    # Read number of FASTQs is found in filename as _R1 or _R2
+    fastq = df == "FASTQ"
+    r1 = fn.str.contains("_R1", regex=False)
+    r2 = fn.str.contains("_R2", regex=False)
+    check(fastq & ~r1 & ~r2, fn, "Unknown filename format (cannot find _R1 or _R2): {}")
+    variety = np.select([fastq & r1, fastq & r2, (df == "IDAT") | rna_bam], [".R1", ".R2", "." + result_type], "")
+    strategy = es.replace({"Targeted Sequencing": "Targeted", "Methylation Array": "MethArray"})
+    sample_tag = cd['sample_tag']
+    sample_name = (cd['case'] + "." + strategy + variety + "." + cd['sample_code'] + ("." + sample_tag).where(sample_tag != "", "")
+        + pd.Series(np.where(reference == "hg38", ".hg38", ""), index=cd.index))
+
+    metadata = ("sample_tag=" + sample_tag).where(cd['aliquot_annotation'] != "", "")
+    if suffixes is not None:
+        suffix = pd.Series([get_suffix(suffixes, *r) for r in zip(cd['uuid'], cd['aliquot_submitter_id'], es)], index=cd.index, dtype=object)
+        sample_name = sample_name + suffix
+        metadata = metadata + " " + ("local_meta=" + suffix).where(suffix != "", "")
+    metadata = metadata.str.strip(" \t")
+
+    columns = [sample_name, cd['case'], disease, es, cd['short_sample_type'], cd['aliquot_submitter_id'], fn,
+        cd['file_size'], df, result_type, cd['uuid'], cd['md5sum'], reference, cd['sample_type'], cd['sample_id'],
+        metadata, cd['aliquot_annotation']]
+    columns = [c.tolist() if isinstance(c, pd.Series) else [c] * len(cd) for c in columns]
+    return ["\t".join(row) for row in zip(*columns)]
+
+def is_nonempty(fn):
+    return fn is not None and os.path.exists(fn) and os.path.getsize(fn) > 0
+
+# Header, then catalog lines of submitted reads, harmonized reads and methylation array, in that order.  As with
+# make_catalog2.sh, each reads file which is not empty is followed by a newline even if it gives no lines
+def make_catalog2(f, aliquots_fn, case, disease, submitted_fn=None, harmonized_fn=None, methyl_fn=None, suffix_fn=None, no_header=False):
+    if not is_nonempty(aliquots_fn):
+        raise ValueError("{} does not exist or is empty".format(aliquots_fn))
+    aliquots = read_aliquots_text(aliquots_fn)
+    suffixes = read_suffix_list(suffix_fn) if suffix_fn is not None else None
+    hashes = AliquotHashes()
+    blocks = []
+    for reads_fn, header, is_methylation in [(submitted_fn, READS_HEADER, False), (harmonized_fn, READS_HEADER, False),
+            (methyl_fn, METHYLATION_HEADER, True)]:
+        if is_nonempty(reads_fn):
+            read_data = read_text_table(reads_fn, header)
+            lines = generate_catalog2(read_data, aliquots, case, disease, is_methylation, reads_fn, aliquots_fn, hashes, suffixes)
+            blocks.append("\n".join(lines) + "\n")
+    if not no_header:
+        f.write("# " + "\t".join(CATALOG2_HEADER) + "\n")
+    for block in blocks:
+        f.write(block)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a comprehensive summary of aligned reads and methylation array from GDC (Catalog2)")
+    parser.add_argument("case", help="Case name")
+    parser.add_argument("disease", help="Disease code")
+    parser.add_argument("-Q", "--aliquots", dest="aliquots_fn", required=True, help="Aliquots file as generated by get_aliquots.sh")
+    parser.add_argument("-R", "--submitted", dest="submitted_fn", help="Submitted reads file as generated by get_submitted_reads.sh")
+    parser.add_argument("-H", "--harmonized", dest="harmonized_fn", help="Harmonized reads file as generated by get_harmonized_reads.sh")
+    parser.add_argument("-M", "--methylation", dest="methyl_fn", help="Methylation array file as generated by get_methylation_array.sh")
+    parser.add_argument("-o", "--output", dest="outfn", help="Write results to output file instead of STDOUT.  Will be overwritten if exists")
+    parser.add_argument("-N", "--no-header", dest="no_header", action="store_true", help="Do not write header")
+    parser.add_argument("-s", "--suffix-list", dest="suffix_fn", help="Data file for appending suffix to sample names")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Ignored; accepted for compatibility with make_catalog2.sh")
+
+    args = parser.parse_args()
+
+    if args.suffix_fn is not None and not is_nonempty(args.suffix_fn):
+        eprint("ERROR: SUFFIX_LIST {} does not exist or is empty".format(args.suffix_fn))
+        sys.exit(1)
+    if args.outfn is not None and os.path.exists(args.outfn):
+        eprint("WARNING: {} exists.  Deleting".format(args.outfn))
+
+    try:
+        if args.outfn is not None:
+            with open(args.outfn, 'w') as f:
+                make_catalog2(f, args.aliquots_fn, args.case, args.disease, args.submitted_fn, args.harmonized_fn, args.methyl_fn, args.suffix_fn, args.no_header)
+            eprint("Written to {}".format(args.outfn))
+        else:
+            make_catalog2(sys.stdout, args.aliquots_fn, args.case, args.disease, args.submitted_fn, args.harmonized_fn, args.methyl_fn, args.suffix_fn, args.no_header)
+    except ValueError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
@@ -1,7 +1,10 @@
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import argparse, sys, os, binascii
-import csv, re, json
+import csv, re, json, glob
+import metrics
+from catalog_fingerprint import catalog_version, fingerprint, is_current, was_written, write_record
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -11,17 +14,43 @@ def eprint(*args, **kwargs):
 # Essentially a merge of reads and aliquots, with some normalization of data, and output to data format as defined here:
 #   https://docs.google.com/document/d/1uSgle8jiIx9EnDFf_XHV3fWYKFElszNLkmGlht_CQGE/edit#
 # Implemented in pandas (i.e., column-wise operations)
+# Time of reading, catalog generation and writing is recorded in the metrics file, if GDC_METRICS is defined (see metrics.py)
+
+# Columns with few distinct values are converted to categoricals, which at project scale take a fraction of the
+# memory of strings.  File size is read as a nullable integer, so that a missing size ("null") is written as an
+# empty field and does not turn all sizes read with it into floats (written as e.g. 1234.0)
+ALIQUOTS_CATEGORIES = ['case', 'sample_type', 'preservation_method', 'analyte_type']
+READS_CATEGORIES = ['case', 'aliquot_submitter_id', 'alignment', 'experimental_strategy', 'data_format', 'state']
+METHYLATION_CATEGORIES = READS_CATEGORIES + ['channel']
+READS_TYPES = {'file_size': 'Int64'}
+
+# Columns of reads and methylation array files, which have no header
+READS_HEADER = ["case", "aliquot_submitter_id", "alignment", "experimental_strategy", "data_format", "file_name", "file_size", "uuid", "md5sum", "state"]
+METHYLATION_HEADER = ["case", "aliquot_submitter_id", "alignment", "submitter_id", "uuid", "channel", "file_name", "file_size", "data_format", "experimental_strategy", "md5sum", "state"]
+
+# Categorical columns are converted to strings where strings are built from them
+def as_text(s):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.astype(object)
+    return s
+
+def to_categorical(df, columns):
+    for col in columns:
+        df[col] = df[col].astype('category')
+    return df
 
 # Note that currently aliquot file has header.  This is not consistent with the other input data files
-def read_aliquots(alq_fn):
+def read_aliquots(alq_fn, categorical=True):
     #alq_header=('case', 'sample_submitter_id', 'sample_id', 'sample_type', 'preservation_method', 'aliquot_submitter_id', 'aliquot_id', 'analyte_type', 'aliquot_annotation')
     # force aliquot_annotation to be type str - doesn't seem to work?
     type_arg = {'aliquot_annotation': 'str'}
     #aliquots = pd.read_csv(alq_fn, sep="\t", names=alq_header, dtype=type_arg, comment='#')
     aliquots = pd.read_csv(alq_fn, sep="\t", dtype=type_arg, comment='#')
+    if categorical:
+        to_categorical(aliquots, ALIQUOTS_CATEGORIES)
     return(aliquots)
 
-def read_reads_file(reads_fn):
+def read_reads_file(reads_fn, categorical=True):
 #    * case
 #    * aliquot submitter id
 #    * alignment
@@ -31,13 +60,14 @@ def read_reads_file(reads_fn):
 #    * file size
 #    * uuid
 #    * md5sum
-    header_list=["case", "aliquot_submitter_id", "alignment", "experimental_strategy", "data_format", "file_name", "file_size", "uuid", "md5sum", "state"]
-    rf = pd.read_csv(reads_fn, sep="\t", names=header_list, comment='#')
+    rf = pd.read_csv(reads_fn, sep="\t", names=READS_HEADER, comment='#', dtype=READS_TYPES)
     # make sure "alignment" has the string value "NA", not NaN
     rf.loc[rf['alignment'].isna(), "alignment"] = "NA"
+    if categorical:
+        to_categorical(rf, READS_CATEGORIES)
     return(rf)
 
-def read_methylation_file(reads_fn):
+def read_methylation_file(reads_fn, categorical=True):
 #    1 case
 #    2 aliquot submitter id
 #    3 alignment
@@ -49,10 +79,11 @@ def read_methylation_file(reads_fn):
 #    9 data_format
 #   10 experimental strategy
 #   11 md5sum
-    header_list=["case", "aliquot_submitter_id", "alignment", "submitter_id", "uuid", "channel", "file_name", "file_size", "data_format", "experimental_strategy", "md5sum", "state"]
-    rf = pd.read_csv(reads_fn, sep="\t", names=header_list, comment='#')
+    rf = pd.read_csv(reads_fn, sep="\t", names=METHYLATION_HEADER, comment='#', dtype=READS_TYPES)
     # make sure "alignment" has the string value "NA", not NaN
     rf.loc[rf['alignment'].isna(), "alignment"] = "NA"
+    if categorical:
+        to_categorical(rf, METHYLATION_CATEGORIES)
     return(rf)
 
 
@@ -71,40 +102,22 @@ def get_data_variety_RNA_BAM(rf):
     rf.loc[transcriptome_ix, "data_variety"]="transcriptome"
     rf.loc[chimeric_ix, "data_variety"]="chimeric"
 
-# Parse filename for read indicator like _R1_
-def get_read(fn):
-     #match = re.search(r'_(R\d)_', fn)
-     match = re.search(r'_(R\d)', fn)   # want to also match DLBCL11282_4198_RNAseq_R1.fastq.gz
-     return match.group(1) if match else None
-
-# Parse filename for lane indicator like _L001_
-def get_lane(fn):
-     match = re.search(r'_(L\d\d\d)_', fn)
-     return match.group(1) if match else None
-
-# Parse filename for sample number indicator like _S12_
-def get_sample_number(fn):
-     match = re.search(r'_(S\d+)_', fn)
-     return match.group(1) if match else None
-
-# Parse filename for index indicator like _I2_
-def get_index(fn):
-     match = re.search(r'_(I\d)_', fn)
-     return match.group(1) if match else None
-
-# append stringB to stringA with _ in between
-# deals nicely if either of these are None
-def nice_append(stringA, stringB):
-    if stringA is None: return stringB
-    if stringB is None: return stringA
-    return stringA + "_" + stringB
-
-def get_dv_string(rf_row):
-    dv = nice_append(None, rf_row['sample'])
-    dv = nice_append(dv, rf_row['lane'])
-    dv = nice_append(dv, rf_row['read'])
-    dv = nice_append(dv, rf_row['index'])
-    return dv
+# Parse filename for Illumina read, lane, sample number and index indicators, as in these examples:
+#   read indicator like _R1_.  Also matches DLBCL11282_4198_RNAseq_R1.fastq.gz, so trailing _ is not required
+#   lane indicator like _L001_
+#   sample number indicator like _S12_
+#   index indicator like _I2_
+# Each lookahead finds the first match of its pattern anywhere in the filename (as re.search would), so all
+# four values are obtained with one pass of str.extract.  Unmatched values are NaN
+FASTQ_NAME_PATTERN = re.compile(r'^(?=(?:.*?_(?P<read>R\d))?)(?=(?:.*?_(?P<lane>L\d\d\d)_)?)(?=(?:.*?_(?P<sample>S\d+)_)?)(?=(?:.*?_(?P<index>I\d)_)?)')
+
+# Join sample, lane, read, and index values with _, skipping those which are missing
+# Returns NaN if all are missing.  Extracted values never contain _, so joining all values and then
+# collapsing repeated _ is the same as joining only the values which exist
+def get_dv_string(fields):
+    dv = fields['sample'].fillna('') + '_' + fields['lane'].fillna('') + '_' + fields['read'].fillna('') + '_' + fields['index'].fillna('')
+    dv = dv.str.replace(r'_+', '_', regex=True).str.strip('_')
+    return dv.where(dv != '')
 
 # Creates a convenient name like S19_L005_R1 which incorporates illumina sample, lane, read, and index values
 # https://support.illumina.com/help/BaseSpace_OLH_009008/Content/Source/Informatics/BS/NamingConvention_FASTQ-files-swBS.htm
@@ -119,49 +132,108 @@ def get_data_variety_FASTQ(rf):
     target_ix = FQ_ix | (BM_ix & UA_ix)
 
     if not target_ix.empty:
-        rf.loc[target_ix, 'read'] = rf.loc[target_ix].apply(lambda row: get_read(row['file_name']), axis=1)
-        rf.loc[target_ix, 'lane'] = rf.loc[target_ix].apply(lambda row: get_lane(row['file_name']), axis=1)
-        rf.loc[target_ix, 'sample'] = rf.loc[target_ix].apply(lambda row: get_sample_number(row['file_name']), axis=1)
-        rf.loc[target_ix, 'index'] = rf.loc[target_ix].apply(lambda row: get_index(row['file_name']), axis=1)
-        rf.loc[target_ix, 'data_variety'] = rf.loc[target_ix].apply(lambda row: get_dv_string(row), axis=1)
-
-
+        fields = rf.loc[target_ix, 'file_name'].astype(str).str.extract(FASTQ_NAME_PATTERN)
+        # columns are NaN for rows which are not targeted
+        for key in ['read', 'lane', 'sample', 'index']:
+            rf[key] = fields[key]
+        rf.loc[target_ix, 'data_variety'] = get_dv_string(fields)
+
+
+
+# Configuration files, relative to this script
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config")
+ANNOTATION_RULES = os.path.join(CONFIG_DIR, "annotation_rules.txt")
+SAMPLE_TYPES = os.path.join(CONFIG_DIR, "sample_types.txt")
+
+# Returns list of tab-separated fields of each line of configuration file, skipping comments and blank lines
+def read_config(fn, n_fields):
+    rows = []
+    with open(fn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.split("\t")
+            if len(fields) < n_fields:
+                raise ValueError("{}: expected {} tab-separated fields: {}".format(fn, n_fields, line))
+            rows.append([x.strip() for x in fields[:n_fields]])
+    return rows
 
 # An Aliquot Tag is a string associated with an aliquot which may be appended to dataset names
 # It consists of two parts: an annotation code and an aliquot hash, separated by '_'
 # An annotation code is meant to be a three-letter identifier of an aliquot annotation, for
 #    instance indicating that the aliquot is marked as "duplicate" (annotaton code "DUP")
 #    If an annotation does not exist, default annotation code  is ALQ
+#    If the annotation is in the annotation table (-A, e.g., config/annotation_table.txt), the code is given there.
+#       Annotations with several notes (separated by ';') take the code of the note listed first in the table
+#    Otherwise the code is that of the first rule in config/annotation_rules.txt whose pattern is found in the
+#       annotation, e.g., "replacement" gives REP, "additional" gives ADD, and "duplicate item" DUP
 #    If an annotation exists but code is not known, default annotation code is ANN
-#    If annotation contains "duplicate item" the annotation code is DUP
-#    If annotation contains "additional" the annotation code is ADD
-#    If annotation contains "replacement" the annotation code is REP
-#    Otherwise, annotation code is performed by the dictionary passed, annotations (not impelmented)
 # Aliquot has is a CRC checksum string based on aliquot_submitter_id, used to create a unique name
 #    compact representation of aliquot name.  Details about CRC checksums:
 #    See https://stackoverflow.com/questions/44804668/how-to-calculate-crc32-checksum-from-a-string-on-linux-bash
-def get_aliquot_tag(aliquots):
-    def get_hash(text):
-        return format(binascii.crc32(text.encode("utf8")), "x")
-
-    alq_hash=aliquots[["aliquot_submitter_id"]].squeeze(axis=1).map(get_hash) 
-
-    # By default, code is ALQ
-    alq_code = pd.Series("ALQ", index=aliquots.index)
-    # if aliquot_annotation exists, tag is ANN
-    alq_code.loc[aliquots[["aliquot_annotation"]].notna().squeeze(axis=1)]="ANN"
-
-    # go from more generic to less generic
-    dup = aliquots["aliquot_annotation"].str.contains("duplicate item", case=False, na=False)
-    add = aliquots["aliquot_annotation"].str.contains("additional", case=False, na=False)
-    rep = aliquots["aliquot_annotation"].str.contains("replacement", case=False, na=False)
-
-    alq_code.loc[dup] = "DUP"   # "duplicate item"
-    alq_code.loc[add] = "ADD"   # "additional"
-    alq_code.loc[rep] = "REP"   # "replacement"
-
-    # Depending on specific values of aliquot_annotation, in consultation with
-    # annotations dictionary (not implemented), different annotation codes can be used
+NO_ANNOTATION_CODE = "ALQ"
+UNKNOWN_ANNOTATION_CODE = "ANN"
+
+# Assigns annotation codes and aliquot hashes.  All rules are combined into one pattern, with one lookahead per
+# rule (as with FASTQ_NAME_PATTERN), so that an annotation is scanned once for all rules.  Codes and hashes are
+# remembered, so that each distinct annotation and aliquot is evaluated once however many rows, files or cases
+# it appears in
+class AnnotationCodes:
+    # rules is list of (pattern, code) in order of precedence; table is list of (annotation, code)
+    def __init__(self, rules, table=None):
+        self.rule_codes = [code for pattern, code in rules]
+        self.pattern = re.compile("".join("(?=(?:.*?(?P<r{}>{}))?)".format(i, pattern) for i, (pattern, code) in enumerate(rules)),
+            re.IGNORECASE | re.DOTALL)
+        # annotation, ignoring case -> (rank, code); earlier entries take precedence
+        self.table = {}
+        for rank, (annotation, code) in enumerate(table or []):
+            self.table.setdefault(annotation.lower(), (rank, code))
+        self.codes = {}
+        self.hashes = {}
+
+    @classmethod
+    def from_files(cls, rules_fn=ANNOTATION_RULES, table_fn=None):
+        return cls(read_config(rules_fn, 2), read_config(table_fn, 2) if table_fn is not None else None)
+
+    def get_code(self, annotation):
+        if not isinstance(annotation, str):
+            return NO_ANNOTATION_CODE
+        if annotation not in self.codes:
+            self.codes[annotation] = self.evaluate(annotation)
+        return self.codes[annotation]
+
+    def evaluate(self, annotation):
+        key = annotation.strip().lower()
+        if key in self.table:
+            return self.table[key][1]
+        found = [self.table[n.strip().lower()] for n in annotation.split(";") if n.strip().lower() in self.table]
+        if found:
+            return min(found)[1]
+        m = self.pattern.match(annotation)
+        for i, code in enumerate(self.rule_codes):
+            if m.group("r{}".format(i)) is not None:
+                return code
+        return UNKNOWN_ANNOTATION_CODE
+
+    def get_hash(self, text):
+        if text not in self.hashes:
+            self.hashes[text] = format(binascii.crc32(text.encode("utf8")), "x")
+        return self.hashes[text]
+
+# Annotation codes of default rules, without annotation table
+_default_annotation_codes = None
+def default_annotation_codes():
+    global _default_annotation_codes
+    if _default_annotation_codes is None:
+        _default_annotation_codes = AnnotationCodes.from_files()
+    return _default_annotation_codes
+
+def get_aliquot_tag(aliquots, annotation_codes=None):
+    if annotation_codes is None:
+        annotation_codes = default_annotation_codes()
+    alq_hash = as_text(aliquots["aliquot_submitter_id"]).map(annotation_codes.get_hash)
+    alq_code = as_text(aliquots["aliquot_annotation"]).map(annotation_codes.get_code)
     return(alq_code + "_" + alq_hash)
 
 # merge all sample_submitter_id's which are used for the same aliquot_submitter_id
@@ -182,112 +254,97 @@ def get_sample_ids(aliquots):
     # rf.merge(alq_sid, on='aliquot_submitter_id').head()
     return(alq_sid)
 
+# Sample types with short names and codes, from configuration file.  Returns DataFrame with columns
+# sample_type, sample_type_short, sample_code
+def read_sample_types(fn=SAMPLE_TYPES):
+    return pd.DataFrame(read_config(fn, 3), columns = ['sample_type', 'sample_type_short', 'sample_code'])
+
+_default_sample_types = None
+def default_sample_types():
+    global _default_sample_types
+    if _default_sample_types is None:
+        _default_sample_types = read_sample_types()
+    return _default_sample_types
+
 # returns tuple of Series sample_code and sample_type_short
-# This is possible source of fatal errors when there is a new sample_type
-# it would be good to move these definitions out of script and into a configuration file 
-def get_sample_code(aliquots):
-    sample_map = [
-# N, blood_normal:   Blood Derived Normal
-        ["Blood Derived Normal", "blood_normal", "N"],
-# A, tissue_normal:   Solid Tissue Normal
-        ["Solid Tissue Normal", "tissue_normal", "A"],
-# T, tumor:   Primary Tumor or Tumor
-        ["Primary Tumor", "tumor", "T"],
-        ["Tumor", "tumor", "T"],
-        ['Additional - New Primary', "tumor", "T"],
-# Nbc, buccal_normal:   Buccal Cell Normal
-        ["Buccal Cell Normal" , "buccal_normal", "Nbc"],
-# Tbm, tumor_bone_marrow: Primary Blood Derived Cancer - Bone Marrow
-        ["Primary Blood Derived Cancer - Bone Marrow" , "tumor_bone_marrow", "Tbm"],
-# Tpb, tumor_peripheral_blood: Primary Blood Derived Cancer - Peripheral Blood
-        ["Primary Blood Derived Cancer - Peripheral Blood" , "tumor_peripheral_blood", "Tpb"],
-# R, recurrent_tumor:   Recurrent Tumor
-        ["Recurrent Tumor" , "recurrent_tumor", "R"],
-# S, slides: Slides - this is new and weird but adding this along with code to detect such situations in the future
-        ["Slides" , "slides", "S"],
-# "FFPE scrolls" and "FFPE Recurrent" 
-        ["FFPE Scrolls", "ffpe", "F"],
-        ["FFPE Recurrent", "ffpe", "F"],
-# Metastatic
-        ["Metastatic", "metastatic", "M"],
-        ["Additional Metastatic", "additional_metastatic", "M"],
-# 'Human Tumor Original Cells'
-        ["Human Tumor Original Cells", "tumor_cells", "Tc"],
-# 'Saliva'
-        ["Saliva", "Saliva", "V"],
-# these from HCMI
-        ["Neoplasms of Uncertain and Unknown Behavior", "unknown", "X"],
-        ["Next Generation Cancer Model", "model", "L"],
-        ["Post neo-adjuvant therapy", "therapy", "P"],
-# sometimes these really are "unknown" or not given
-        ["unknown", "unknown", "X"]
-    ]
-
-
-    sst = pd.DataFrame(sample_map, columns = ['sample_type', 'sample_type_short', 'sample_code'])
+# This is possible source of fatal errors when there is a new sample_type, which is then to be added to
+# config/sample_types.txt
+def get_sample_code(aliquots, sample_types=None):
+    sst = sample_types if sample_types is not None else default_sample_types()
     merged = aliquots.merge(sst, on="sample_type", how="left")# [['sample_code', 'sample_type_short']]
     if merged['sample_code'].isnull().values.any():
         m=merged['sample_code'].isnull()
-        msg="Unknown sample type: {}".format(merged.loc[m, "sample_type"].unique())
+        msg="Unknown sample type: {}.  Sample types are defined in config/sample_types.txt".format(as_text(merged.loc[m, "sample_type"]).unique())
         raise ValueError(msg)
     return merged['sample_code'], merged['sample_type_short']
 
+# Returns Series of dataset names.  Parts of the name are built as Series rather than as columns of CD, to avoid
+# adding columns to the catalog data
 def get_dataset_name(cd):
     # Dataset name is composed of:
     # case [. aliquot_tag] . experimental_strategy_ds [. data_variety ] . sample_code . reference
 
     # whit experimental strategies shortened: "Targeted_Sequencing" to "Targeted", and "Methylation_Array" to "MethArray"
     # for the purpose of creating dataset name
-    cd["experimental_strategy_ds"] = cd["experimental_strategy"]
-    cd.loc[(cd["experimental_strategy_ds"]=="Targeted_Sequencing"), "experimental_strategy_ds"]="Targeted"
-    cd.loc[(cd["experimental_strategy_ds"]=="Methylation_Array"), "experimental_strategy_ds"]="MethArray"
+    experimental_strategy_ds = as_text(cd["experimental_strategy"]).replace({"Targeted_Sequencing": "Targeted", "Methylation_Array": "MethArray"})
 
     # https://stackoverflow.com/questions/48083074/conditional-concatenation-based-on-string-value-in-column
     # Conditionally add aliquot tag where aliquot annotation exists
-    cd['labeled_case'] = cd['case'] 
+    labeled_case = as_text(cd['case'])
     m = cd['aliquot_annotation'].notna()
-    cd.loc[m, 'labeled_case'] += ('.' + cd.loc[m, 'aliquot_tag'])
+    labeled_case = labeled_case.where(~m, labeled_case + '.' + cd['aliquot_tag'])
 
     # include data variety field (e.g., R1) only if non-trivial
-    cd['data_variety_tag'] = ''
-    m = cd['data_variety'].notna() 
-    cd.loc[m, 'data_variety_tag'] = '.' + cd.loc[m,'data_variety'] 
-    cd.loc[cd['data_variety_tag'] == '.', "data_variety_tag"] = ""
+    data_variety = as_text(cd['data_variety'])
+    m = data_variety.notna() & (data_variety != '')
+    data_variety_tag = ('.' + data_variety).where(m, '')
 
-    cd['alignment_tag'] = ""
-    cd.loc[cd['alignment'] == 'harmonized', "alignment_tag"] = ".hg38"
+    alignment_tag = pd.Series(np.where(cd['alignment'] == 'harmonized', '.hg38', ''), index=cd.index)
 
-    dataset_name = cd['labeled_case'] +'.'+ cd['experimental_strategy_ds'] + cd['data_variety_tag'] +'.'+ cd['sample_code'] + cd['alignment_tag']
+    dataset_name = labeled_case +'.'+ experimental_strategy_ds + data_variety_tag +'.'+ as_text(cd['sample_code']) + alignment_tag
     return dataset_name        
 
-# append {key: row[key]} to dictionary d provided key exists in row and is not empty or blank
-def append_safely(d, row, key):
-    if key not in row.keys():
-        return d
-    v = row[key]
-    if v == "":
-        return d
-    if v == None:
-        return d
-    if pd.isnull(v):
-        return d
-    d[key] = row[key]
-    return d
-
-def get_metadata_json(row):
-    md = {}     # metadata dictionary
-    md = append_safely(md, row, 'aliquot_tag')
-    md = append_safely(md, row, 'aliquot_annotation')
-    md = append_safely(md, row, 'sample')
-    md = append_safely(md, row, 'lane')
-    md = append_safely(md, row, 'read')
-    md = append_safely(md, row, 'index')
-    md = append_safely(md, row, 'gdc_sample_type')
-    md = append_safely(md, row, 'state')
-    md = append_safely(md, row, 'preservation_method')
-    return json.dumps(md)
-
-def generate_catalog(read_data, aliquots, is_methylation):
+# Keys of metadata JSON, in order they are written.  Only keys which are columns of catalog data
+# are considered, and keys with empty or null values are skipped
+METADATA_KEYS = ['aliquot_tag', 'aliquot_annotation', 'sample', 'lane', 'read', 'index', 'gdc_sample_type', 'state', 'preservation_method']
+
+# Returns Series with metadata JSON string for each row, e.g.,
+#   {"aliquot_tag": "ALQ_732dc11c", "sample": "S0", "lane": "L001", "read": "R1", "state": "validated"}
+# Formatting is the same as json.dumps() of a dictionary.  Each string is built in one step from the values of its
+# row, rather than by appending to strings of all rows once per key, which makes a copy of all strings for each key
+def get_metadata_json(cd):
+    keys = [key for key in METADATA_KEYS if key in cd.columns]
+    def is_value(v):
+        return v is not None and v == v and v != ""
+    md = ["{" + ", ".join('"' + key + '": ' + json.dumps(v) for key, v in zip(keys, row) if is_value(v)) + "}"
+        for row in zip(*[cd[key].tolist() for key in keys])]
+    return pd.Series(md, index=cd.index, dtype=object)
+
+# Columns of aliquots which are used in catalog data
+ALIQUOT_COLUMNS = ['case', 'aliquot_submitter_id', 'sample_type', 'preservation_method', 'aliquot_annotation', 'aliquot_tag',
+    'sample_code', 'sample_type_short']
+
+# Add aliquot tag, sample code and short sample type to aliquots, keeping only columns used in catalog data
+# annotation_codes (AnnotationCodes) and sample_types (see read_sample_types) are from default configuration
+# files if not given
+def prepare_aliquots(aliquots, annotation_codes=None, sample_types=None):
+    # Add "aliquot_tag" column to aliquots
+    aliquot_tag = get_aliquot_tag(aliquots, annotation_codes)
+    aliquots = aliquots.assign(aliquot_tag=aliquot_tag.values)
+
+    # this now has column sample_ids as a comma-separated lists of all aliquot_submitter_id values
+    # Merging also determines order of aliquots, and so of catalog rows of reads with more than one aliquot row
+    sids = get_sample_ids(aliquots)
+    aliquots = aliquots.merge(sids, on="aliquot_submitter_id")
+
+    sample_code, sample_type_short = get_sample_code(aliquots, sample_types)
+    aliquots['sample_code'] = sample_code
+    aliquots['sample_type_short'] = sample_type_short
+    return aliquots[ALIQUOT_COLUMNS]
+
+# Aliquots may be passed already processed by prepare_aliquots, as in batch mode where aliquots of all cases
+# are prepared once and then used for each group of cases
+def generate_catalog(read_data, aliquots, is_methylation, prepared=False, annotation_codes=None, sample_types=None):
     # process read_data
     # Add "data_variety" column to read_data
     read_data['data_variety'] = ""
@@ -298,45 +355,40 @@ def generate_catalog(read_data, aliquots, is_methylation):
         get_data_variety_FASTQ(read_data)
 
     # Rename experimental strategies containing spaces to underscores.  This could be generalized
-    read_data.loc[(read_data["experimental_strategy"]=="Targeted Sequencing"), "experimental_strategy"]="Targeted_Sequencing"
-    read_data.loc[(read_data["experimental_strategy"]=="Methylation Array"), "experimental_strategy"]="Methylation_Array"
-
+    read_data['experimental_strategy'] = read_data['experimental_strategy'].replace(
+        {"Targeted Sequencing": "Targeted_Sequencing", "Methylation Array": "Methylation_Array"})
 
     # Now update aliquots
-    # Add "aliquot_tag" column to aliquots
-    aliquot_tag = get_aliquot_tag(aliquots)
-    aliquots = aliquots.assign(aliquot_tag=aliquot_tag.values)
-
-    # this now has column sample_ids as a comma-separated lists of all aliquot_submitter_id values
-    sids = get_sample_ids(aliquots)
-    aliquots = aliquots.merge(sids, on="aliquot_submitter_id")
-
-    sample_code, sample_type_short = get_sample_code(aliquots)
-    aliquots = aliquots.assign(sample_code=sample_code)
-    aliquots = aliquots.assign(sample_type_short=sample_type_short)
+    if not prepared:
+        aliquots = prepare_aliquots(aliquots, annotation_codes, sample_types)
 
     # Finally merge aliquot info with reads
-#    print("DEBUG2")
-#    print(read_data)
-#    print(aliquots)
-    catalog_data = read_data.merge(aliquots, on=['aliquot_submitter_id', 'case'])
+    merge_on = ['aliquot_submitter_id', 'case']
+    # In batch mode reads of several files (column _outfn) are merged at once.  Merging on the file as well keeps
+    # rows of each file in the same order as when that file is processed on its own
+    if '_outfn' in read_data.columns:
+        aliquots = aliquots.merge(read_data[['case', '_outfn']].drop_duplicates(), on='case')
+        merge_on.append('_outfn')
+    catalog_data = read_data.merge(aliquots, on=merge_on)
 
-    dataset_name = get_dataset_name(catalog_data)
-    catalog_data = catalog_data.assign(dataset_name=dataset_name)
+    # Columns are added and renamed in place, rather than with assign and rename which copy all catalog data
+    catalog_data['dataset_name'] = get_dataset_name(catalog_data)
 
     # Rename column names a little
-    catalog_data = catalog_data.rename(columns={'md5sum': 'md5', 'file_name': 'filename', 'file_size': 'filesize', \
-        'sample_type': 'gdc_sample_type', 'sample_type_short': 'sample_type'})
+    catalog_data.rename(columns={'md5sum': 'md5', 'file_name': 'filename', 'file_size': 'filesize', \
+        'sample_type': 'gdc_sample_type', 'sample_type_short': 'sample_type'}, inplace=True)
     catalog_data['specimen_name'] = catalog_data['aliquot_submitter_id']
 
     # Generate metadata as JSON string
-    catalog_data['metadata'] = catalog_data.apply(lambda row: get_metadata_json(row), axis=1)
+    catalog_data['metadata'] = get_metadata_json(catalog_data)
 
     return(catalog_data)
 
+CATALOG_HEADER = [ 'dataset_name', 'case', 'disease', 'experimental_strategy', 'sample_type', 'specimen_name', 'filename',
+    'filesize', 'data_format', 'data_variety', 'alignment', 'project', 'uuid', 'md5', 'metadata']
+
 def write_catalog(outfn, catalog_data, disease, project):
-    header = [ 'dataset_name', 'case', 'disease', 'experimental_strategy', 'sample_type', 'specimen_name', 'filename',
-        'filesize', 'data_format', 'data_variety', 'alignment', 'project', 'uuid', 'md5', 'metadata']
+    header = CATALOG_HEADER
     # Index(['case', 'aliquot_submitter_id', 'alignment', 'experimental_strategy',
     #  'data_format', 'filename', 'filesize', 'uuid', 'md5', 'data_variety',
     #  'sample_submitter_id', 'sample_id', 'sample_type', 'aliquot_id',
@@ -352,30 +404,379 @@ def write_catalog(outfn, catalog_data, disease, project):
     print("Writing catalog to " + outfn)
     write_data.to_csv(outfn, sep="\t", quoting=csv.QUOTE_NONE, index=False)
 
+# Batch mode
+# Rather than running this script up to three times per case (see make_catalog3.sh), all cases of a project
+# are processed at once: aliquots, submitted and harmonized reads of all cases are read into combined frames
+# and generate_catalog is run once over reads and once over methylation data.  Per-case catalog3 files
+# are written to the same place as make_catalog3.sh writes them, and optionally all are merged into one
+# project catalog as done by collect_catalog3 in process_catalog.sh
+#
+# With a memory budget (-m), cases are processed in groups with about as many rows of reads as fit in the budget,
+# so that memory use does not grow with the size of the project.  Aliquots of all cases are prepared once and
+# indexed by case, and the aliquots of each group are selected from them.  Groups consist of whole cases, so
+# catalog3 files are the same as when all cases are processed at once
+#
+# Incremental rebuild (-i): the fingerprint of the inputs, catalog code and configuration of each catalog3 file is
+# recorded next to it (see catalog_fingerprint.py), and catalog3 files whose fingerprint is unchanged are not made
+# again.  In batch mode only cases with a changed catalog3 file are read and processed.  -l lists those cases, so
+# that process_catalog.sh -i runs make_catalog3.sh only for them
+
+# Per-case input files and the catalog3 file written for each, relative to LOGBASE/outputs/CASE
+READS_FILES = [("submitted_reads.dat", "submitted_reads.catalog3.dat"), ("harmonized_reads.dat", "harmonized_reads.catalog3.dat")]
+METHYLATION_FILES = [("methylation_array.dat", "methylation_array.catalog3.dat")]
+
+# Approximate peak memory of reading, catalog generation and writing per row of reads, in bytes, as measured
+# for batch mode on projects written by synthetic_data.py.  Used to convert a memory budget to a number of rows
+ROW_BYTES = 2500
+# Rows read or written at once in batch mode
+BLOCK_ROWS = 10000
+
+# Returns list of (case, disease) tuples from CASES file, skipping commented out entries
+def read_cases(cases_fn):
+    cases = []
+    with open(cases_fn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.split("\t")
+            cases.append((fields[0], fields[1]))
+    return cases
+
+# Returns list of cases which are to be processed; cases with is_empty.flag are skipped
+# As in process_catalog.sh, read groups and submitted reads are required to exist
+def get_batch_cases(cases, logbase):
+    batch_cases = []
+    for case, disease in cases:
+        datd = os.path.join(logbase, "outputs", case)
+        if os.path.exists(os.path.join(datd, "is_empty.flag")):
+            eprint("{}/is_empty.flag exists.  Skipping case".format(datd))
+            continue
+        for fn in ["aliquots.dat", "read_groups.dat", "submitted_reads.dat"]:
+            if not is_nonempty(os.path.join(datd, fn)):
+                raise ValueError("{} does not exist or is empty".format(os.path.join(datd, fn)))
+        batch_cases.append((case, disease))
+    return batch_cases
+
+def is_nonempty(fn):
+    return os.path.exists(fn) and os.path.getsize(fn) > 0
+
+# Read given per-case file for all cases and concatenate.  Column _outfn records the catalog3 file
+# each row is to be written to.  Returns None if no data.  Columns are converted to categoricals for blocks of
+# about BLOCK_ROWS rows, which is much faster than converting those of each file
+def read_batch_files(cases, logbase, file_list, reader, categories):
+    blocks = []
+    frames = []
+    rows = 0
+    for case, disease in cases:
+        datd = os.path.join(logbase, "outputs", case)
+        for in_fn, out_fn in file_list:
+            fn = os.path.join(datd, in_fn)
+            if not is_nonempty(fn):
+                continue
+            rf = reader(fn, categorical=False)
+            if rf.empty:
+                continue
+            rf['_outfn'] = os.path.join(datd, out_fn)
+            frames.append(rf)
+            rows += len(rf)
+            if rows >= BLOCK_ROWS:
+                blocks.append(to_categorical(pd.concat(frames, ignore_index=True), categories))
+                frames = []
+                rows = 0
+    if frames:
+        blocks.append(to_categorical(pd.concat(frames, ignore_index=True), categories))
+    if not blocks:
+        return None
+    return concat_frames(blocks)
+
+# Concatenate frames read by the same reader.  Categorical columns remain categorical, with the union of the
+# categories of all frames; pd.concat would convert them to strings
+def concat_frames(frames):
+    columns = {}
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            columns[col] = union_categoricals([f[col] for f in frames])
+        else:
+            columns[col] = pd.concat([f[col] for f in frames], ignore_index=True)
+    return pd.DataFrame(columns)
+
+# Number of rows of per-case input files, counted as lines
+def count_rows(cases, logbase, file_list):
+    rows = {}
+    for case, disease in cases:
+        n = 0
+        for in_fn, out_fn in file_list:
+            fn = os.path.join(logbase, "outputs", case, in_fn)
+            if os.path.exists(fn):
+                with open(fn, 'rb') as f:
+                    n += sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b""))
+        rows[case] = n
+    return rows
+
+# Split cases into groups of whole cases with up to max_rows rows of input each.  A case with more rows
+# is a group of its own
+def get_case_groups(cases, rows, max_rows):
+    groups = [[]]
+    n = 0
+    for case in cases:
+        if groups[-1] and n + rows[case[0]] > max_rows:
+            groups.append([])
+            n = 0
+        groups[-1].append(case)
+        n += rows[case[0]]
+    return groups
+
+# Aliquots of given cases, from aliquots of all cases indexed by case with case_rows
+def select_aliquots(aliquots, case_rows, cases):
+    ix = [case_rows[case] for case, disease in cases if case in case_rows]
+    if not ix:
+        return aliquots.iloc[:0]
+    return aliquots.take(np.concatenate(ix))
+
+# Write catalog3 rows to the per-case file given by column _outfn.  Returns dictionary case -> list of
+# catalog3 files written.  Rows are formatted BLOCK_ROWS at a time, rather than all at once, and appended to
+# the files of those rows
+def write_batch_catalogs(catalog_data, diseases, project):
+    catalog_data['disease'] = catalog_data['case'].map(diseases)
+    catalog_data['project'] = project
+    header = "\t".join(CATALOG_HEADER)
+
+    case_files = {}
+    written = set()
+    for start in range(0, len(catalog_data), BLOCK_ROWS):
+        block = catalog_data.iloc[start:start + BLOCK_ROWS]
+        lines = block[CATALOG_HEADER].to_csv(sep="\t", quoting=csv.QUOTE_NONE, index=False, header=False).splitlines()
+        for outfn, ix in block.groupby('_outfn', sort=False).indices.items():
+            if outfn not in written:
+                print("Writing catalog to " + outfn)
+                with open(outfn, 'w') as f:
+                    f.write(header + "\n")
+                written.add(outfn)
+                case_files.setdefault(block['case'].iat[ix[0]], []).append(outfn)
+            with open(outfn, 'a') as f:
+                for i in ix:
+                    f.write(lines[i] + "\n")
+    return case_files
+
+# Rows of catalog3 files, without header
+def read_catalog_lines(fns):
+    lines = []
+    for fn in fns:
+        with open(fn) as f:
+            lines += f.read().split("\n")[1:]
+    return lines
+
+# Same as collect_catalog3 in process_catalog.sh: header, followed by unique sorted rows of each case.
+# Rows are sorted by byte value (as with LC_ALL=C sort).  Rows are read back from the catalog3 files written for
+# each case, given by case_files, so that rows of all cases need not be kept in memory
+def write_merged_catalog(outfn, cases, case_files):
+    with open(outfn, 'w') as f:
+        f.write("\t".join(CATALOG_HEADER) + "\n")
+        for case, disease in cases:
+            for line in sorted(set(read_catalog_lines(case_files.get(case, [])))):
+                if line.strip() != "":
+                    f.write(line + "\n")
+    eprint("Written merged catalog to " + outfn)
+
+# Catalog3 files of case with the fingerprint of their inputs, as list of (outfn, fingerprint).  Only files
+# whose input exists are made.  Fingerprints are the same as those of per-case runs of make_catalog3.py -i
+def case_fingerprints(case, disease, logbase, project, version, parquet_dir=None):
+    datd = os.path.join(logbase, "outputs", case)
+    fps = []
+    for file_list, is_methylation in [(READS_FILES, False), (METHYLATION_FILES, True)]:
+        for in_fn, out_fn in file_list:
+            fn = os.path.join(datd, in_fn)
+            if is_nonempty(fn):
+                fp = fingerprint(version, [os.path.join(datd, "aliquots.dat"), fn], is_methylation, disease, project, parquet_dir)
+                fps.append((os.path.join(datd, out_fn), fp))
+    return fps
+
+# Cases with a catalog3 file which is not up to date, and dictionary case -> fingerprints of all cases
+def get_changed_cases(cases, logbase, project, version, parquet_dir=None):
+    fingerprints = {case: case_fingerprints(case, disease, logbase, project, version, parquet_dir) for case, disease in cases}
+    changed = [(case, disease) for case, disease in cases if not all(is_current(outfn, fp) for outfn, fp in fingerprints[case])]
+    return changed, fingerprints
+
+# With version given (see catalog_fingerprint.catalog_version), only cases whose inputs, catalog code or
+# configuration changed since their catalog3 files were made are processed, and the fingerprints of their
+# catalog3 files are recorded.  Rows of unchanged cases in the merged catalog are read from their catalog3 files
+def make_batch_catalog(cases_fn, logbase, project, merged_fn=None, parquet_dir=None, memory_mb=None, annotation_codes=None, sample_types=None, version=None):
+    all_cases = get_batch_cases(read_cases(cases_fn), logbase)
+    cases = all_cases
+    diseases = dict(cases)
+    case_files = {}
+    fingerprints = {}
+    if version is not None and parquet_dir is not None:
+        # Parquet files are written by group rather than by case, so a partial rebuild would lose unchanged cases
+        eprint("Parquet dataset is written for all cases.  Processing all cases")
+        version = None
+    if parquet_dir is not None:
+        # Groups depend on the memory budget, so files of an earlier run may have other names than those written now
+        remove_parquet(parquet_dir, batch_parquet_names(project) + [name for case, disease in all_cases for name in case_parquet_names(case)])
+    if version is not None:
+        with metrics.timed("phase", program="make_catalog3", phase="fingerprint", cases=len(all_cases)) as m:
+            cases, fingerprints = get_changed_cases(all_cases, logbase, project, version)
+            m["changed"] = len(cases)
+        eprint("{} of {} cases changed since catalog3 files were made".format(len(cases), len(all_cases)))
+        changed = set(case for case, disease in cases)
+        for case, disease in all_cases:
+            if case not in changed:
+                case_files[case] = [outfn for outfn, fp in fingerprints[case] if was_written(outfn)]
+    with metrics.timed("phase", program="make_catalog3", phase="read_aliquots", cases=len(cases)) as m:
+        aliquots = to_categorical(pd.concat([read_aliquots(os.path.join(logbase, "outputs", case, "aliquots.dat"), categorical=False) for case, disease in cases],
+            ignore_index=True), ALIQUOTS_CATEGORIES) if cases else None
+        m["rows"] = 0 if aliquots is None else len(aliquots)
+    if aliquots is None:
+        eprint("No cases to process")
+    else:
+        aliquots = prepare_aliquots(aliquots, annotation_codes, sample_types)
+        case_rows = aliquots.groupby('case', sort=False, observed=True).indices
+        for file_list, reader, categories, is_methylation in [(READS_FILES, read_reads_file, READS_CATEGORIES, False),
+                (METHYLATION_FILES, read_methylation_file, METHYLATION_CATEGORIES, True)]:
+            data = "methylation_array" if is_methylation else "reads"
+            if memory_mb is None:
+                groups = [cases]
+            else:
+                groups = get_case_groups(cases, count_rows(cases, logbase, file_list), max(1, memory_mb * 10**6 // ROW_BYTES))
+                eprint("Processing {} of {} cases in {} groups".format(data, len(cases), len(groups)))
+            for k, group in enumerate(groups):
+                with metrics.timed("phase", program="make_catalog3", phase="read_" + data, group=k) as m:
+                    read_data = read_batch_files(group, logbase, file_list, reader, categories)
+                    m["rows"] = 0 if read_data is None else len(read_data)
+                if read_data is None:
+                    continue
+                with metrics.timed("phase", program="make_catalog3", phase="generate_catalog", data=data, group=k) as m:
+                    catalog_data = generate_catalog(read_data, select_aliquots(aliquots, case_rows, group), is_methylation, prepared=True)
+                    m["rows"] = len(catalog_data)
+                del read_data
+                if catalog_data.empty:
+                    continue
+                with metrics.timed("phase", program="make_catalog3", phase="write_catalog", data=data, rows=len(catalog_data), group=k):
+                    for case, fns in write_batch_catalogs(catalog_data, diseases, project).items():
+                        case_files.setdefault(case, []).extend(fns)
+                if parquet_dir is not None:
+                    # Each group is written to its own files
+                    basename = "{}.{}".format(project, data) if memory_mb is None else "{}.{}.{}".format(project, data, k)
+                    with metrics.timed("phase", program="make_catalog3", phase="write_parquet", data=data, rows=len(catalog_data), group=k):
+                        write_parquet(parquet_dir, catalog_data, basename)
+                del catalog_data
+    # Recorded once all catalog3 files of case are written, so that an interrupted run is redone
+    for case, disease in cases:
+        for outfn, fp in fingerprints.get(case, []):
+            write_record(outfn, fp, outfn in case_files.get(case, []))
+    if merged_fn is not None:
+        with metrics.timed("phase", program="make_catalog3", phase="write_merged_catalog", cases=len(all_cases)):
+            write_merged_catalog(merged_fn, all_cases, case_files)
+
+# Parquet output is optional, and requires pyarrow only when used
+def write_parquet(outd, catalog_data, basename):
+    import catalog_parquet
+    catalog_parquet.write_parquet(outd, catalog_data, basename)
+
+# Parquet files of a project or case are removed from all partitions before it is written, so that files of an
+# earlier run are not kept next to the new ones when rows moved to another partition, when batch mode groups
+# cases differently, or when the dataset was written in the other mode.  Switching between batch and per-case
+# mode therefore rewrites the project's Parquet files
+def remove_parquet(outd, basenames):
+    import catalog_parquet
+    catalog_parquet.remove_files(outd, basenames)
+
+# Basenames, as glob patterns, of Parquet files written for project in batch mode, e.g., CPTAC3.reads or
+# CPTAC3.reads.2 with a memory budget
+def batch_parquet_names(project):
+    return [glob.escape(project) + "." + data + suffix for data in ("reads", "methylation_array") for suffix in ("", ".*")]
+
+# Basenames, as glob patterns, of Parquet files written for case in per-case mode, e.g., C3L-00004.submitted_reads
+def case_parquet_names(case, file_list=READS_FILES + METHYLATION_FILES):
+    return [glob.escape(case) + "." + os.path.basename(out_fn).split(".")[0] for in_fn, out_fn in file_list]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Processes reads files to create a catalog3 view of each entry")
-    parser.add_argument("reads_fn", help="Harmonized or Submitted Reads file")
-    parser.add_argument("-o", "--output", dest="outfn", required=True, help="Output file name")
-    parser.add_argument("-Q", "--aliquots", dest="aliquots_fn", required=True, help="Aliquots file")
+    parser.add_argument("reads_fn", nargs="?", help="Harmonized or Submitted Reads file.  Not used in batch mode")
+    parser.add_argument("-o", "--output", dest="outfn", help="Output file name.  In batch mode, optional merged catalog for all cases")
+    parser.add_argument("-Q", "--aliquots", dest="aliquots_fn", help="Aliquots file")
+    parser.add_argument("-C", "--cases", dest="cases_fn", help="Batch mode: process all cases in CASES file, with case name and disease in first and second columns")
+    parser.add_argument("-L", "--logbase", dest="logbase", default="./logs", help="Batch mode: base directory of discovery output.  Default ./logs")
     parser.add_argument("-D", "--disease", dest="disease", default="DISEASE", help="Disease code")
     parser.add_argument("-P", "--project", dest="project", default="PROJECT", help="Project name")
-    parser.add_argument("-A", "--annotation", dest="annotation_fn", help="Annotation table")
+    parser.add_argument("-A", "--annotation", dest="annotation_fn", help="Annotation table with annotation code of each known aliquot annotation, e.g., config/annotation_table.txt.  Takes precedence over annotation rules")
+    parser.add_argument("-R", "--annotation-rules", dest="rules_fn", default=ANNOTATION_RULES, help="Annotation rules.  Default config/annotation_rules.txt")
+    parser.add_argument("-T", "--sample-types", dest="sample_types_fn", default=SAMPLE_TYPES, help="Sample types with short names and codes.  Default config/sample_types.txt")
     parser.add_argument("-d", "--debug", action="store_true", help="Print debugging information to stderr")
     parser.add_argument("-n", "--no-header", action="store_true", help="Do not print header")
     parser.add_argument("-M", "--is_methylation", dest="is_methylation", default=False, action="store_true", help="Reads are methylation data")
+    parser.add_argument("-p", "--parquet", dest="parquet_dir", help="Also write catalog to Parquet dataset in this directory, partitioned by disease and experimental strategy.  Requires pyarrow")
+    parser.add_argument("-m", "--memory", dest="memory_mb", type=int, help="Batch mode: process cases in groups so that catalog generation uses about this many MB")
+    parser.add_argument("-i", "--incremental", action="store_true", help="Do not make catalog3 files whose inputs, catalog code and configuration are unchanged since last made, as recorded in OUTFN.fingerprint")
+    parser.add_argument("-l", "--list-changed", dest="changed_fn", help="Batch mode: write cases whose catalog3 files are not up to date to this file, rather than making catalogs")
 
     args = parser.parse_args()
 
-    aliquots=read_aliquots(args.aliquots_fn)
-    if args.is_methylation:
-        read_data = read_methylation_file(args.reads_fn)
-    else:
-        read_data = read_reads_file(args.reads_fn)
-    catalog_data = generate_catalog(read_data, aliquots, args.is_methylation)
+    try:
+        annotation_codes = AnnotationCodes.from_files(args.rules_fn, args.annotation_fn)
+        sample_types = read_sample_types(args.sample_types_fn)
+    except (OSError, ValueError, re.error) as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
+    version = catalog_version([args.rules_fn, args.sample_types_fn, args.annotation_fn]) if (args.incremental or args.changed_fn is not None) else None
+
+    if args.changed_fn is not None:
+        if args.cases_fn is None:
+            parser.error("-l requires batch mode (-C)")
+        try:
+            # Listed for per-case runs of make_catalog3.py -i, whose fingerprints include the Parquet directory
+            changed, fingerprints = get_changed_cases(get_batch_cases(read_cases(args.cases_fn), args.logbase), args.logbase, args.project, version, args.parquet_dir)
+        except ValueError as e:
+            eprint("ERROR: {}".format(e))
+            sys.exit(1)
+        with open(args.changed_fn, 'w') as f:
+            for case, disease in changed:
+                f.write("{}\t{}\n".format(case, disease))
+        eprint("{} of {} cases changed since catalog3 files were made.  Written to {}".format(len(changed), len(fingerprints), args.changed_fn))
+        sys.exit(0)
+
+    if args.cases_fn is not None:
+        try:
+            make_batch_catalog(args.cases_fn, args.logbase, args.project, args.outfn, args.parquet_dir, args.memory_mb, annotation_codes, sample_types, version)
+        except ValueError as e:
+            eprint("ERROR: {}".format(e))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.reads_fn is None or args.outfn is None or args.aliquots_fn is None:
+        parser.error("reads_fn, -o and -Q are required unless in batch mode (-C)")
+
+    if version is not None:
+        fp = fingerprint(version, [args.aliquots_fn, args.reads_fn], args.is_methylation, args.disease, args.project, args.parquet_dir)
+        if is_current(args.outfn, fp):
+            eprint("Inputs unchanged since {} was made.  Not writing".format(args.outfn))
+            sys.exit(0)
+
+    with metrics.timed("phase", program="make_catalog3", phase="read", input=args.reads_fn) as m:
+        aliquots=read_aliquots(args.aliquots_fn)
+        if args.is_methylation:
+            read_data = read_methylation_file(args.reads_fn)
+        else:
+            read_data = read_reads_file(args.reads_fn)
+        m["rows"] = len(read_data)
+    with metrics.timed("phase", program="make_catalog3", phase="generate_catalog", input=args.reads_fn) as m:
+        catalog_data = generate_catalog(read_data, aliquots, args.is_methylation, annotation_codes=annotation_codes, sample_types=sample_types)
+        m["rows"] = len(catalog_data)
+
+    if args.parquet_dir is not None and not read_data.empty:
+        # Also removes Parquet files of this catalog when it is now empty
+        remove_parquet(args.parquet_dir, batch_parquet_names(args.project) + case_parquet_names(str(read_data['case'].iat[0]), [(args.reads_fn, args.outfn)]))
 
     if (not catalog_data.empty):
-        write_catalog(args.outfn, catalog_data, args.disease, args.project)
+        with metrics.timed("phase", program="make_catalog3", phase="write_catalog", input=args.reads_fn, rows=len(catalog_data)):
+            write_catalog(args.outfn, catalog_data, args.disease, args.project)
+        if args.parquet_dir is not None:
+            # e.g., C3L-00004.submitted_reads
+            basename = "{}.{}".format(catalog_data['case'].iat[0], os.path.basename(args.outfn).split(".")[0])
+            with metrics.timed("phase", program="make_catalog3", phase="write_parquet", input=args.reads_fn, rows=len(catalog_data)):
+                write_parquet(args.parquet_dir, catalog_data, basename)
     else:
         eprint("Catalog is empty.  Not writing " + args.outfn)
-
-    
+    if version is not None:
+        write_record(args.outfn, fp, not catalog_data.empty)
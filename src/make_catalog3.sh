@@ -19,6 +19,10 @@ Options:
 -o: Output directery OUTD.  Will create if does not exist.  Default: '.'
 -D DISEASE: Disease code associated with case, e.g., BRCA.  Used only `disease` column in catalog output
 -P PROJECT: Project code associated with case, e.g., CPTAC3.  Used only `project` column in catalog output
+-p PARQUET_DIR: Also write catalog to Parquet dataset in PARQUET_DIR, partitioned by disease and experimental strategy.  Requires pyarrow
+-A ANNOTATION_TABLE: Table of annotation codes of known aliquot annotations, e.g., config/annotation_table.txt
+-i: Incremental.  Do not remake catalog3 files whose inputs, catalog code and configuration are unchanged since
+    they were made, as recorded in OUTD/*.catalog3.dat.fingerprint
 
 Input data: Read the following files $DATD:
 * aliquots.dat
@@ -36,7 +40,7 @@ EOF
 OUTD="."
 DP_ARGS=""  # Will hold optional flags for DISEASE and PROJECT
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
-while getopts ":hdo:D:P:" opt; do
+while getopts ":hdo:D:P:p:A:i" opt; do
   case $opt in
     h)
       echo "$USAGE"
@@ -54,6 +58,15 @@ while getopts ":hdo:D:P:" opt; do
     P) 
       DP_ARGS="$DP_ARGS -P $OPTARG"
       ;;
+    p) 
+      DP_ARGS="$DP_ARGS -p $OPTARG"
+      ;;
+    A) 
+      DP_ARGS="$DP_ARGS -A $OPTARG"
+      ;;
+    i) 
+      DP_ARGS="$DP_ARGS -i"
+      ;;
     \?)
       >&2 echo "Invalid option: -$OPTARG" 
       echo "$USAGE"
@@ -0,0 +1,71 @@
+import json, time, fcntl, contextlib
+import os
+
+# Structured metrics of discovery and catalog runs
+#
+# If the environment variable GDC_METRICS is defined, records are appended as JSON lines to that file.
+# Several processes may write to the same file; each record is written with a single locked write.
+# Otherwise nothing is recorded.
+#
+# Record types:
+# * stage - one discovery stage of a case (process_case.sh): aliquots, read_groups, submitted_reads, ...
+#     {"type": "stage", "case": "C3L-00004", "stage": "read_groups", "start": 1690000000.0, "seconds": 12.1, "status": 0}
+# * query - one HTTP request to GDC (queryGDC.sh, gdc_client.py, gdc_batch.py).  `error` is null on success,
+#   otherwise the error class (see error_class); `batch` is the number of lookups in a batched query
+#     {"type": "query", "case": "C3L-00004", "stage": "read_groups", "source": "gdc_client", "start": ..., "seconds": 0.8,
+#      "bytes": 2312, "error": null, "cached": false}
+# * phase - one step of make_catalog3.py, with number of rows processed
+#     {"type": "phase", "program": "make_catalog3", "phase": "generate_catalog", "start": ..., "seconds": 1.2, "rows": 5210}
+#
+# Case and stage are taken from GDC_METRICS_CASE and GDC_METRICS_STAGE, which process_case.sh sets for the
+# scripts it calls.  See metrics_report.py for a summary of the metrics file
+
+def get_metrics_fn():
+    return os.environ.get("GDC_METRICS") or None
+
+def is_enabled():
+    return get_metrics_fn() is not None
+
+def record(kind, **fields):
+    fn = get_metrics_fn()
+    if fn is None:
+        return
+    r = {"type": kind}
+    for key, var in [("case", "GDC_METRICS_CASE"), ("stage", "GDC_METRICS_STAGE")]:
+        if os.environ.get(var):
+            r[key] = os.environ[var]
+    r.update(fields)
+    line = json.dumps(r) + "\n"
+    with open(fn, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+
+# Record time taken by the body of the with statement.  Fields may be added to the yielded dictionary, e.g.,
+#   with metrics.timed("phase", program="make_catalog3", phase="read") as m:
+#       ...
+#       m["rows"] = len(df)
+@contextlib.contextmanager
+def timed(kind, **fields):
+    start = time.time()
+    try:
+        yield fields
+    finally:
+        record(kind, start=start, seconds=time.time() - start, **fields)
+
+# Error classes of queries which are retried.  "unauthorized" is fatal and is not retried
+RETRIED_ERRORS = ["throttle", "timeout", "parse", "other"]
+
+# Classify GDC query errors for reporting.  R is the response text and errors the list from gdc_client.get_errors,
+# or None if the response is not valid JSON
+def error_class(R, errors):
+    if errors == []:
+        return None
+    if "You are posting too quickly" in R:
+        return "throttle"
+    if errors is None:
+        return "parse"
+    if "Unauthorized query." in errors:
+        return "unauthorized"
+    if any("second timeout" in e for e in errors):
+        return "timeout"
+    return "other"
@@ -0,0 +1,157 @@
+import json
+import argparse, sys, os
+from metrics import RETRIED_ERRORS
+
+# Summarize metrics file written by discovery and catalog scripts (see metrics.py), e.g.,
+#   python src/metrics_report.py logs/metrics.jsonl
+#
+# Reports
+# * per stage: number of cases, total, mean and maximum time, queries, retries, failures and response bytes
+# * slowest cases, and slowest stages of individual cases
+# * query errors by class
+# * make_catalog3.py phases
+#
+# A query is one HTTP request to GDC which succeeded; retries are requests which failed with an error that is
+# retried (see RETRIED_ERRORS in metrics.py), and failures are those which failed with a fatal error, such as an
+# unauthorized query.  Responses served from the query cache are counted separately
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+def read_metrics(fn):
+    records = []
+    with open(fn) as f:
+        for i, line in enumerate(f):
+            if line.strip() == "":
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                eprint("WARNING: {}:{} is not valid JSON.  Skipping".format(fn, i + 1))
+    return records
+
+class Totals:
+    def __init__(self):
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.runs = 0
+        self.queries = 0
+        self.cached = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes = 0
+        self.cases = set()
+
+    def add_stage(self, r):
+        self.seconds += r.get("seconds", 0)
+        self.max_seconds = max(self.max_seconds, r.get("seconds", 0))
+        self.runs += 1
+        if "case" in r:
+            self.cases.add(r["case"])
+
+    def add_query(self, r):
+        self.bytes += r.get("bytes", 0)
+        if r.get("cached"):
+            self.cached += 1
+        elif r.get("error") is None:
+            self.queries += 1
+        elif r["error"] in RETRIED_ERRORS:
+            self.retries += 1
+        else:
+            self.failures += 1
+
+# Returns dictionaries of Totals by stage, by case, and by (case, stage), and count of errors by (class, source)
+def summarize(records):
+    by_stage, by_case, by_case_stage = {}, {}, {}
+    errors = {}
+    for r in records:
+        if r.get("type") not in ("stage", "query"):
+            continue
+        case = r.get("case", "NA")
+        stage = r.get("stage", "NA")
+        for d, key in [(by_stage, stage), (by_case, case), (by_case_stage, (case, stage))]:
+            t = d.setdefault(key, Totals())
+            if r["type"] == "stage":
+                t.add_stage(r)
+            else:
+                t.add_query(r)
+        if r["type"] == "query" and r.get("error") is not None:
+            key = (r["error"], r.get("source", "NA"))
+            errors[key] = errors.get(key, 0) + 1
+    return by_stage, by_case, by_case_stage, errors
+
+def summarize_phases(records):
+    phases = {}
+    for r in records:
+        if r.get("type") != "phase":
+            continue
+        key = (r.get("program", "NA"), r.get("phase", "NA"), r.get("data", ""))
+        p = phases.setdefault(key, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0})
+        p["count"] += 1
+        p["seconds"] += r.get("seconds", 0)
+        p["max_seconds"] = max(p["max_seconds"], r.get("seconds", 0))
+        p["rows"] += r.get("rows", 0) or 0
+    return phases
+
+def mb(n):
+    return "{:.2f}".format(n / 1e6)
+
+def print_report(records, top=10, outf=sys.stdout):
+    by_stage, by_case, by_case_stage, errors = summarize(records)
+    w = lambda *fields: outf.write("\t".join(str(f) for f in fields) + "\n")
+
+    w("# Stages")
+    w("stage", "cases", "runs", "total_seconds", "mean_seconds", "max_seconds", "queries", "cached", "retries", "failures", "MB")
+    for stage, t in sorted(by_stage.items(), key=lambda x: -x[1].seconds):
+        mean = t.seconds / t.runs if t.runs else 0
+        w(stage, len(t.cases), t.runs, "{:.1f}".format(t.seconds), "{:.2f}".format(mean), "{:.2f}".format(t.max_seconds),
+            t.queries, t.cached, t.retries, t.failures, mb(t.bytes))
+
+    w("")
+    w("# Slowest cases")
+    w("case", "total_seconds", "queries", "cached", "retries", "failures", "MB", "slowest_stage", "slowest_stage_seconds")
+    for case, t in sorted(by_case.items(), key=lambda x: -x[1].seconds)[:top]:
+        stages = [(s, cs.seconds) for (c, s), cs in by_case_stage.items() if c == case]
+        slowest = max(stages, key=lambda x: x[1]) if stages else ("NA", 0)
+        w(case, "{:.1f}".format(t.seconds), t.queries, t.cached, t.retries, t.failures, mb(t.bytes), slowest[0], "{:.1f}".format(slowest[1]))
+
+    w("")
+    w("# Slowest case stages")
+    w("case", "stage", "seconds", "queries", "retries", "failures", "MB")
+    for (case, stage), t in sorted(by_case_stage.items(), key=lambda x: -x[1].seconds)[:top]:
+        w(case, stage, "{:.1f}".format(t.seconds), t.queries, t.retries, t.failures, mb(t.bytes))
+
+    w("")
+    w("# Query errors")
+    w("error", "source", "count")
+    for (error, source), n in sorted(errors.items(), key=lambda x: -x[1]):
+        w(error, source, n)
+
+    phases = summarize_phases(records)
+    if phases:
+        w("")
+        w("# Catalog phases")
+        w("program", "phase", "data", "count", "total_seconds", "max_seconds", "rows")
+        for (program, phase, data), p in sorted(phases.items(), key=lambda x: -x[1]["seconds"]):
+            w(program, phase, data, p["count"], "{:.2f}".format(p["seconds"]), "{:.2f}".format(p["max_seconds"]), p["rows"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize discovery and catalog metrics")
+    parser.add_argument("metrics_fn", nargs="+", help="Metrics file(s) written with GDC_METRICS")
+    parser.add_argument("-n", "--top", dest="top", type=int, default=10, help="Number of slowest cases and case stages to report")
+    parser.add_argument("-o", "--output", dest="outfn", help="Write report to this file rather than stdout")
+
+    args = parser.parse_args()
+
+    records = []
+    for fn in args.metrics_fn:
+        if not os.path.exists(fn):
+            eprint("ERROR: {} does not exist".format(fn))
+            sys.exit(1)
+        records += read_metrics(fn)
+
+    if args.outfn:
+        with open(args.outfn, 'w') as f:
+            print_report(records, args.top, f)
+    else:
+        print_report(records, args.top)
@@ -0,0 +1,375 @@
+import json, re, time, random, threading, collections
+import argparse, sys, os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from gdc_batch import READ_GROUP_FIELDS, SAR_STRATEGIES
+from gdc_record import GDCRecord
+from case_scheduler import read_cases
+import synthetic_data
+
+# Local mock of the GDC submission GraphQL API, for offline end-to-end tests and benchmarks of discovery
+#
+# Responses are either
+# * replayed from an archive recorded during a real run with GDC_RECORD (see gdc_record.py), or
+# * generated from synthetic cases (see synthetic_data.py).  The graph of synthetic entities is queried as GDC
+#   would be: `ENTITY(with_path_to: {type: T, submitter_id|id|project_id: X}, first: N, offset: M) { fields }`,
+#   with aliases (gdc_batch.py), links to parents and children in the selection, and paging.
+#
+# The GDC API's failure modes may be injected:
+# * latency: a fixed delay before every response, or the time each query took when recorded (-R)
+# * throttling: a fraction of requests, and all requests above a rate, are answered with the
+#   "You are posting too quickly" HTML page
+# * timeouts: a fraction of requests, and queries returning more than a number of entities, are answered with the
+#   20 second query timeout error
+# Queries not in the archive are answered with "Unauthorized query.", which clients do not retry, and are logged.
+# Requests with a token other than that given with -k are also unauthorized.  Counts of requests by outcome are
+# returned by GET /stats.
+#
+# Usage:
+#   python src/mock_gdc_server.py -a logs/gdc_record.sqlite -p 8765
+#   python src/mock_gdc_server.py -C dat/cases.dat -p 8765 -l 0.05 -t 0.02 -T 0.01
+#   GDC_URL=http://127.0.0.1:8765/ bash src/run_discovery.sh dat/cases.dat
+
+PORT = 8765
+# Number of results when `first` is not given, as with GDC; see case_traversal.DEFAULT_FIRST
+DEFAULT_FIRST = 10
+THROTTLE_HTML = ("<html><head><title>Hold up there!</title></head><body><center><h1>Hold up there!</h1>"
+    "<p>You are posting too quickly. Wait for few moments and try again.</p></body></html>")
+TIMEOUT_ERROR = ("Query exceeded 20.0 second timeout. Please reduce query complexity and try again. Ways to limit query "
+    "complexity include adding \"first: 1\" arguments to limit results, limiting path query filter usage (e.g. with_path_to), "
+    "or limiting extensive path traversal field inclusion (e.g. _related_cases).")
+FILE_FIELDS = ["experimental_strategy", "data_format", "id", "file_name", "file_size", "md5sum", "state"]
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Tokens of GraphQL query: strings, numbers, names and punctuation
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|-?\d+|\w+|[{}():,\[\]]|\S')
+
+# Parser for the subset of GraphQL used in discovery queries.  parse() returns list of fields of top-level
+# selection, each (alias, name, arguments, selection), where selection is None for scalar fields
+class QueryParser:
+    def __init__(self, query):
+        self.tokens = TOKEN_RE.findall(query)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise ValueError("Syntax error: expected {} at token {} of query, found {}".format(expected or "token", self.i, token))
+        self.i += 1
+        return token
+
+    def parse(self):
+        if self.peek() == "query":
+            self.take()
+        selection = self.selection()
+        if self.peek() is not None:
+            raise ValueError("Syntax error: unexpected {} after query".format(self.peek()))
+        return selection
+
+    def selection(self):
+        self.take("{")
+        fields = []
+        while self.peek() != "}":
+            alias = name = self.take()
+            if self.peek() == ":":
+                self.take()
+                name = self.take()
+            args = self.arguments() if self.peek() == "(" else {}
+            selection = self.selection() if self.peek() == "{" else None
+            fields.append((alias, name, args, selection))
+            if self.peek() == ",":
+                self.take()
+        self.take("}")
+        return fields
+
+    def arguments(self):
+        self.take("(")
+        args = self.object_fields(")")
+        self.take(")")
+        return args
+
+    def object_fields(self, end):
+        d = {}
+        while self.peek() != end:
+            key = self.take()
+            self.take(":")
+            d[key] = self.value()
+            if self.peek() == ",":
+                self.take()
+        return d
+
+    def value(self):
+        token = self.take()
+        if token == "{":
+            d = self.object_fields("}")
+            self.take("}")
+            return d
+        if token.startswith('"'):
+            return json.loads(token)
+        if re.fullmatch(r'-?\d+', token):
+            return int(token)
+        return {"true": True, "false": False, "null": None}.get(token, token)
+
+# Graph of entities of synthetic cases.  Each entity is a dictionary of its fields, with links to other entities
+# as lists of entities, e.g., sample["aliquots"].  Entities are found by the entities on their path to the project
+class SyntheticGraph:
+    def __init__(self, project="SYN"):
+        self.project = project
+        # (entity type, path type, path key) -> list of entities
+        self.paths = {}
+
+    # Register entity of type ENTITY under each entity on its path, given as list of (type, entity)
+    def add(self, entity, e, path):
+        for path_type, p in path + [("project", {"project_id": self.project})]:
+            for key in ("submitter_id", "id", "project_id"):
+                if p.get(key) is not None:
+                    self.paths.setdefault((entity, path_type, p[key]), []).append(e)
+        return e
+
+    # Add synthetic case (see synthetic_data.make_case), with samples in CPTAC or TCGA data model
+    def add_case(self, c, data_model="CPTAC"):
+        case = {"submitter_id": c["submitter_id"], "id": synthetic_data.uuid(random.Random(c["submitter_id"]))}
+        self.add("demographic", dict(c["demographic"], cases=[case]), [("case", case)])
+        for s in c["samples"]:
+            sample = {k: s[k] for k in ("submitter_id", "id", "sample_type", "preservation_method")}
+            sample["cases"] = [case]
+            self.add("sample", sample, [("case", case)])
+            aliquots = [self.add_aliquot(a, [("sample", sample), ("case", case)]) for a in s["aliquots"]]
+            if data_model == "TCGA":
+                analytes = collections.OrderedDict()
+                for a in aliquots:
+                    analytes.setdefault(a["analyte_type"], []).append(a)
+                sample["aliquots"] = []
+                sample["portions"] = [{"analytes": [{"submitter_id": "%s-%s" % (sample["submitter_id"], t[0]), "id": "%s-%s" % (sample["id"], t[0]),
+                    "analyte_type": t, "aliquots": al} for t, al in analytes.items()]}]
+            else:
+                sample["aliquots"] = aliquots
+                sample["portions"] = []
+
+    def add_aliquot(self, a, path):
+        aliquot = {k: a[k] for k in ("submitter_id", "id", "analyte_type", "annotations")}
+        self.add("aliquot", aliquot, path)
+        path = [("aliquot", aliquot)] + path
+        aliquot["read_groups"] = []
+        for r in a["read_groups"]:
+            rg = {k: r[k] for k in READ_GROUP_FIELDS}
+            rg["aliquots"] = [aliquot]
+            aliquot["read_groups"].append(self.add("read_group", rg, path))
+            entity = "submitted_aligned_reads" if r["library_strategy"] in SAR_STRATEGIES else "submitted_unaligned_reads"
+            for f in r["files"]:
+                sr = {k: f[k] for k in FILE_FIELDS}
+                sr["read_groups"] = [rg]
+                self.add(entity, sr, [("read_group", rg)] + path)
+                for h in f["harmonized"]:
+                    ar = {k: h[k] for k in FILE_FIELDS}
+                    ar["submitted_aligned_reads_files"] = [sr] if entity == "submitted_aligned_reads" else []
+                    ar["submitted_unaligned_reads_files"] = [sr] if entity == "submitted_unaligned_reads" else []
+                    self.add("aligned_reads", ar, [(entity, sr), ("read_group", rg)] + path)
+        for m in a["methylation"]:
+            self.add("raw_methylation_array", dict(m, aliquots=[aliquot]), path)
+        return aliquot
+
+    # Entities of given type with path to given entity, paged by first and offset
+    def find(self, entity, args):
+        path = args.get("with_path_to") or {}
+        key = next((path[k] for k in ("submitter_id", "id", "project_id") if k in path), None)
+        found = self.paths.get((entity, path.get("type"), key), [])
+        offset = args.get("offset", 0)
+        return found[offset:offset + args.get("first", DEFAULT_FIRST)]
+
+# Fields of entity given by selection
+def project(e, selection):
+    d = {}
+    for alias, name, args, sub in selection:
+        v = e.get(name)
+        if sub is not None:
+            v = [project(x, sub) for x in v or []]
+        d[alias] = v
+    return d
+
+class MockGDC:
+    def __init__(self, record=None, graph=None, latency=0.0, recorded_latency=False, throttle_fraction=0.0, max_rate=None,
+            timeout_fraction=0.0, max_results=None, token=None, seed=0, verbose=False):
+        self.record = record
+        self.graph = graph
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+        self.throttle_fraction = throttle_fraction
+        self.max_rate = max_rate
+        self.timeout_fraction = timeout_fraction
+        self.max_results = max_results
+        self.token = token
+        self.verbose = verbose
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = collections.deque()   # times of requests in the last second
+        self.counts = collections.Counter()
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    # Fault to inject into request, if any: "throttle" or "timeout"
+    def fault(self):
+        now = time.time()
+        with self.lock:
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            self.recent.append(now)
+            if self.max_rate is not None and len(self.recent) > self.max_rate:
+                return "throttle"
+            x = self.rnd.random()
+        if x < self.throttle_fraction:
+            return "throttle"
+        if x < self.throttle_fraction + self.timeout_fraction:
+            return "timeout"
+        return None
+
+    # Returns (HTTP status, content type, response text, seconds to wait before responding) for request
+    def respond(self, body, token):
+        self.count("requests")
+        fault = self.fault()
+        if fault == "throttle":
+            self.count("throttle")
+            return 429, "text/html", THROTTLE_HTML, self.latency
+        if fault == "timeout":
+            self.count("timeout")
+            return 200, "application/json", json.dumps({"data": {}, "errors": [TIMEOUT_ERROR]}), self.latency
+        if self.token is not None and token != self.token:
+            self.count("unauthorized")
+            return 200, "application/json", json.dumps({"data": None, "errors": ["Unauthorized query."]}), self.latency
+        try:
+            query = json.loads(body)["query"]
+        except (ValueError, KeyError, TypeError):
+            self.count("invalid")
+            return 400, "application/json", json.dumps({"data": None, "errors": ["Invalid request body"]}), self.latency
+        if self.record is not None:
+            return self.replay(query)
+        return self.synthesize(query)
+
+    def replay(self, query):
+        result = self.record.get(query)
+        if result is None:
+            self.count("miss")
+            eprint("Query not in archive: {}".format(query.strip()))
+            return 200, "application/json", json.dumps({"data": None, "errors": ["Unauthorized query."]}), self.latency
+        R, seconds = result
+        self.count("ok")
+        delay = seconds if self.recorded_latency and seconds is not None else self.latency
+        return 200, "application/json", R, delay
+
+    def synthesize(self, query):
+        try:
+            fields = QueryParser(query).parse()
+        except ValueError as e:
+            self.count("invalid")
+            return 400, "application/json", json.dumps({"data": None, "errors": [str(e)]}), self.latency
+        data = {}
+        n = 0
+        for alias, name, args, selection in fields:
+            found = self.graph.find(name, args)
+            n += len(found)
+            data[alias] = [project(e, selection or []) for e in found]
+        if self.max_results is not None and n > self.max_results:
+            self.count("timeout")
+            return 200, "application/json", json.dumps({"data": {}, "errors": [TIMEOUT_ERROR]}), self.latency
+        self.count("ok")
+        return 200, "application/json", json.dumps({"data": data}), self.latency
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, as used by gdc_client.py
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            if mock.verbose:
+                eprint(format % args)
+
+        def send(self, status, content_type, text):
+            b = text.encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(b)))
+            self.end_headers()
+            self.wfile.write(b)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf8")
+            status, content_type, text, delay = mock.respond(body, self.headers.get("X-Auth-Token"))
+            if delay:
+                time.sleep(delay)
+            self.send(status, content_type, text)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self.send(200, "application/json", json.dumps(mock.stats()))
+            else:
+                self.send(404, "text/plain", "Not found")
+    return Handler
+
+# Graph of synthetic cases of cases file, generated as by synthetic_data.py
+def synthetic_graph(cases, files_per_case=60, seed=0, project="SYN", data_model="CPTAC"):
+    graph = SyntheticGraph(project)
+    for case, disease in cases:
+        graph.add_case(synthetic_data.make_case(case, files_per_case, seed), data_model)
+    return graph
+
+# Start server in a background thread.  Returns server, whose URL is "http://127.0.0.1:%d/" % server.server_port
+def start_server(mock, port=0, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock GDC GraphQL server replaying recorded responses or serving synthetic cases")
+    parser.add_argument("-a", "--archive", dest="record_fn", help="Replay responses recorded in this archive (see gdc_record.py)")
+    parser.add_argument("-C", "--cases", dest="cases_fn", help="Serve synthetic data for cases in this TSV file, with case name in first column")
+    parser.add_argument("-f", "--files-per-case", dest="files_per_case", type=int, default=60, help="Approximate number of submitted files per synthetic case")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0, help="Random seed for synthetic data and injected faults")
+    parser.add_argument("-m", "--data-model", dest="data_model", choices=["CPTAC", "TCGA"], default="CPTAC", help="Data model of synthetic samples.  Default CPTAC")
+    parser.add_argument("-P", "--project", dest="project", default="SYN", help="Project ID of synthetic cases.  Default SYN")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=PORT, help="Port to listen on.  Default {}".format(PORT))
+    parser.add_argument("-l", "--latency", dest="latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("-R", "--recorded-latency", dest="recorded_latency", action="store_true", help="Wait as long as each query took when recorded")
+    parser.add_argument("-t", "--throttle", dest="throttle_fraction", type=float, default=0.0, help="Fraction of requests answered with 'You are posting too quickly'")
+    parser.add_argument("-r", "--max-rate", dest="max_rate", type=float, help="Throttle requests above this many per second")
+    parser.add_argument("-T", "--timeout", dest="timeout_fraction", type=float, default=0.0, help="Fraction of requests answered with query timeout error")
+    parser.add_argument("-n", "--max-results", dest="max_results", type=int, help="Queries returning more entities than this time out (synthetic data only)")
+    parser.add_argument("-k", "--token", dest="token_fn", help="Requests with token other than that in this file are unauthorized")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log requests to stderr")
+
+    args = parser.parse_args()
+
+    if (args.record_fn is None) == (args.cases_fn is None):
+        eprint("ERROR: Give either archive (-a) or cases file (-C)")
+        sys.exit(1)
+    token = None
+    if args.token_fn is not None:
+        with open(args.token_fn) as f:
+            token = f.read().rstrip("\n")
+    if args.record_fn is not None:
+        if not os.path.exists(args.record_fn):
+            eprint("ERROR: Archive {} does not exist".format(args.record_fn))
+            sys.exit(1)
+        record, graph = GDCRecord(args.record_fn), None
+        eprint("Replaying {} recorded responses".format(record.count()))
+    else:
+        record, graph = None, synthetic_graph(read_cases(args.cases_fn), args.files_per_case, args.seed, args.project, args.data_model)
+    mock = MockGDC(record, graph, args.latency, args.recorded_latency, args.throttle_fraction, args.max_rate, args.timeout_fraction,
+        args.max_results, token, args.seed, args.verbose)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(mock))
+    server.daemon_threads = True
+    eprint("Mock GDC server listening on http://127.0.0.1:{}/".format(server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        eprint("Requests: {}".format(json.dumps(mock.stats())))
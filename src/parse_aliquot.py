@@ -2,7 +2,7 @@
 # m.wyczalkowski@wustl.edu
 # Washington University School of Medicine
 
-import json
+import json, re
 import argparse, sys, os
 
 # https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
@@ -72,46 +72,86 @@ def eprint(*args, **kwargs):
 #RESULT: {"data":{"sample":[{"aliquots":[],"id":"5a249602-cb25-4a4e-b671-8937d5f929e2","preservation_method":"Frozen","sample_type":"Blood Derived Normal","submitter_id":"CTSP-AD2M-NB1-A"},{"aliquots":[],"id":"4f9b4902-a42b-461a-a66d-739375e524fa","preservation_method":"Frozen","sample_type":"Primary Tumor","submitter_id":"CTSP-AD2M-TTP1-A"},{"aliquots":[],"id":"35058835-82bb-4e52-a697-24432c2622b0","preservation_method":"FFPE","sample_type":"Primary Tumor","submitter_id":"CTSP-AD2M-TTP1-G"}]}}
 
 # Parsing these independently
-            
-def parse_YAML(infn, outfn, case, data_model):
-    if infn: 
-        with open(infn) as f:
-            data = json.load(f)
-    else:
-        data = json.load( sys.stdin )
-
-    outf = open(outfn, 'w') if outfn else sys.stdout
 
-    header=('sample_submitter_id', 'sample_id', 'sample_type', 'preservation_method', 'aliquot_submitter_id', 'aliquot_id', 'analyte_type', 'aliquot_annotation')
-    if case is not None:
-        header = ('case',) + header
-    print('%s' % '\t'.join(header), file=outf)
-
-    if data_model == "TCGA":
-        samples = data['data']['sample']
-        for s in samples:
-            sample_type = s['sample_type']
-            if sample_type is None:
-                sample_type = "unknown"
-            sample_submitter_id = s['submitter_id']
-            sample_id = s['id']
-            sample_preservation_method = format(s['preservation_method'])
-            for p in s['portions']:
-                for a in p['analytes']:
-                    analyte_type = a['analyte_type']
-                    for l in a['aliquots']:
-                        aliquot_id=l['id']
-                        aliquot_submitter_id=l['submitter_id']
-                        annotations=set()
-                        for n in l['annotations']:
-                            annotations.add(n['notes'])
-                        aliquot_annotation=';'.join(annotations)
-
-                        output_data=(sample_submitter_id, sample_id, sample_type, sample_preservation_method, aliquot_submitter_id, aliquot_id, analyte_type, aliquot_annotation)
-                        if case is not None:
-                            output_data = (case,) + output_data
-                        print('\t'.join(output_data), file=outf)
-    elif data_model == "CPTAC":
+# Responses are parsed incrementally: the input is read in chunks, and each element of the `sample` array is
+# decoded as soon as it has been read completely, so only one sample is held in memory at a time.
+# Aliquot records are generated as they are parsed, and output is written in buffered blocks.
+#
+# Library use:
+#     with open("response.json") as f:
+#         for record in iter_aliquots(iter_samples(f), "C3L-00004", "CPTAC"):
+#             ...
+
+HEADER = ('sample_submitter_id', 'sample_id', 'sample_type', 'preservation_method', 'aliquot_submitter_id', 'aliquot_id', 'analyte_type', 'aliquot_annotation')
+CHUNK_SIZE = 65536
+SAMPLE_ARRAY = re.compile(r'"sample"\s*:\s*(\[|null)')
+decoder = json.JSONDecoder()
+
+# Generator of sample dictionaries in response `{"data": {"sample": [ ... ]}}` read from file object f
+def iter_samples(f, chunk_size=CHUNK_SIZE):
+    buf = ""
+    eof = False
+
+    # find start of sample array
+    while True:
+        m = SAMPLE_ARRAY.search(buf)
+        if m or eof:
+            break
+        chunk = f.read(chunk_size)
+        eof = (chunk == "")
+        buf += chunk
+    if m is None:
+        # Not the expected response.  Parse the whole document to report the problem as before
+        data = json.loads(buf)
+        yield from data['data']['sample']
+        return
+    if m.group(1) == "null":
+        return
+    pos = m.end()
+
+    # decode array elements one at a time
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                sample, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield sample
+                buf = buf[end:]
+                pos = 0
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of input in sample array")
+        # element is incomplete; read at least as much again as is pending so large elements are not re-decoded often
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        eof = (chunk == "")
+        buf = buf[pos:] + chunk
+        pos = 0
+
+def get_aliquot_annotation(l):
+    annotations=set()
+    for n in l['annotations']:
+        annotations.add(n['notes'])
+    return ';'.join(annotations)
+
+# Generator of aliquot records (tuples of output fields) for given samples
+def iter_aliquots(samples, case, data_model):
+    for s in samples:
+        sample_type = s['sample_type']
+        if sample_type is None:
+            sample_type = "unknown"
+        sample_submitter_id = s['submitter_id']
+        sample_id = s['id']
+        sample_preservation_method = format(s['preservation_method'])
+        if data_model == "TCGA":
+            aliquots = ((a['analyte_type'], l) for p in s['portions'] for a in p['analytes'] for l in a['aliquots'])
+        elif data_model == "CPTAC":
 #{
 #  "data": {
 #    "sample": [
@@ -127,34 +167,64 @@ def parse_YAML(infn, outfn, case, data_model):
 #        "sample_type": "Solid Tissue Normal",
 #        "submitter_id": "C3L-00001-06"
 #   ...}
-        samples = data['data']['sample']
-        for s in samples:
-            sample_type = s['sample_type']
-            if sample_type is None:
-                sample_type = "unknown"
-            sample_submitter_id = s['submitter_id']
-            sample_id = s['id']
-            sample_preservation_method = format(s['preservation_method'])
-            for l in s['aliquots']:
-                analyte_type = format(l['analyte_type'])    # sometimes analyte_type is `null`
-                aliquot_id=l['id']
-                aliquot_submitter_id=l['submitter_id']
-                annotations=set()
-                for n in l['annotations']:
-                    annotations.add(n['notes'])
-                aliquot_annotation=';'.join(annotations)
-
-                output_data=(sample_submitter_id, sample_id, sample_type, sample_preservation_method, aliquot_submitter_id, aliquot_id, analyte_type, aliquot_annotation)
-                if case is not None:
-                    output_data = (case,) + output_data
-                print('\t'.join(output_data), file=outf)
-    else:
-        assert False    # should never get here because argparse has limited permitted values
+            # sometimes analyte_type is `null`
+            aliquots = ((format(l['analyte_type']), l) for l in s['aliquots'])
+        else:
+            assert False    # should never get here because argparse has limited permitted values
+
+        for analyte_type, l in aliquots:
+            output_data=(sample_submitter_id, sample_id, sample_type, sample_preservation_method, l['submitter_id'], l['id'], analyte_type, get_aliquot_annotation(l))
+            if case is not None:
+                output_data = (case,) + output_data
+            yield output_data
+
+def get_header(case):
+    if case is not None:
+        return ('case',) + HEADER
+    return HEADER
+
+# Write records to outf in blocks of block_size lines
+def write_records(records, outf, block_size=1000):
+    block = []
+    for r in records:
+        block.append('\t'.join(r) + '\n')
+        if len(block) >= block_size:
+            outf.writelines(block)
+            block = []
+    outf.writelines(block)
 
+def parse_YAML(infn, outfn, case, data_model):
+    parse_many([(case, infn, data_model)], outfn, header_case=case)
 
+# Parse several responses, e.g. for many cases, writing one table with a single header line.
+# inputs is a list of (case, input file name, data model) tuples.  Input file name of None reads from stdin
+def parse_many(inputs, outfn, header_case="case"):
+    outf = open(outfn, 'w') if outfn else sys.stdout
+    print('%s' % '\t'.join(get_header(header_case)), file=outf)
+    for case, infn, data_model in inputs:
+        if infn:
+            with open(infn) as f:
+                write_records(iter_aliquots(iter_samples(f), case, data_model), outf)
+        else:
+            write_records(iter_aliquots(iter_samples(sys.stdin), case, data_model), outf)
     if outf is not sys.stdout:
         outf.close()
 
+# Batch file lists case, input file name, and optionally data model in tab-separated columns
+def read_batch_file(batch_fn, default_data_model):
+    inputs = []
+    with open(batch_fn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.split("\t")
+            data_model = fields[2] if len(fields) > 2 else default_data_model
+            if data_model not in ("CPTAC", "TCGA"):
+                raise ValueError("Unknown data model {} in {}".format(data_model, batch_fn))
+            inputs.append((fields[0], fields[1], data_model))
+    return inputs
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse aliquot information from YAML response")
     parser.add_argument("-d", "--debug", action="store_true", help="Print debugging information to stderr")
@@ -162,7 +232,11 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", dest="outfn", help="Output file name.  default writes to stdout")
     parser.add_argument("-c", "--case", dest="case", help="Case name to prepend to table, for convenience")
     parser.add_argument("-m", "--data_model", dest="data_model", default="CPTAC", choices={"CPTAC", "TCGA"}, help="GDC data model associating case and aliquots")
+    parser.add_argument("-b", "--batch", dest="batch_fn", help="Parse many responses: file listing case, response file name and optional data model, tab-separated")
 
     args = parser.parse_args()
 
-    parse_YAML(args.infn, args.outfn, args.case, args.data_model)
+    if args.batch_fn:
+        parse_many(read_batch_file(args.batch_fn, args.data_model), args.outfn)
+    else:
+        parse_YAML(args.infn, args.outfn, args.case, args.data_model)
@@ -24,6 +24,16 @@ Options:
 -O OUTD: intermediate file output directory.  Default: ./dat
 -t GDC_TOKEN: path to gdc-user-token.*.txt file
 -D DISEASE
+-q: Query GDC with in-process python client src/gdc_client.py rather than src/queryGDC.sh
+-b: Batch read group, submitted reads, harmonized reads and methylation queries (src/gdc_batch.py)
+-p: Discover with in-process pipeline src/discover_case.py, which queries read groups, submitted and harmonized
+    reads of each aliquot as soon as their parents are found, and methylation and demographics concurrently.
+    Writes the same files
+-T: With -p, fetch read groups, submitted and harmonized reads and methylation arrays for the whole case in one
+    query each, rather than one query per parent (src/case_traversal.py)
+
+If GDC_METRICS is defined, time of each stage is recorded in that file, as are queries made by called scripts.
+See src/metrics.py
 
 SUFFIX_LIST is a TSV file listing a UUID or Aliquot ID in first column, second
 column is suffix to be added to sample_name.  This allows specific samples to
@@ -35,11 +45,12 @@ EOF
 # However, this approach misses datasets associated with deprecated / replaced datasets
 # so is no longer implemented
 
+PYTHON="/diskmnt/Projects/Users/mwyczalk/miniconda3/bin/python"
 # Where scripts live
 OUTD="./dat"
 DISEASE="unknown"   # this is not strictly needed, but used in demographics.  Catalog gets case disease info at catalog creation time
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
-while getopts ":hdf:O:vt:D:" opt; do
+while getopts ":hdf:O:vt:D:qbpT" opt; do
   case $opt in
     h)
       echo "$USAGE"
@@ -63,6 +74,19 @@ while getopts ":hdf:O:vt:D:" opt; do
     D)
       DISEASE="$OPTARG"
       ;;
+    q)
+      # QUERYGDC is used by all get_*.sh scripts
+      export QUERYGDC="$PYTHON src/gdc_client.py"
+      ;;
+    b)
+      BATCH=1
+      ;;
+    p)
+      PIPELINE=1
+      ;;
+    T)
+      PIPELINE_ARG="$PIPELINE_ARG -T"
+      ;;
     \?)
       >&2 echo "Invalid option: -$OPTARG"
       echo "$USAGE"
@@ -125,6 +149,46 @@ function test_exit_status {
     done
 }
 
+# Current time in microseconds
+function now_us {
+    if [ -n "$EPOCHREALTIME" ]; then
+        echo ${EPOCHREALTIME/./}
+    else
+        date +%s%6N
+    fi
+}
+
+# Run CMD as discovery stage STAGE.  If GDC_METRICS is defined, append stage record to it
+# GDC_METRICS_STAGE identifies the stage in query records written by called scripts
+function run_stage {
+    STAGE=$1
+    CMD=$2
+    export GDC_METRICS_STAGE=$STAGE
+    if [ -z "$GDC_METRICS" ] || [ "$DRYRUN" == "d" ]; then
+        run_cmd "$CMD"
+        return
+    fi
+
+    START_US=$(now_us)
+    >&2 echo [ $(date) ] Running: $CMD
+    eval $CMD
+    rcs=${PIPESTATUS[*]};
+    STATUS=0
+    for rc in ${rcs}; do
+        if [[ $rc != 0 ]]; then
+            STATUS=$rc
+        fi
+    done
+    ELAPSED_US=$(( $(now_us) - START_US ))
+    printf '{"type": "stage", "case": "%s", "stage": "%s", "start": %d.%06d, "seconds": %d.%06d, "status": %d}\n' \
+        "$CASE" "$STAGE" $(( START_US / 1000000 )) $(( START_US % 1000000 )) $(( ELAPSED_US / 1000000 )) $(( ELAPSED_US % 1000000 )) \
+        $STATUS >> $GDC_METRICS
+    if [[ $STATUS != 0 ]]; then
+        >&2 echo Fatal error.  Exiting
+        exit $STATUS
+    fi
+}
+
 function confirm {
     FN=$1
     if [ ! -s $FN ]; then
@@ -134,6 +198,7 @@ function confirm {
 }
 
 >&2 echo Processing $CASE 
+export GDC_METRICS_CASE=$CASE
 
 A_OUT="$OUTD/aliquots.dat"
 RG_OUT="$OUTD/read_groups.dat"
@@ -146,13 +211,22 @@ DEM_OUT="$OUTD/demographics.dat"
 mkdir -p $OUTD
 test_exit_status
 
+if [ $PIPELINE ]; then
+    if [ $VERBOSE ]; then
+        PIPELINE_ARG="$PIPELINE_ARG -v"
+    fi
+    CMD="$PYTHON src/discover_case.py -O $OUTD -D $DISEASE $PIPELINE_ARG $CASE"
+    run_stage pipeline "$CMD"
+    exit 0
+fi
+
 # Run both TCGA and CPTAC data models 
 A1_OUT="$OUTD/aliquots-CPTAC.dat"
 A2_OUT="$OUTD/aliquots-TCGA.dat"
 CMD="bash src/get_aliquots.sh -m CPTAC $ALIQUOT_ARGS -o $A1_OUT $VERBOSE_ARG $CASE "
-run_cmd "$CMD"
+run_stage aliquots "$CMD"
 CMD="bash src/get_aliquots.sh -m TCGA $ALIQUOT_ARGS -o $A2_OUT $VERBOSE_ARG $CASE "
-run_cmd "$CMD"
+run_stage aliquots "$CMD"
 
 # Merge the CPTAC and TCGA discovery aliquots, respecting the header line
 head -n1 $A1_OUT > $A_OUT
@@ -164,19 +238,37 @@ if [ $(wc -l $A_OUT | cut -f 1 -d ' ' ) == "1" ]; then
     CMD="touch $OUTD/is_empty.flag"
     run_cmd "$CMD"
 else
-    CMD="bash src/get_read_groups.sh -o $RG_OUT $VERBOSE_ARG $A_OUT"
-    run_cmd "$CMD"
+    if [ -z $BATCH ]; then
+        CMD="bash src/get_read_groups.sh -o $RG_OUT $VERBOSE_ARG $A_OUT"
+        run_stage read_groups "$CMD"
 
-    CMD="bash src/get_submitted_reads.sh -o $SR_OUT $VERBOSE_ARG $RG_OUT"
-    run_cmd "$CMD"
+        CMD="bash src/get_submitted_reads.sh -o $SR_OUT $VERBOSE_ARG $RG_OUT"
+        run_stage submitted_reads "$CMD"
 
-    CMD="bash src/get_harmonized_reads.sh -o $HR_OUT $VERBOSE_ARG $SR_OUT"
-    run_cmd "$CMD"
+        CMD="bash src/get_harmonized_reads.sh -o $HR_OUT $VERBOSE_ARG $SR_OUT"
+        run_stage harmonized_reads "$CMD"
 
-    CMD="bash src/get_methylation_array.sh -o $MA_OUT $VERBOSE_ARG $A_OUT"
-    run_cmd "$CMD"
+        CMD="bash src/get_methylation_array.sh -o $MA_OUT $VERBOSE_ARG $A_OUT"
+        run_stage methylation_array "$CMD"
+    else
+        # Same output files, with many lookups per GraphQL query
+        if [ $VERBOSE ]; then
+            BATCH_ARG="-v"
+        fi
+        CMD="$PYTHON src/gdc_batch.py read_groups -o $RG_OUT $BATCH_ARG $A_OUT"
+        run_stage read_groups "$CMD"
+
+        CMD="$PYTHON src/gdc_batch.py submitted_reads -o $SR_OUT $BATCH_ARG $RG_OUT"
+        run_stage submitted_reads "$CMD"
+
+        CMD="$PYTHON src/gdc_batch.py harmonized_reads -o $HR_OUT $BATCH_ARG $SR_OUT"
+        run_stage harmonized_reads "$CMD"
+
+        CMD="$PYTHON src/gdc_batch.py methylation_array -o $MA_OUT $BATCH_ARG $A_OUT"
+        run_stage methylation_array "$CMD"
+    fi
 fi
 
 CMD="bash src/get_demographics.sh -o $DEM_OUT $VERBOSE_ARG $CASE $DISEASE"
-run_cmd "$CMD"
+run_stage demographics "$CMD"
 
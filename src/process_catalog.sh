@@ -17,14 +17,27 @@ Options:
 -L LOGBASE: base directory of runtime output.  Default ./logs
 -c: create v2 catalog 
 -s SUFFIX_LIST: data file for appending suffix to sample names (catalog 2 only)
+-b: Batch mode.  Create catalog3 files for all cases in one call to make_catalog3.py (catalog 3 only)
+-m MB: Memory budget of batch mode.  Cases are processed in groups so that make_catalog3.py uses about MB megabytes
+-p PARQUET_DIR: Also write catalog3 to Parquet dataset in PARQUET_DIR (catalog 3 only).  Requires pyarrow
+-A ANNOTATION_TABLE: Table of annotation codes of known aliquot annotations, e.g., config/annotation_table.txt (catalog 3 only)
+-I: Create or update index of project catalog3 for lookups with src/catalog_index.py (catalog 3 only)
+-M: Record make_catalog3.py phase times in LOGBASE/metrics.jsonl.  Summarize with src/metrics_report.py
+-S: Collect catalog3 with src/collect_catalog.py: rows sorted and deduplicated by UUID, output replaced atomically,
+    and only cases changed since the last collection read (catalog 3 only)
+-i: Incremental.  Make catalog3 files only for cases whose inputs, catalog code or configuration changed since
+    their catalog3 files were made, as recorded in LOGBASE/outputs/CASE/*.catalog3.dat.fingerprint (catalog 3 only)
 
 CASES is a TSV file with case name and disease in first and second columns
 
 PROJECT (e.g., CPTAC3) is passed directly to catalog3 column and used for catalog filename
 EOF
 
+PYTHON="/diskmnt/Projects/Users/mwyczalk/miniconda3/bin/python"
 NJOBS=0
 XARGS2="" # extra arguments for catalog2
+XARGS3="" # extra arguments for catalog3
+BATCH_ARGS="" # extra arguments for catalog3 batch mode
 LOGBASE="./logs"
 
 DESTD="./results"
@@ -34,7 +47,7 @@ DESTD="./results"
 
 # Using rungo as a template for parallel: https://github.com/ding-lab/TinDaisy/blob/master/src/rungo
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
-while getopts ":hdv1L:cs:" opt; do
+while getopts ":hdv1L:cs:bm:p:A:IMSi" opt; do
   case $opt in
     h)
       echo "$USAGE"
@@ -58,6 +71,31 @@ while getopts ":hdv1L:cs:" opt; do
     s)  
       XARGS2="$XARGS2 -s $OPTARG"
       ;;
+    b)  
+      BATCH=1
+      ;;
+    m)  
+      BATCH_ARGS="$BATCH_ARGS -m $OPTARG"
+      ;;
+    p)  
+      XARGS3="$XARGS3 -p $OPTARG"
+      ;;
+    A)  
+      XARGS3="$XARGS3 -A $OPTARG"
+      ;;
+    I)  
+      DO_INDEX=1
+      ;;
+    M)  
+      USE_METRICS=1
+      ;;
+    S)  
+      DO_COLLECT=1
+      ;;
+    i)  
+      XARGS3="$XARGS3 -i"
+      INCREMENTAL=1
+      ;;
     \?)
       >&2 echo "Invalid option: -$OPTARG"
       echo "$USAGE"
@@ -147,6 +185,11 @@ fi
 >&2 echo Intermediate results stored in $LOGBASE
 >&2 echo Final results written to $DESTD
 
+# make_catalog3.py appends phase times to GDC_METRICS.  See src/metrics.py
+if [ $USE_METRICS ]; then
+    export GDC_METRICS="$LOGBASE/metrics.jsonl"
+fi
+
 # If verbose flag repeated multiple times (e.g., VERBOSE="vvv"), pass the value of VERBOSE with one flag popped off (i.e., VERBOSE_ARG="vv")
 if [ $VERBOSE ]; then
     VERBOSE_ARG=${VERBOSE%?}
@@ -173,11 +216,12 @@ function process_case {
         # make_catalog3.sh is the standard one
         if [ -z $DO_CATALOG2 ]; then
             >&2 echo Running Catalog3
-            CMD="bash src/make_catalog3.sh -o $OUTD -D $DISEASE -P $PROJECT $OUTD"
+            CMD="bash src/make_catalog3.sh $XARGS3 -o $OUTD -D $DISEASE -P $PROJECT $OUTD"
         else
             >&2 echo Running Catalog2
             CATALOG_OUT="-o $OUTD/${PROJECT}.Catalog.dat"  
-            CMD="bash src/make_catalog2.sh -Q $A_OUT -R $SR_OUT -H $HR_OUT -M $MA_OUT $XARGS2 $CATALOG_OUT -v $CASE $DISEASE"
+            # make_catalog2.py writes the same Catalog2 file as make_catalog2.sh, which may be used instead
+            CMD="$PYTHON src/make_catalog2.py -Q $A_OUT -R $SR_OUT -H $HR_OUT -M $MA_OUT $XARGS2 $CATALOG_OUT $CASE $DISEASE"
         fi
         run_cmd "$CMD"
     fi
@@ -206,7 +250,7 @@ function process_cases {
             break
         fi
 
-    done < $CASES
+    done < $PROCESS_CASES
 
     if [ $NJOBS != 0 ]; then
         # this will wait until all jobs completed
@@ -315,12 +359,59 @@ function collect_catalog2 {
     >&2 echo Collected Catalog2 details into $CATALOG2
 }
 
+# Sorted, deduplicated and incremental alternative to collect_catalog3
+function collect_catalog3_sorted {
+    CATALOG3="$DESTD/${PROJECT}.Catalog3.tsv"
+    CMD="$PYTHON src/collect_catalog.py -k catalog3 -L $LOGBASE -o $CATALOG3 $CASES"
+    run_cmd "$CMD" $DRYRUN
+}
+
+# Index is updated incrementally, with only rows which changed since the last run written
+function index_catalog3 {
+    CATALOG3="$DESTD/${PROJECT}.Catalog3.tsv"
+    INDEX="$DESTD/${PROJECT}.Catalog3.sqlite"
+    CMD="$PYTHON src/catalog_index.py -u $CATALOG3 $INDEX"
+    run_cmd "$CMD" $DRYRUN
+}
+
+# Batch mode writes per-case catalog3 files and the merged catalog in one step
+if [ $BATCH ] && [ ! $DO_CATALOG2 ]; then
+    CATALOG3="$DESTD/${PROJECT}.Catalog3.tsv"
+    if [ $DO_COLLECT ]; then
+        CMD="$PYTHON src/make_catalog3.py $XARGS3 $BATCH_ARGS -C $CASES -L $LOGBASE -P $PROJECT"
+        run_cmd "$CMD" $DRYRUN
+        collect_catalog3_sorted
+    else
+        CMD="$PYTHON src/make_catalog3.py $XARGS3 $BATCH_ARGS -C $CASES -L $LOGBASE -P $PROJECT -o $CATALOG3"
+        run_cmd "$CMD" $DRYRUN
+    fi
+    if [ $DO_INDEX ]; then
+        index_catalog3
+    fi
+    exit 0
+fi
+
+# Incremental mode lists changed cases in one call to make_catalog3.py, so that unchanged cases are not visited
+PROCESS_CASES=$CASES
+if [ $INCREMENTAL ] && [ ! $DO_CATALOG2 ] && [ "$DRYRUN" != "d" ]; then
+    PROCESS_CASES="$LOGBASE/catalog3.changed_cases.dat"
+    CMD="$PYTHON src/make_catalog3.py $XARGS3 -C $CASES -L $LOGBASE -P $PROJECT -l $PROCESS_CASES"
+    run_cmd "$CMD" $DRYRUN
+fi
+
 # main loop
 process_cases
 
 if [ ! $JUSTONE ] ; then
     if [ ! $DO_CATALOG2 ]; then
-        collect_catalog3
+        if [ $DO_COLLECT ]; then
+            collect_catalog3_sorted
+        else
+            collect_catalog3
+        fi
+        if [ $DO_INDEX ]; then
+            index_catalog3
+        fi
     else
         collect_catalog2
     fi
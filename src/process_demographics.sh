@@ -15,6 +15,8 @@ Options:
 -v: Verbose.  May be repeated to get verbose output from called scripts
 -L LOGBASE: base directory of runtime output.  Default ./logs
 -1: stop after processing one case
+-S: Collect with src/collect_catalog.py: rows sorted and deduplicated, output replaced atomically, and only cases
+    changed since the last collection read
 
 CASES is a TSV file with case name and disease in first and second columns
 We are adding the disease as a field here, as it is no longer written during discovery
@@ -24,6 +26,7 @@ PROJECT (e.g., CPTAC3) is passed directly to catalog3 column
 Will write results/PROJECT.Demographics.tsv
 EOF
 
+PYTHON="/diskmnt/Projects/Users/mwyczalk/miniconda3/bin/python"
 BIND="src"
 XARGS=""
 LOGBASE="./logs"
@@ -31,7 +34,7 @@ DESTD="./results"
 
 # Using rungo as a template for parallel: https://github.com/ding-lab/TinDaisy/blob/master/src/rungo
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
-while getopts ":hdvD:L:1" opt; do
+while getopts ":hdvD:L:1S" opt; do
   case $opt in
     h)
       echo "$USAGE"
@@ -52,6 +55,9 @@ while getopts ":hdvD:L:1" opt; do
     1)
       JUSTONE=1
       ;;
+    S)
+      DO_COLLECT=1
+      ;;
     \?)
       >&2 echo "Invalid option: -$OPTARG"
       echo "$USAGE"
@@ -161,5 +167,11 @@ function collect_demographics {
     done < $CASES
 }
 
-collect_demographics
+if [ $DO_COLLECT ]; then
+    mkdir -p $DESTD
+    CMD="$PYTHON src/collect_catalog.py -k demographics -L $LOGBASE -o $DESTD/${PROJECT}.Demographics.tsv $CASES"
+    run_cmd "$CMD" $DRYRUN
+else
+    collect_demographics
+fi
 
@@ -13,6 +13,12 @@
 # query.dat contains "bare queryGL" script (see https://docs.gdc.cancer.gov/API/Users_Guide/Submission/#querying-submitted-data-using-graphql )
 #       queryGDC - 
 #   will read query from STDIN
+#
+# If GDC_METRICS is defined, each query made with -r is recorded in that file.  See src/metrics.py
+# If GDC_RATE_LIMIT is defined, queries made with -r share a request rate limit.  See src/rate_limit.py
+#   These queries are made by src/gdc_client.py, which takes from the rate limit and reports to it in one process
+# If GDC_RECORD is defined, successful responses to queries made with -r are recorded in that archive.  See src/gdc_record.py
+# If GDC_URL is defined, queries are posted to that URL rather than the GDC API, e.g., to a local src/mock_gdc_server.py
 
 # Matthew A. Wyczalkowski
 # m.wyczalkowski@wustl.edu
@@ -60,7 +66,7 @@ function run_query {
         ARGS="-s $ARGS"
     fi
 
-    URL="https://api.gdc.cancer.gov/v0/submission/graphql"
+    URL=${GDC_URL:-"https://api.gdc.cancer.gov/v0/submission/graphql"}
 
     if [ $DRYRUN ]; then
         >&2 echo curl $ARGS -XPOST -H \"X-Auth-Token: $t\" $URL --data \"$QUERY_JSON\" 
@@ -72,6 +78,83 @@ function run_query {
     fi
 }
 
+# Current time in microseconds
+function now_us {
+    if [ -n "$EPOCHREALTIME" ]; then
+        echo ${EPOCHREALTIME/./}
+    else
+        date +%s%6N
+    fi
+}
+
+# Error class of response R with errors ERR, as in error_class() of src/metrics.py
+function error_class {
+    R=$1
+    ERR=$2
+    if [ -z "$ERR" ]; then
+        echo null
+    elif [[ $R = *"You are posting too quickly"* ]]; then
+        echo '"throttle"'
+    elif [[ $ERR = "ERROR parsing result"* ]]; then
+        echo '"parse"'
+    elif [ "$ERR" == "Unauthorized query." ]; then
+        echo '"unauthorized"'
+    elif [[ $ERR = *"second timeout"* ]]; then
+        echo '"timeout"'
+    else
+        echo '"other"'
+    fi
+}
+
+# Append query record to $GDC_METRICS, if defined
+# usage: record_query START_US END_US R ERR
+function record_query {
+    if [ -z "$GDC_METRICS" ]; then
+        return
+    fi
+    START_US=$1
+    END_US=$2
+    ELAPSED_US=$(( END_US - START_US ))
+    CLASS=$(error_class "$3" "$4")
+    CTX=""
+    if [ -n "$GDC_METRICS_CASE" ]; then
+        CTX="$CTX\"case\": \"$GDC_METRICS_CASE\", "
+    fi
+    if [ -n "$GDC_METRICS_STAGE" ]; then
+        CTX="$CTX\"stage\": \"$GDC_METRICS_STAGE\", "
+    fi
+    printf '{"type": "query", %s"source": "queryGDC.sh", "start": %d.%06d, "seconds": %d.%06d, "bytes": %d, "error": %s, "cached": false, "batch": 1}\n' \
+        "$CTX" $(( START_US / 1000000 )) $(( START_US % 1000000 )) $(( ELAPSED_US / 1000000 )) $(( ELAPSED_US % 1000000 )) \
+        $(LC_ALL=C; echo ${#3}) "$CLASS" >> $GDC_METRICS
+}
+
+# Append response R to query QUERY_JSON to archive $GDC_RECORD, if defined
+# usage: record_response QUERY_JSON START_US END_US R
+function record_response {
+    if [ -z "$GDC_RECORD" ]; then
+        return
+    fi
+    ELAPSED_US=$(( $3 - $2 ))
+    printf '%s\n' "$4" | $PYTHON src/gdc_record.py -a "$1" -s $(( ELAPSED_US / 1000000 )).$(printf '%06d' $(( ELAPSED_US % 1000000 ))) $GDC_RECORD
+}
+
+# Delay in seconds before retry ATTEMPT (0 for first retry), growing exponentially from BASE_MS milliseconds
+# up to 60 seconds.  Half of the delay is random, so that clients which failed together do not retry together.
+# Same as backoff_delay in src/rate_limit.py
+function backoff {
+    local ATTEMPT=$1
+    local BASE_MS=$2
+    local D_MS=60000
+    if [ $ATTEMPT -lt 16 ]; then
+        D_MS=$(( BASE_MS << ATTEMPT ))
+        if [ $D_MS -gt 60000 ]; then
+            D_MS=60000
+        fi
+    fi
+    local DELAY_MS=$(( D_MS / 2 + ( RANDOM * 32768 + RANDOM ) % ( D_MS / 2 + 1 ) ))
+    printf "%d.%03d" $(( DELAY_MS / 1000 )) $(( DELAY_MS % 1000 ))
+}
+
 # Perform query, repeating in case of timeout error until it succeeds.
 # Goal is to handle this response:
 # R = { "data": {}, "errors": [ "Query exceeded 20.0 second timeout. Please reduce query complexity and try again. Ways to limit query complexity include adding \"first: 1\" arguments to limit results, limiting path query filter usage (e.g. with_path_to), or limiting extensive path traversal field inclusion (e.g. _related_cases)." ] }
@@ -79,51 +162,58 @@ function run_query {
 # We will test for for errors, such as "Unauthorized query.", and quit if encountered.
 #
 # Another error results in R="<html><head><title>Hold up there!</title></head><body><center><h1>Hold up there!</h1><p>You are posting too quickly. Wait for few moments and try again.</p></body></html>"
-# This will result in us waiting 5 seconds before trying again
+# This will result in us waiting at least 5 seconds before trying again
+#
+# Delays before retries grow exponentially with the number of failed attempts, with random jitter
 function run_query_retry {
     QUERY_JSON=$1
     t=$2
+    ATTEMPT=0
 
-    # GDC sometimes returns transient errors.  These are tricky to reproduce.
-    R=$(run_query "$QUERY_JSON" "$t")  
+    while true; do
+        # GDC sometimes returns transient errors.  These are tricky to reproduce.
+        START_US=$(now_us)
+        R=$(run_query "$QUERY_JSON" "$t")  
+        END_US=$(now_us)
 
-    # We validate JSON as recommended here: https://github.com/stedolan/jq/issues/1637
-    if jq -e . >/dev/null 2>&1 <<<"$R"; then
-        ERR=$(echo $R | jq -r '.errors[]? ')
-        test_exit_status
-    else
-        ERR="ERROR parsing result : $R"
-    fi
+        # We validate JSON as recommended here: https://github.com/stedolan/jq/issues/1637
+        if jq -e . >/dev/null 2>&1 <<<"$R"; then
+            ERR=$(echo $R | jq -r '.errors[]? ')
+            test_exit_status
+        else
+            ERR="ERROR parsing result : $R"
+        fi
 
-#    # This is a transiet error and code below not fully tested.
-#    if [[ $R = *"You are posting too quickly."* ]]; then
-#        ERR="You are posting too quickly."
-#    else
-#        # Here assume valid JSON.  TODO: test whether JSON is in fact valid
-#        ERR=$(echo $R | jq -r '.errors[]? ')
-#        test_exit_status
-#    fi
+        record_query $START_US $END_US "$R" "$ERR"
 
-    if [ -z "$ERR" ]; then
-        if [ $VERBOSE ]; then
-            >&2 echo RESULT: $R
+        if [ -z "$ERR" ]; then
+            record_response "$QUERY_JSON" $START_US $END_US "$R"
+            if [ $VERBOSE ]; then
+                >&2 echo RESULT: $R
+            fi
+            echo "$R"
+            return
         fi
-        echo "$R"
-    else
+
         if [ "$ERR" == "Unauthorized query." ]; then
             >&2 echo Fatal error: $ERR
             exit 1
         fi
-        if [ "$ERR" == "You are posting too quickly." ]; then
-            >&2 echo Posting too quickly error.  Pausing.
-            wait 5
+        # The throttle response is HTML, so ERR is a parsing error
+        if [[ $R = *"You are posting too quickly"* ]]; then
+            DELAY=$(backoff $ATTEMPT 5000)
+            DELAY=$(awk "BEGIN {print 5 + $DELAY}")
+            >&2 echo Posting too quickly error.  Pausing $DELAY s.
+        else
+            DELAY=$(backoff $ATTEMPT 1000)
         fi
         if [ $VERBOSE ]; then
             >&2 echo ERRORS: $ERR
-            >&2 echo Query failed.  Retrying.
+            >&2 echo Query failed.  Retrying in $DELAY s.
         fi
-        run_query_retry "$QUERY_JSON" "$t"
-    fi
+        sleep $DELAY
+        ATTEMPT=$(( ATTEMPT + 1 ))
+    done
 }
 
 function get_json {
@@ -202,6 +292,17 @@ fi
 T=$(cat $GDC_TOKEN)
 
 GQL=$1
+
+# With a shared rate limit, each query would otherwise start python twice, to wait for the rate limit and to report
+# the outcome.  Instead the query and its retries are made by gdc_client.py, which does both in one process.  As
+# here, the query cache is not used
+if [ $REPEAT ] && [ -n "$GDC_RATE_LIMIT" ] && [ -z "$DRYRUN" ]; then
+    if [ $VERBOSE ]; then
+        GDC_CLIENT_ARGS="-v"
+    fi
+    GDC_CACHE="" exec $PYTHON src/gdc_client.py -r $GDC_CLIENT_ARGS -t $GDC_TOKEN $GQL
+fi
+
 JSON=$(get_json $GQL)  
 
 if [ $REPEAT ]; then
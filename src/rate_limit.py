@@ -0,0 +1,126 @@
+import json, time, fcntl, random
+import argparse, sys, os
+
+# Request rate limiting shared by all processes querying GDC
+#
+# A token bucket is kept in a small state file, locked with fcntl, so that all queries of a discovery run --
+# from queryGDC.sh, gdc_client.py and gdc_batch.py, in any number of concurrent case processes -- draw from
+# one budget of RATE requests per second, with bursts of up to BURST requests.
+#
+# Query outcomes are reported back to the same file: counts of successful, throttled ("You are posting too
+# quickly") and timed out queries.  A throttle response also pauses all requests for PAUSE seconds.  The counts
+# are read by case_scheduler.py to adjust the number of cases processed at once.
+#
+# Environment variables:
+#   GDC_RATE_LIMIT - path to state file.  Rate limiting is disabled if not defined
+#   GDC_RATE - requests per second.  Default 5
+#   GDC_BURST - bucket size.  Default 10
+#
+# Command line use, e.g. from bash:
+#   python src/rate_limit.py acquire $GDC_RATE_LIMIT
+#   python src/rate_limit.py report $GDC_RATE_LIMIT throttle
+#   python src/rate_limit.py backoff 3 5   # prints jittered delay for attempt 3 with base 5 seconds
+
+RATE = 5.0
+BURST = 10.0
+PAUSE = 5.0
+OUTCOMES = ["ok", "throttle", "timeout"]
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# Delay before retry ATTEMPT (0 for first retry): exponential in attempt, capped at CAP seconds,
+# with "equal jitter" -- half of the delay is fixed and half random -- so that clients which failed
+# together do not retry together
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    d = min(cap, base * 2 ** attempt)
+    return d / 2 + random.uniform(0, d / 2)
+
+class TokenBucket:
+    def __init__(self, path, rate=RATE, burst=BURST, pause=PAUSE):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.pause = pause
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get("GDC_RATE_LIMIT")
+        if not path:
+            return None
+        return cls(path, float(os.environ.get("GDC_RATE", RATE)), float(os.environ.get("GDC_BURST", BURST)))
+
+    # Call func(state, now) with state file locked, and write back the modified state.  Returns result of func
+    def update(self, func):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            text = f.read()
+            now = time.time()
+            state = json.loads(text) if text.strip() else {}
+            if "tokens" not in state:
+                state.update({"tokens": self.burst, "time": now, "pause_until": 0})
+            for k in OUTCOMES:
+                state.setdefault(k, 0)
+            # refill
+            state["tokens"] = min(self.burst, state["tokens"] + (now - state["time"]) * self.rate)
+            state["time"] = now
+            result = func(state, now)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            return result
+
+    # Wait until a request may be made
+    def acquire(self):
+        def take(state, now):
+            if now < state["pause_until"]:
+                return state["pause_until"] - now
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0
+            return (1 - state["tokens"]) / self.rate
+        while True:
+            wait = self.update(take)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    # Record query outcome: ok, throttle or timeout.  Throttling pauses all requests
+    def report(self, outcome):
+        def add(state, now):
+            state[outcome] += 1
+            if outcome == "throttle":
+                state["pause_until"] = max(state["pause_until"], now + self.pause)
+                state["tokens"] = 0
+        self.update(add)
+
+    # Returns dictionary with counts of query outcomes
+    def counts(self):
+        return self.update(lambda state, now: {k: state[k] for k in OUTCOMES})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared request rate limiting for GDC queries")
+    parser.add_argument("command", choices=["acquire", "report", "counts", "backoff"], help="Action to take")
+    parser.add_argument("args", nargs="*", help="acquire STATE; report STATE OUTCOME; counts STATE; backoff ATTEMPT [BASE [CAP]]")
+
+    args = parser.parse_args()
+
+    if args.command == "backoff":
+        print("{:.2f}".format(backoff_delay(*[float(a) for a in args.args])))
+        sys.exit(0)
+    if not args.args:
+        parser.error("State file is required")
+
+    bucket = TokenBucket(args.args[0], float(os.environ.get("GDC_RATE", RATE)), float(os.environ.get("GDC_BURST", BURST)))
+    if args.command == "acquire":
+        bucket.acquire()
+    elif args.command == "report":
+        if len(args.args) != 2 or args.args[1] not in OUTCOMES:
+            parser.error("Usage: report STATE {}".format("|".join(OUTCOMES)))
+        bucket.report(args.args[1])
+    elif args.command == "counts":
+        print(json.dumps(bucket.counts()))
@@ -13,14 +13,29 @@ Options:
 -h: Print this help message
 -d: Dry run.  Print commands but do not execute queries
 -v: Verbose.  May be repeated to get verbose output from called scripts
--J N: Evaluate N cases in parallel.  If 0, disable parallel mode. Default 0
+-J N: Evaluate up to N cases in parallel with src/case_scheduler.py.  If 0, disable parallel mode. Default 0
+-R RATE: In parallel mode, limit GDC queries of all cases to RATE per second.  Default 5
+-r: In parallel mode, process all cases rather than resuming from LOGBASE/discovery.checkpoint.  With -P, fetch all pages again
+-P PROJECT: Discover all cases with project-wide bulk queries of GDC project PROJECT (e.g., CPTAC-3) using
+    src/discover_project.py, rather than case by case.  Fetched pages are kept in LOGBASE/pages/PROJECT until the
+    per-case files are written, and an interrupted run resumes with the next page
 -1: stop after processing one case
 -L LOGBASE: base directory of runtime output.  Default ./logs
 -t GDC_TOKEN: GDC token file
+-q: Query GDC with in-process python client src/gdc_client.py rather than src/queryGDC.sh
+-b: Batch read group, submitted reads, harmonized reads and methylation queries
+-p: Discover each case with in-process pipeline src/discover_case.py
+-T: With -p, query each entity type once per case rather than once per parent
+-C: Cache query results in LOGBASE/gdc_cache.sqlite.  Requires -q, -b or -p
+-F: Force refresh of cached query results
+-M: Record stage and query metrics in LOGBASE/metrics.jsonl.  Summarize with src/metrics_report.py
 
 CASES is a TSV file with case name and disease in first and second columns
 
-This calls process_case.sh once for each case, possibly using GNU parallel to process multiple cases at once
+This calls process_case.sh once for each case.  In parallel mode, the number of cases processed at once adapts to
+GDC throttling and timeout responses, queries of all cases share one rate limit, and completed cases are recorded
+in LOGBASE/discovery.checkpoint so that an interrupted run resumes with unfinished cases.  The checkpoint is set
+aside once all cases succeed, so that the next run processes all cases
 Require GDC_TOKEN environment variable to be defined with path to gdc-user-token.*.txt file
 
 EOF
@@ -38,12 +53,15 @@ if [ ! -x $BID ]; then
     >&2 echo ERROR: $BID does not exist or is not executable
 fi
 
+PYTHON="/diskmnt/Projects/Users/mwyczalk/miniconda3/bin/python"
 NJOBS=0
 XARGS=""
+SCHED_ARGS=""   # extra arguments for case_scheduler.py
+PROJECT_ARGS="" # extra arguments for discover_project.py
 
 # Using rungo as a template for parallel: https://github.com/ding-lab/TinDaisy/blob/master/src/rungo
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
-while getopts ":hdvJ:1L:t:" opt; do
+while getopts ":hdvJ:1L:t:qbpTCFMR:rP:" opt; do
   case $opt in
     h)
       echo "$USAGE"
@@ -67,6 +85,37 @@ while getopts ":hdvJ:1L:t:" opt; do
     t)
       GDC_TOKEN="$OPTARG"
       ;;
+    q)
+      XARGS="$XARGS -q"
+      ;;
+    b)
+      XARGS="$XARGS -b"
+      ;;
+    p)
+      XARGS="$XARGS -p"
+      ;;
+    T)
+      XARGS="$XARGS -T"
+      ;;
+    C)
+      USE_CACHE=1
+      ;;
+    F)
+      export GDC_CACHE_REFRESH=1
+      ;;
+    M)
+      USE_METRICS=1
+      ;;
+    R)
+      export GDC_RATE=$OPTARG
+      ;;
+    r)
+      SCHED_ARGS="$SCHED_ARGS -r"
+      PROJECT_ARGS="$PROJECT_ARGS -r"
+      ;;
+    P)
+      PROJECT="$OPTARG"
+      ;;
     \?)
       >&2 echo "Invalid option: -$OPTARG"
       echo "$USAGE"
@@ -139,17 +188,41 @@ if [ $VERBOSE ]; then
     VERBOSE_ARG="-$VERBOSE_ARG"
 fi
 
-# Used for `parallel` job groups 
-NOW=$(date)
-MYID=$(date +%Y%m%d%H%M%S)
-
-if [ $NJOBS == 0 ] ; then
+if [ $PROJECT ]; then
+    >&2 echo Discovering all cases of project $PROJECT \(project mode\)
+elif [ $NJOBS == 0 ] ; then
     >&2 echo Running single case at a time \(single mode\)
 else
     >&2 echo Job submission with $NJOBS cases in parallel
 fi
 
 
+# Parallel mode: case_scheduler.py runs process_case.sh for each case
+function schedule_cases {
+    export GDC_RATE_LIMIT="$LOGBASE/rate_limit.state"
+    if [ $JUSTONE ]; then
+        SCHED_ARGS="$SCHED_ARGS -1"
+    fi
+    if [ "$DRYRUN" == "d" ]; then
+        SCHED_ARGS="$SCHED_ARGS -d"
+    fi
+    CMD="$PYTHON src/case_scheduler.py -J $NJOBS -L $LOGBASE $SCHED_ARGS $CASES -- bash src/process_case.sh $XARGS -t $GDC_TOKEN $DEM $VERBOSE_ARG"
+    >&2 echo Running: $CMD
+    eval $CMD
+}
+
+# Project mode: discover_project.py queries all cases at once and writes LOGBASE/outputs/CASE for each case
+function discover_project {
+    if [ $JUSTONE ]; then
+        PROJECT_ARGS="$PROJECT_ARGS -1"
+    fi
+    if [ $VERBOSE ]; then
+        PROJECT_ARGS="$PROJECT_ARGS -v"
+    fi
+    CMD="$PYTHON src/discover_project.py -P $PROJECT -L $LOGBASE -t $GDC_TOKEN $PROJECT_ARGS $CASES"
+    run_cmd "$CMD" $DRYRUN
+}
+
 function process_cases {
     # Case file has two tab separated columns, case name and disease
     while read L; do
@@ -166,12 +239,6 @@ function process_cases {
 
         CMD="bash src/process_case.sh $XARGS -t $GDC_TOKEN -O $LOGD -D $DIS $DEM $VERBOSE_ARG $CASE > $STDOUT_FN 2> $STDERR_FN"
 
-        if [ $NJOBS != 0 ]; then
-            JOBLOG="$LOGD/$CASE.log"
-            CMD=$(echo "$CMD" | sed 's/"/\\"/g' )   # This will escape the quotes in $CMD 
-            CMD="parallel --semaphore -j$NJOBS --id $MYID --joblog $JOBLOG --tmpdir $LOGD \"$CMD\" "
-        fi
-
         run_cmd "$CMD" $DRYRUN
         >&2 echo Written to $STDOUT_FN
 
@@ -180,23 +247,35 @@ function process_cases {
         fi
 
     done < $CASES
-
-    if [ $NJOBS != 0 ]; then
-        # this will wait until all jobs completed
-        CMD="parallel --semaphore --wait --id $MYID"
-        run_cmd "$CMD" $DRYRUN
-    fi
 }
 
 mkdir -p $DESTD
 mkdir -p $LOGBASE
 
+# Query cache is used by src/gdc_client.py and src/gdc_batch.py.  See src/gdc_cache.py for details
+if [ $USE_CACHE ]; then
+    export GDC_CACHE="$LOGBASE/gdc_cache.sqlite"
+    >&2 echo Caching query results in $GDC_CACHE
+fi
+
+# Metrics are appended to by process_case.sh and the scripts it calls.  See src/metrics.py
+if [ $USE_METRICS ]; then
+    export GDC_METRICS="$LOGBASE/metrics.jsonl"
+    >&2 echo Recording metrics in $GDC_METRICS
+fi
+
 START=$(date)
 >&2 echo [ $START ] Starting discovery
 
 
 # real work takes place here
-process_cases
+if [ $PROJECT ]; then
+    discover_project
+elif [ $NJOBS == 0 ]; then
+    process_cases
+else
+    schedule_cases
+fi
 rc=$?
 if [[ $rc != 0 ]]; then
     >&2 echo ERROR $rc: $!
@@ -207,3 +286,6 @@ END=$(date)
 >&2 echo [ $END ] Discovery complete
 >&2 echo Timing summary: 
 >&2 echo Discovery start: [ $START ]  End: [ $END ]
+if [ $USE_METRICS ]; then
+    >&2 echo Metrics summary: python src/metrics_report.py $GDC_METRICS
+fi
@@ -0,0 +1,209 @@
+import json, random
+import argparse, os
+from gdc_batch import format_row, READ_GROUP_FIELDS, READS_FIELDS, METHYLATION_FIELDS, SAR_STRATEGIES
+
+# Generate synthetic GDC-shaped data for benchmarks and offline testing
+#
+# A synthetic case is a nested dictionary with the same structure as the GDC graph traversed during discovery:
+#   case / samples / aliquots / read groups / submitted reads / harmonized reads
+#                             / methylation arrays
+# From it we generate
+# * GraphQL responses to the sample query of get_aliquots.sh, for both CPTAC and TCGA data models
+# * the intermediate files written by discovery: aliquots.dat, read_groups.dat, submitted_reads.dat,
+#   harmonized_reads.dat, methylation_array.dat, demographics.dat
+#
+# Sizes are given as the number of submitted files per case and number of cases, so that data sets from
+# one case up to ~100k files per project can be generated.  Output is deterministic for a given seed.
+
+SAMPLE_TYPES = ["Primary Tumor", "Primary Tumor", "Blood Derived Normal", "Solid Tissue Normal", "Tumor", "Buccal Cell Normal"]
+ANNOTATIONS = [
+    "Duplicate item: CCRCC Tumor heterogeneity study aliquot",
+    "Duplicate item: Additional DNA requested",
+    "Additional DNA Distribution - Additional aliquot",
+    "Duplicate item: Replacement RNA Distribution - original aliquot failed",
+    "Original DNA Aliquot",
+]
+DNA_STRATEGIES = ["WGS", "WXS", "WXS", "Targeted Sequencing"]
+RNA_STRATEGIES = ["RNA-Seq", "RNA-Seq", "miRNA-Seq"]
+
+def uuid(rnd):
+    h = "%032x" % rnd.getrandbits(128)
+    return "-".join([h[0:8], h[8:12], h[12:16], h[16:20], h[20:32]])
+
+def md5(rnd):
+    return "%032x" % rnd.getrandbits(128)
+
+# Illumina-style FASTQ names, e.g. 170830_UNC31-K00269_0078_AHLCVMBBXX_AGTCAA_S18_L006_R1_001.fastq.gz
+# A fraction have index reads, or use the short form DLBCL11282_4198_RNAseq_R1.fastq.gz
+def fastq_names(rnd, prefix):
+    style = rnd.random()
+    if style < 0.1:
+        return ["%s_%d_RNAseq_R%d.fastq.gz" % (prefix, rnd.randrange(10000), r) for r in (1, 2)]
+    flowcell = "".join(rnd.choice("ABCDEFGHKLMNX0123456789") for i in range(9))
+    barcode = "".join(rnd.choice("ACGT") for i in range(6))
+    base = "%06d_UNC31-K00269_%04d_A%s_%s_S%d_L%03d" % (rnd.randrange(170000, 230000), rnd.randrange(10000), flowcell, barcode, rnd.randrange(1, 48), rnd.randrange(1, 9))
+    reads = ["R1", "R2"]
+    if style > 0.9:
+        reads += ["I1"]
+    return ["%s_%s_001.fastq.gz" % (base, r) for r in reads]
+
+def make_file(rnd, es, data_format, file_name):
+    return {"experimental_strategy": es, "data_format": data_format, "id": uuid(rnd), "file_name": file_name,
+        "file_size": rnd.randrange(10**6, 10**11), "md5sum": md5(rnd), "state": rnd.choice(["validated", "released", "released"])}
+
+def make_read_group(rnd, aliquot_name, k, analyte_type, n_files):
+    es = rnd.choice(DNA_STRATEGIES if analyte_type == "DNA" else RNA_STRATEGIES)
+    rg = {"submitter_id": "%s-RG%d" % (aliquot_name, k), "library_strategy": es, "experiment_name": None,
+        "target_capture_kit_target_region": None, "files": []}
+    while len(rg["files"]) < n_files:
+        if es in SAR_STRATEGIES:
+            f = make_file(rnd, es, "BAM", "%s.%s.bam" % (rg["submitter_id"], md5(rnd)[:8]))
+            harmonized = [make_file(rnd, es, "BAM", "%s.%s.gdc_realn.bam" % (f["id"], es.lower().replace(" ", "_")))]
+            f["harmonized"] = harmonized if rnd.random() < 0.8 else []
+            rg["files"].append(f)
+        elif rnd.random() < 0.1:
+            # unaligned BAM
+            f = make_file(rnd, es, "BAM", "%s_R%d.unaligned.bam" % (rg["submitter_id"], 1))
+            f["harmonized"] = []
+            rg["files"].append(f)
+        else:
+            for fn in fastq_names(rnd, rg["submitter_id"]):
+                f = make_file(rnd, es, "FASTQ", fn)
+                f["harmonized"] = []
+                rg["files"].append(f)
+            if es == "RNA-Seq" and rnd.random() < 0.8:
+                fid = rg["files"][-1]["id"]
+                rg["files"][-1]["harmonized"] = [make_file(rnd, es, "BAM", "%s.rna_seq.%s.gdc_realn.bam" % (fid, v)) for v in ("genomic", "transcriptome", "chimeric")]
+    return rg
+
+# Returns synthetic case with approximately n_files submitted files
+def make_case(case, n_files=60, seed=0):
+    rnd = random.Random("%s:%d" % (case, seed))
+    c = {"submitter_id": case, "samples": [],
+        "demographic": {"ethnicity": rnd.choice(["not hispanic or latino", "not reported"]), "gender": rnd.choice(["male", "female"]),
+            "race": rnd.choice(["white", "asian", "not reported"]), "days_to_birth": -rnd.randrange(7000, 30000)}}
+    n = 0
+    i = 0
+    while n < n_files:
+        sample = {"submitter_id": "%s-%02d" % (case, i), "id": uuid(rnd), "sample_type": rnd.choice(SAMPLE_TYPES),
+            "preservation_method": rnd.choice(["Frozen", "FFPE", None]), "aliquots": []}
+        for j in range(rnd.randint(1, 3)):
+            name = "CPT%07d%02d" % (rnd.randrange(10**7), j)
+            analyte_type = rnd.choice(["DNA", "RNA"])
+            annotations = [{"notes": rnd.choice(ANNOTATIONS)}] if rnd.random() < 0.15 else []
+            aliquot = {"submitter_id": name, "id": uuid(rnd), "analyte_type": analyte_type, "annotations": annotations,
+                "read_groups": [], "methylation": []}
+            for k in range(rnd.randint(1, 4)):
+                rg = make_read_group(rnd, name, k, analyte_type, rnd.randint(1, 4))
+                aliquot["read_groups"].append(rg)
+                n += len(rg["files"])
+            if analyte_type == "DNA" and rnd.random() < 0.3:
+                for channel in ("Red", "Green"):
+                    aliquot["methylation"].append({"submitter_id": "%s_%s" % (name, channel), "id": uuid(rnd), "channel": channel,
+                        "file_name": "%s_R0%dC01_%s.idat" % (md5(rnd)[:10], j + 1, channel[:3]), "file_size": 8095228, "data_format": "IDAT",
+                        "experimental_strategy": "Methylation Array", "md5sum": md5(rnd), "state": "released"})
+            sample["aliquots"].append(aliquot)
+        c["samples"].append(sample)
+        i += 1
+    return c
+
+# Response to sample query of get_aliquots.sh
+def sample_response(c, data_model="CPTAC"):
+    samples = []
+    for s in c["samples"]:
+        d = {k: s[k] for k in ("submitter_id", "id", "sample_type", "preservation_method")}
+        aliquots = [{k: a[k] for k in ("submitter_id", "id", "analyte_type", "annotations")} for a in s["aliquots"]]
+        if data_model == "TCGA":
+            analytes = {}
+            for a in aliquots:
+                analytes.setdefault(a.pop("analyte_type"), []).append(a)
+            d["portions"] = [{"analytes": [{"submitter_id": "%s-%s" % (s["submitter_id"], at[0]), "id": "%s-%s" % (s["id"], at[0]),
+                "analyte_type": at, "aliquots": al} for at, al in analytes.items()]}]
+        else:
+            d["aliquots"] = aliquots
+        samples.append(d)
+    return {"data": {"sample": samples}}
+
+def iter_aliquots(c):
+    for s in c["samples"]:
+        for a in s["aliquots"]:
+            yield s, a
+
+def aliquot_lines(c):
+    lines = []
+    for s, a in iter_aliquots(c):
+        annotation = ";".join(n["notes"] for n in a["annotations"])
+        lines.append("\t".join([c["submitter_id"], s["submitter_id"], s["id"], s["sample_type"], format(s["preservation_method"]),
+            a["submitter_id"], a["id"], a["analyte_type"], annotation]))
+    return lines
+
+def read_group_lines(c):
+    return [format_row([c["submitter_id"], a["submitter_id"]], rg, READ_GROUP_FIELDS) for s, a in iter_aliquots(c) for rg in a["read_groups"]]
+
+def submitted_lines(c):
+    lines = []
+    for s, a in iter_aliquots(c):
+        for rg in a["read_groups"]:
+            alignment = "submitted_aligned" if rg["library_strategy"] in SAR_STRATEGIES else "submitted_unaligned"
+            lines += [format_row([c["submitter_id"], a["submitter_id"], alignment], f, READS_FIELDS) for f in rg["files"]]
+    return sorted(set(lines))
+
+def harmonized_lines(c):
+    return [format_row([c["submitter_id"], a["submitter_id"], "harmonized"], h, READS_FIELDS)
+        for s, a in iter_aliquots(c) for rg in a["read_groups"] for f in rg["files"] for h in f["harmonized"]]
+
+def methylation_lines(c):
+    return [format_row([c["submitter_id"], a["submitter_id"], "NA"], m, METHYLATION_FIELDS) for s, a in iter_aliquots(c) for m in a["methylation"]]
+
+def write_lines(fn, lines, header=None):
+    with open(fn, 'w') as f:
+        if header is not None:
+            f.write(header + "\n")
+        for line in lines:
+            f.write(line + "\n")
+
+# Write discovery output for synthetic project to LOGBASE/outputs/CASE, and cases file CASES_FN
+# Returns list of case names
+def write_project(logbase, cases_fn, n_cases, files_per_case=60, disease="CCRCC", seed=0, responses=False):
+    cases = ["SYN-%05d" % i for i in range(n_cases)]
+    # Cases file may be written to LOGBASE, which need not exist yet
+    os.makedirs(logbase, exist_ok=True)
+    if os.path.dirname(cases_fn):
+        os.makedirs(os.path.dirname(cases_fn), exist_ok=True)
+    with open(cases_fn, 'w') as f:
+        for case in cases:
+            f.write("%s\t%s\n" % (case, disease))
+    header = "case\tsample_submitter_id\tsample_id\tsample_type\tpreservation_method\taliquot_submitter_id\taliquot_id\tanalyte_type\taliquot_annotation"
+    for case in cases:
+        c = make_case(case, files_per_case, seed)
+        outd = os.path.join(logbase, "outputs", case)
+        os.makedirs(outd, exist_ok=True)
+        write_lines(os.path.join(outd, "aliquots.dat"), aliquot_lines(c), header)
+        write_lines(os.path.join(outd, "read_groups.dat"), read_group_lines(c))
+        write_lines(os.path.join(outd, "submitted_reads.dat"), submitted_lines(c))
+        hl = harmonized_lines(c)
+        if hl:
+            write_lines(os.path.join(outd, "harmonized_reads.dat"), hl)
+        ml = methylation_lines(c)
+        if ml:
+            write_lines(os.path.join(outd, "methylation_array.dat"), ml)
+        d = c["demographic"]
+        write_lines(os.path.join(outd, "demographics.dat"), ["\t".join([case, disease, d["ethnicity"], d["gender"], d["race"], str(d["days_to_birth"])])],
+            "case\tdisease\tethnicity\tgender\trace\tdays_to_birth")
+        if responses:
+            for data_model in ("CPTAC", "TCGA"):
+                with open(os.path.join(outd, "sample_response-%s.json" % data_model), 'w') as f:
+                    json.dump(sample_response(c, data_model), f)
+    return cases
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic discovery output for a project")
+    parser.add_argument("logbase", help="Base directory; files are written to LOGBASE/outputs/CASE")
+    parser.add_argument("-C", "--cases", dest="cases_fn", required=True, help="Cases file to write")
+    parser.add_argument("-n", "--cases-count", dest="n_cases", type=int, default=10, help="Number of cases")
+    parser.add_argument("-f", "--files-per-case", dest="files_per_case", type=int, default=60, help="Approximate number of submitted files per case")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0, help="Random seed")
+    parser.add_argument("-R", "--responses", action="store_true", help="Also write CPTAC and TCGA sample query responses for each case")
+
+    args = parser.parse_args()
+    write_project(args.logbase, args.cases_fn, args.n_cases, args.files_per_case, seed=args.seed, responses=args.responses)
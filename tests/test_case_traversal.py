@@ -0,0 +1,77 @@
+import random
+import os, sys
+import pytest
+
+# Regression test of case-level traversal queries in discover_case.py
+#
+# CaseTraversalPipeline (discover_case.py -T) must write the same discovery files as the per-hop CasePipeline.
+# Both are run against mock_gdc_server.py serving synthetic cases, with queries of more than MAX_RESULTS entities
+# answered with the query timeout error, so that case-level queries are retried with smaller pages and fetched in
+# several pages.  One read group has more submitted files than per-hop queries return (see DEFAULT_FIRST in
+# case_traversal.py).  Run from the repository root:
+#   python -m pytest -q tests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import case_traversal
+import mock_gdc_server
+import synthetic_data
+from discover_case import CasePipeline, CaseTraversalPipeline
+from gdc_client import GDCClient
+
+CASES = ["SYN-00000", "SYN-00001"]
+FILES_PER_CASE = 250
+PAGE_SIZE = 400
+MAX_RESULTS = 150
+OUTPUTS = ["aliquots.dat", "read_groups.dat", "submitted_reads.dat", "harmonized_reads.dat", "methylation_array.dat"]
+
+# Synthetic graph, with a read group of DEFAULT_FIRST + 2 submitted files added to the first case
+def make_graph(data_model):
+    graph = mock_gdc_server.SyntheticGraph()
+    for i, case in enumerate(CASES):
+        c = synthetic_data.make_case(case, FILES_PER_CASE)
+        if i == 0:
+            aliquot = c["samples"][0]["aliquots"][0]
+            rg = synthetic_data.make_read_group(random.Random(case), aliquot["submitter_id"], len(aliquot["read_groups"]),
+                "DNA", case_traversal.DEFAULT_FIRST + 2)
+            aliquot["read_groups"].append(rg)
+        graph.add_case(c, data_model)
+    return graph
+
+# Run pipeline on all cases, writing discovery files to OUTD/CASE.  Returns list of pipelines
+def discover(pipeline_class, client, outd, **kwargs):
+    pipelines = []
+    for case in CASES:
+        pipeline = pipeline_class(client, case, "CCRCC", **kwargs)
+        pipeline.run()
+        os.makedirs(os.path.join(outd, case))
+        pipeline.write(os.path.join(outd, case))
+        pipelines.append(pipeline)
+    return pipelines
+
+def read_file(fn):
+    if not os.path.exists(fn):
+        return None
+    with open(fn) as f:
+        return f.read()
+
+@pytest.mark.parametrize("data_model", ["CPTAC", "TCGA"])
+def test_traversal_matches_per_hop(tmp_path, data_model):
+    mock = mock_gdc_server.MockGDC(graph=make_graph(data_model), max_results=MAX_RESULTS)
+    server = mock_gdc_server.start_server(mock)
+    try:
+        client = GDCClient("token", url="http://127.0.0.1:%d/" % server.server_port)
+        discover(CasePipeline, client, str(tmp_path / "per_hop"))
+        pipelines = discover(CaseTraversalPipeline, client, str(tmp_path / "traversal"), page_size=PAGE_SIZE)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Pages which timed out were fetched again with a smaller page size, and entity types with more entities than
+    # that were fetched in several pages
+    assert mock.stats().get("timeout", 0) > 0
+    assert max(len(v) for p in pipelines for v in p.entities.values()) > case_traversal.MIN_PAGE_SIZE
+    for case in CASES:
+        for fn in OUTPUTS:
+            expected = read_file(str(tmp_path / "per_hop" / case / fn))
+            assert read_file(str(tmp_path / "traversal" / case / fn)) == expected, (case, fn)
+        assert read_file(str(tmp_path / "per_hop" / case / "submitted_reads.dat"))
@@ -0,0 +1,70 @@
+import io
+import os, sys
+import pytest
+
+# Regression test of make_catalog2.py and cpt_hash.py
+#
+# data/catalog2 has discovery files of one case, with annotated CPT and non-CPT aliquots (the aliquots file has rows
+# of both the current and the earlier format, without preservation_method, in which make_catalog2.sh finds sample
+# IDs and annotations), FASTQ R1 / R2, RNA-Seq BAM result types and methylation arrays, and a suffix list.
+# catalog2.tsv and catalog2.suffix.tsv were written by make_catalog2.sh without and with -s, and make_catalog2.py
+# must reproduce them byte for byte.  Hash IDs are those of the reference hashids implementation.  Run from the
+# repository root:
+#   python -m pytest -q tests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_catalog2
+import cpt_hash
+
+DATAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog2")
+
+def data_fn(fn):
+    return os.path.join(DATAD, fn)
+
+def read_file(fn):
+    with open(data_fn(fn)) as f:
+        return f.read()
+
+def write_catalog2(**kwargs):
+    f = io.StringIO()
+    make_catalog2.make_catalog2(f, data_fn("aliquots.dat"), "C3L-00001", "CCRCC", submitted_fn=data_fn("submitted_reads.dat"),
+        harmonized_fn=data_fn("harmonized_reads.dat"), methyl_fn=data_fn("methylation_array.dat"), **kwargs)
+    return f.getvalue()
+
+def test_catalog2():
+    assert write_catalog2() == read_file("catalog2.tsv")
+
+def test_catalog2_suffix_list():
+    assert write_catalog2(suffix_fn=data_fn("suffix_list.dat")) == read_file("catalog2.suffix.tsv")
+
+def test_catalog2_no_header():
+    assert write_catalog2(no_header=True) == read_file("catalog2.tsv").split("\n", 1)[1]
+
+# (salt, min_length, numbers, hash ID), as given by the reference hashids implementation
+HASHIDS_VECTORS = [
+    ("", 0, (123,), "Mj3"),
+    ("", 0, (882300091,), "lR60WNr"),
+    ("", 0, (0,), "gY"),
+    ("", 0, (1, 2, 3), "o2fXhV"),
+    ("", 0, (12345678901234,), "10ApEz3gZ"),
+    ("", 8, (1,), "olejRejN"),
+    ("this is my salt", 0, (12345,), "NkK9"),
+    ("this is my salt", 0, (683, 94108, 123, 5), "aBMswoO2UB3Sj"),
+    ("MySalt", 0, (25, 46, 57), "1liJyCK1"),
+]
+
+@pytest.mark.parametrize("salt, min_length, numbers, hashid", HASHIDS_VECTORS)
+def test_hashids(salt, min_length, numbers, hashid):
+    hashids = cpt_hash.Hashids(salt=salt, min_length=min_length)
+    assert hashids.encode(*numbers) == hashid
+    assert hashids.decode(hashid) == numbers
+
+def test_hashids_invalid():
+    with pytest.raises(ValueError):
+        cpt_hash.Hashids().decode("Mj4")
+
+def test_cpt_hash():
+    hashes = cpt_hash.CPTHash()
+    assert cpt_hash.cpt_number("CPT0088230009_1") == 882300091
+    assert hashes.get_hash("CPT0088230009_1") == "lR60WNr"
+    assert hashes.get_hash("C3L-00001-03-R1") == ""
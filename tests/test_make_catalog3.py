@@ -0,0 +1,127 @@
+import json, re
+import os, sys
+import pandas as pd
+
+# Regression test of columnar data variety and metadata JSON in make_catalog3.py
+#
+# get_data_variety_FASTQ and get_metadata_json are compared with the row-wise implementations they replaced
+# (kept below as rowwise_*) on the file names and annotations of data/catalog3_file_names.tsv, which must give
+# identical values.  Run from the repository root:
+#   python -m pytest -q tests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_catalog3
+
+FILE_NAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog3_file_names.tsv")
+
+# Row-wise implementation of make_catalog3.py before vectorization
+
+def rowwise_get_read(fn):
+    match = re.search(r'_(R\d)', fn)
+    return match.group(1) if match else None
+
+def rowwise_get_lane(fn):
+    match = re.search(r'_(L\d\d\d)_', fn)
+    return match.group(1) if match else None
+
+def rowwise_get_sample_number(fn):
+    match = re.search(r'_(S\d+)_', fn)
+    return match.group(1) if match else None
+
+def rowwise_get_index(fn):
+    match = re.search(r'_(I\d)_', fn)
+    return match.group(1) if match else None
+
+def nice_append(stringA, stringB):
+    if stringA is None: return stringB
+    if stringB is None: return stringA
+    return stringA + "_" + stringB
+
+def rowwise_get_dv_string(rf_row):
+    dv = nice_append(None, rf_row['sample'])
+    dv = nice_append(dv, rf_row['lane'])
+    dv = nice_append(dv, rf_row['read'])
+    dv = nice_append(dv, rf_row['index'])
+    return dv
+
+def rowwise_get_data_variety_FASTQ(rf):
+    FQ_ix = rf['data_format']=='FASTQ'
+    BM_ix = rf['data_format']=='BAM'
+    UA_ix = rf['alignment']=='submitted_unaligned'
+
+    target_ix = FQ_ix | (BM_ix & UA_ix)
+
+    if not target_ix.empty:
+        rf.loc[target_ix, 'read'] = rf.loc[target_ix].apply(lambda row: rowwise_get_read(row['file_name']), axis=1)
+        rf.loc[target_ix, 'lane'] = rf.loc[target_ix].apply(lambda row: rowwise_get_lane(row['file_name']), axis=1)
+        rf.loc[target_ix, 'sample'] = rf.loc[target_ix].apply(lambda row: rowwise_get_sample_number(row['file_name']), axis=1)
+        rf.loc[target_ix, 'index'] = rf.loc[target_ix].apply(lambda row: rowwise_get_index(row['file_name']), axis=1)
+        rf.loc[target_ix, 'data_variety'] = rf.loc[target_ix].apply(lambda row: rowwise_get_dv_string(row), axis=1)
+
+def append_safely(d, row, key):
+    if key not in row.keys():
+        return d
+    v = row[key]
+    if v == "":
+        return d
+    if v == None:
+        return d
+    if pd.isnull(v):
+        return d
+    d[key] = row[key]
+    return d
+
+def rowwise_get_metadata_json(row):
+    md = {}
+    for key in ['aliquot_tag', 'aliquot_annotation', 'sample', 'lane', 'read', 'index', 'gdc_sample_type', 'state', 'preservation_method']:
+        md = append_safely(md, row, key)
+    return json.dumps(md)
+
+# Missing values are None in the row-wise implementation and NaN in the columnar one; both are written as missing
+def as_values(s):
+    return [None if pd.isna(v) else v for v in s.astype(object)]
+
+def read_file_names():
+    return pd.read_csv(FILE_NAMES, sep="\t", dtype=str, keep_default_na=False, encoding="utf8")
+
+def with_data_variety(get_data_variety_FASTQ):
+    rf = read_file_names()
+    rf['data_variety'] = ""
+    make_catalog3.get_data_variety_RNA_BAM(rf)
+    get_data_variety_FASTQ(rf)
+    return rf
+
+# Catalog data with the columns of metadata JSON, with missing and empty values as in catalog generation
+def catalog_data(rf):
+    cd = rf.copy()
+    cd['aliquot_annotation'] = cd['aliquot_annotation'].replace("", float('nan'))
+    cd['aliquot_tag'] = ["ANN_{:x}".format(i) if a == a else "ALQ_{:x}".format(i) for i, a in enumerate(cd['aliquot_annotation'])]
+    cd['gdc_sample_type'] = "Primary Tumor"
+    cd['preservation_method'] = ["", "FFPE", None, "Snap Frozen"] * (len(cd) // 4) + [""] * (len(cd) % 4)
+    return cd
+
+def test_data_variety_FASTQ():
+    expected = with_data_variety(rowwise_get_data_variety_FASTQ)
+    observed = with_data_variety(make_catalog3.get_data_variety_FASTQ)
+    for col in ['read', 'lane', 'sample', 'index', 'data_variety']:
+        assert as_values(observed[col]) == as_values(expected[col]), col
+
+def test_data_variety_FASTQ_values():
+    rf = with_data_variety(make_catalog3.get_data_variety_FASTQ).set_index('file_name')
+    assert rf.loc["170802_UNC31-K00269_0072_AHK3GVBBXX_ACAGTG_S19_L005_R2_001.fastq.gz", 'data_variety'] == "S19_L005_R2"
+    assert rf.loc["DLBCL11282_4198_RNAseq_R1.fastq.gz", 'data_variety'] == "R1"
+    assert rf.loc["sample_S1_L002_I1_001.fastq.gz", 'data_variety'] == "S1_L002_I1"
+    assert rf.loc["2f2b1c2e-0d4c-4a10-8b0f-0d3b4a6d9f7e.rna_seq.chimeric.gdc_realn.bam", 'data_variety'] == "chimeric"
+    assert pd.isna(rf.loc["reads.fastq.gz", 'data_variety'])
+
+def test_metadata_json():
+    expected = catalog_data(with_data_variety(rowwise_get_data_variety_FASTQ))
+    observed = catalog_data(with_data_variety(make_catalog3.get_data_variety_FASTQ))
+    assert make_catalog3.get_metadata_json(observed).tolist() == expected.apply(rowwise_get_metadata_json, axis=1).tolist()
+
+# Catalog data is read with categorical columns
+def test_metadata_json_categorical():
+    expected = catalog_data(with_data_variety(rowwise_get_data_variety_FASTQ))
+    observed = make_catalog3.to_categorical(catalog_data(with_data_variety(make_catalog3.get_data_variety_FASTQ)),
+        ['state', 'gdc_sample_type', 'preservation_method'])
+    assert make_catalog3.get_metadata_json(observed).tolist() == expected.apply(rowwise_get_metadata_json, axis=1).tolist()